@@ -88,6 +88,12 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Europe/Moscow'
 
+# --- Выдача Avito (SERP) ---
+# Сколько секунд одна загруженная выдача обслуживает все задачи с этим search_url
+SERP_CACHE_TTL = 240
+# Каталог для записи сырых страниц выдачи (корпус для manage.py benchmark_serp_parser)
+SERP_RECORD_DIR = None
+
 #CELERY_BEAT_SCHEDULE = {
 #    'run-all-bidders-every-5-minutes': {
 #        'task': 'main_app.tasks.trigger_all_active_tasks',
@@ -96,9 +102,117 @@ CELERY_TIMEZONE = 'Europe/Moscow'
 #}
 
 
+# --- Планировщик биддера (main_app/scheduler.py) ---
+SCHEDULER_TICK_SECONDS = 15
+SCHEDULER_BATCH_SIZE = 500
+SCHEDULER_DISPATCH_RATE = 20   # задач в секунду
+SCHEDULER_LEASE_SECONDS = 900  # через сколько потерянный цикл запустится снова
+TASK_MIN_RUN_INTERVAL = 120    # цикл одной задачи не чаще, сек
+# Вне расписания задачи спят до открытия окна; на общей границе (09:00)
+# просыпаются в пределах SCHEDULE_RAMP_SECONDS, а не одним тиком
+SCHEDULE_RAMP_SECONDS = 120
+
+# Цикл по аккаунту: параллельных запросов ставок и максимум задач за запуск
+ACCOUNT_CYCLE_CONCURRENCY = 8
+ACCOUNT_CYCLE_MAX_TASKS = 200
+
+# Пул прокси выдачи (main_app/proxy_pool.py). Сам список — модель ProxyServer
+# в админке; PROXY_POOL — запасной вариант, если в БД нет активных прокси:
+# [{'user', 'pass', 'host', 'port', 'change_ip_url', 'rpm_limit'}, ...]
+PROXY_POOL = []
+PROXY_POOL_RELOAD_SECONDS = 10
+PROXY_STATS_WINDOW_MINUTES = 5
+PROXY_DEFAULT_RPM = 20
+PROXY_COOLDOWN_SECONDS = 60
+PROXY_COOLDOWN_MAX = 900
+PROXY_WAIT_SECONDS = 10
+# Смена IP: не чаще раза в минуту на прокси, до 20 сек ждём текущие запросы
+ROTATION_MIN_INTERVAL = 60
+ROTATION_DRAIN_TIMEOUT = 20
+
+# Ограничитель запросов к api.avito.ru (main_app/ratelimit.py): стартовая
+# скорость аккаунта, пределы AIMD (запросов/сек), запас и потолок кластера.
+# Можно переопределить любое семейство: token, core, cpxpromo
+AVITO_RATE_LIMITS = {}
+AIMD_INCREASE = 0.1
+AIMD_DECREASE = 0.5
+RATE_LIMIT_MAX_WAIT = 30
+
+# План мощности прокси (main_app/capacity.py): как часто пересчитывать,
+# какую долю устойчивой скорости прокси занимать, самый длинный интервал выдачи
+CAPACITY_PLAN_SECONDS = 60
+CAPACITY_HEADROOM = 0.85
+CAPACITY_MAX_INTERVAL = 3600
+
+# Пулы keep-alive соединений синхронного клиента (main_app/http_client.py)
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = 32
+HTTP_API_RETRIES = 2
+HTTP_API_BACKOFF = 0.5
+
+# Пауза между циклами задачи (main_app/bidding.py): после смены ставки и при
+# скачках позиции — короче, до минимума; пока всё спокойно — длиннее, до максимума.
+# Минимум по умолчанию — TASK_MIN_RUN_INTERVAL / (1 - разброс), меньше не ставится
+BID_POLL_MAX_SECONDS = 1800
+BID_POLL_BACKOFF = 1.5
+BID_POLL_VOLATILE_POSITIONS = 3
+
+# Кэш ставок (main_app/bid_state.py): через сколько секунд сверять ставку с getBids
+BID_RECONCILE_SECONDS = 1800
+
+# Движок ввода-вывода биддера: 'threads' (run_account_cycle) или 'async'
+# (run_async_cycle — httpx/HTTP-2, пачка аккаунтов в одном цикле событий)
+BIDDER_IO_ENGINE = 'threads'
+ASYNC_CYCLE_MAX_TASKS = 2000
+ASYNC_MAX_CONNECTIONS = 100
+ASYNC_ACCOUNT_CONCURRENCY = 16
+ASYNC_PROXY_CONCURRENCY = 2
+
+# Индекс объявлений аккаунта (main_app/item_index.py): через сколько секунд
+# обновлять в фоне, сколько хранить, сколько страниц каталога грузить параллельно
+ITEM_INDEX_STALE_SECONDS = 600
+ITEM_INDEX_TTL = 24 * 3600
+ITEM_INDEX_CONCURRENCY = 4
+
+# Балансы аккаунтов: фоновое обновление и параллельность обновления по кнопке
+BALANCE_REFRESH_SECONDS = 600
+BALANCE_REFRESH_CONCURRENCY = 8
+
+# Буфер логов задач (main_app/log_sink.py): вставка пачкой по размеру или по времени
+LOG_SINK_BATCH_SIZE = 500
+LOG_SINK_FLUSH_SECONDS = 5
+
+# Логи задач (main_app/log_storage.py): сколько дней хранить записи (итоги
+# по дням остаются), на сколько дней вперёд готовить секции, как часто обслуживать
+TASK_LOG_RETENTION_DAYS = 30
+TASK_LOG_PARTITION_PREMAKE_DAYS = 3
+TASK_LOG_MAINTENANCE_SECONDS = 3600
+
+# Модели выдачи «ставка → позиция» (main_app/price_model.py): окно наблюдений,
+# минимум наблюдений на модель, как часто подгонять и обновлять прогнозы
+PRICE_MODEL_WINDOW_DAYS = 28
+PRICE_MODEL_MIN_SAMPLES = 12
+PRICE_MODEL_REFRESH_SECONDS = 900
+
 CELERY_BEAT_SCHEDULE = {
-    'revive-stale-tasks': {
-        'task': 'main_app.tasks.revive_stale_tasks',
-        'schedule': 300.0,  # каждые 5 минут
+    'dispatch-due-tasks': {
+        'task': 'main_app.tasks.dispatch_due_tasks',
+        'schedule': float(SCHEDULER_TICK_SECONDS),
+    },
+    'refresh-balances': {
+        'task': 'main_app.tasks.refresh_balances',
+        'schedule': float(BALANCE_REFRESH_SECONDS),
+    },
+    'maintain-task-logs': {
+        'task': 'main_app.tasks.maintain_task_logs_task',
+        'schedule': float(TASK_LOG_MAINTENANCE_SECONDS),
+    },
+    'plan-scrape-capacity': {
+        'task': 'main_app.tasks.plan_capacity_task',
+        'schedule': float(CAPACITY_PLAN_SECONDS),
+    },
+    'refresh-price-models': {
+        'task': 'main_app.tasks.refresh_price_models_task',
+        'schedule': float(PRICE_MODEL_REFRESH_SECONDS),
     },
 }
\ No newline at end of file
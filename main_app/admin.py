@@ -1,7 +1,7 @@
 # core/admin.py
 
 from django.contrib import admin
-from .models import BiddingTask
+from .models import BiddingTask, ProxyServer
 
 @admin.register(BiddingTask)
 class BiddingTaskAdmin(admin.ModelAdmin):
@@ -19,3 +19,14 @@ class BiddingTaskAdmin(admin.ModelAdmin):
 
     # Поля, которые будут ссылками на страницу редактирования
     list_display_links = ('id', 'ad_id')
+
+
+@admin.register(ProxyServer)
+class ProxyServerAdmin(admin.ModelAdmin):
+    """
+    Пул прокси для загрузки выдачи. Воркеры перечитывают его сами
+    (см. main_app.proxy_pool) — перезапуск не нужен.
+    """
+    list_display = ('port', 'host', 'user', 'rpm_limit', 'is_active')
+    list_filter = ('is_active',)
+    list_editable = ('rpm_limit', 'is_active')
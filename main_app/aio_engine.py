@@ -0,0 +1,268 @@
+# main_app/aio_engine.py
+"""
+Асинхронный движок ввода-вывода: сотни одновременных запросов ставок,
+карточек объявлений и загрузок выдачи в одном процессе.
+
+Один пул HTTP/2-соединений к api.avito.ru, отдельный keep-alive клиент на
+каждый прокси, семафоры на аккаунт и на порт прокси. Работа с БД остаётся
+синхронной — до и после asyncio.run; внутри цикла событий только HTTP.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Union, Dict, List, Tuple
+
+import httpx
+from django.conf import settings
+
+from .avito_api import (
+    GET_BIDS_URL_TPL,
+    SET_MANUAL_BID_URL,
+    ITEM_INFO_URL_TPL,
+    build_bid_body,
+    invalidate_access_token,
+    parse_bid_price,
+    parse_item_info,
+)
+from . import bid_state, ratelimit
+from .bidding import needs_current_price, plan_bid, plan_out_of_schedule, finish_plan
+from .proxy_pool import choose_proxy, end_request, proxy_url
+from .serp import (
+    SERP_MAX_ATTEMPTS, handle_network_error, handle_response, no_proxy_result,
+    request_headers,
+)
+
+logger = logging.getLogger(__name__)
+
+ASYNC_MAX_CONNECTIONS = getattr(settings, 'ASYNC_MAX_CONNECTIONS', 100)
+# Одновременных запросов к API на один аккаунт
+ASYNC_ACCOUNT_CONCURRENCY = getattr(settings, 'ASYNC_ACCOUNT_CONCURRENCY', 16)
+# Одновременных загрузок выдачи через один порт прокси
+ASYNC_PROXY_CONCURRENCY = getattr(settings, 'ASYNC_PROXY_CONCURRENCY', 2)
+
+
+class AvitoAsyncEngine:
+    """
+    Использование: async with AvitoAsyncEngine() as engine: ...
+    Создаётся внутри работающего цикла событий.
+    """
+
+    def __init__(self):
+        self._api = None
+        self._proxy_clients = {}
+        self._account_limits = defaultdict(
+            lambda: asyncio.Semaphore(ASYNC_ACCOUNT_CONCURRENCY)
+        )
+        self._proxy_limits = defaultdict(
+            lambda: asyncio.Semaphore(ASYNC_PROXY_CONCURRENCY)
+        )
+
+    async def __aenter__(self):
+        self._api = httpx.AsyncClient(
+            http2=True,
+            timeout=15,
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_MAX_CONNECTIONS,
+            ),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._api.aclose()
+        for client in self._proxy_clients.values():
+            await client.aclose()
+        self._proxy_clients.clear()
+
+    # ---------------------------------------------------------
+    # API Avito
+    # ---------------------------------------------------------
+
+    async def _throttle(self, family: str, account: str) -> bool:
+        """Ждёт очереди в общем ограничителе (ratelimit) без блокировки цикла."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + ratelimit.RATE_LIMIT_MAX_WAIT
+        while True:
+            wait = await loop.run_in_executor(None, ratelimit.reserve, family, account)
+            if wait <= 0:
+                return True
+            if loop.time() + wait > deadline:
+                logger.warning(f"[RATE] {family}: очередь дольше {ratelimit.RATE_LIMIT_MAX_WAIT} сек")
+                return False
+            await asyncio.sleep(wait)
+
+    async def _api_call(self, account_key, method: str, url: str,
+                        access_token: str, **kwargs) -> Union[httpx.Response, None]:
+        headers = {'Authorization': f'Bearer {access_token}'}
+        loop = asyncio.get_running_loop()
+        family = ratelimit.family_for(url)
+        account = await loop.run_in_executor(None, ratelimit.account_for_token, access_token)
+        async with self._account_limits[account_key]:
+            if not await self._throttle(family, account):
+                return None
+            try:
+                response = await self._api.request(method, url, headers=headers, **kwargs)
+            except httpx.HTTPError as e:
+                logger.error(f"[ASYNC] {method} {url}: {e}")
+                return None
+        await loop.run_in_executor(
+            None, ratelimit.record_response, family, account,
+            response.status_code, response.headers,
+        )
+        if response.status_code == 401:
+            await loop.run_in_executor(None, invalidate_access_token, access_token)
+        return response
+
+    async def get_bid(self, account_key, ad_id: int,
+                      access_token: str) -> Union[float, None]:
+        """Ставка из кэша (bid_state) или из getBids."""
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, bid_state.cached_bid, ad_id)
+        if cached is not None:
+            return cached
+        url = GET_BIDS_URL_TPL.format(item_id=ad_id)
+        for attempt in range(2):
+            response = await self._api_call(account_key, 'GET', url, access_token)
+            if response is not None:
+                if response.status_code == 401:
+                    return None
+                if response.status_code == 200:
+                    price = parse_bid_price(response.json())
+                    if price is not None:
+                        await loop.run_in_executor(None, bid_state.remember_bid, ad_id, price)
+                    return price
+                logger.error(f"[STAVKA] Статус {response.status_code} для {ad_id}")
+        return None
+
+    async def set_bid(self, account_key, ad_id: int, new_price: float,
+                      access_token: str, daily_limit_rub: float = None) -> bool:
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, bid_state.is_same_bid, ad_id, new_price, daily_limit_rub):
+            logger.info(f"[SET] {ad_id}: ставка {new_price} ₽ уже стоит — пропуск")
+            return True
+        body = build_bid_body(ad_id, new_price, daily_limit_rub)
+        logger.info(f"[SET] Ставка {new_price} ₽ для {ad_id}")
+        response = await self._api_call(
+            account_key, 'POST', SET_MANUAL_BID_URL, access_token, json=body
+        )
+        if response is None or response.status_code >= 400:
+            status = response.status_code if response is not None else '—'
+            logger.error(f"[SET] Ошибка {status} для {ad_id}")
+            await loop.run_in_executor(None, bid_state.forget_bid, ad_id)
+            return False
+        await loop.run_in_executor(None, bid_state.remember_bid, ad_id, new_price, daily_limit_rub)
+        return True
+
+    async def get_item_info(self, account_key, access_token: str, user_id: int,
+                            item_id: int) -> Union[Dict, None]:
+        url = ITEM_INFO_URL_TPL.format(user_id=user_id, item_id=item_id)
+        response = await self._api_call(account_key, 'GET', url, access_token)
+        if response is None or response.status_code != 200:
+            return None
+        return parse_item_info(response.json())
+
+    # ---------------------------------------------------------
+    # Выдача через прокси
+    # ---------------------------------------------------------
+
+    def _proxy_client(self, proxy_url: str, port: int) -> httpx.AsyncClient:
+        client = self._proxy_clients.get(port)
+        if client is None:
+            client = httpx.AsyncClient(
+                proxy=proxy_url, http2=True, timeout=30, follow_redirects=True
+            )
+            self._proxy_clients[port] = client
+        return client
+
+    async def fetch_serp(self, search_url: str, attempt: int = 0,
+                         exclude_port: int = None) -> Dict:
+        """Асинхронный аналог serp.fetch_attempt — одна попытка."""
+        loop = asyncio.get_running_loop()
+        # Выбор прокси ходит в Redis — вне цикла событий
+        proxy_used = await loop.run_in_executor(None, choose_proxy, exclude_port)
+        if proxy_used is None:
+            return await loop.run_in_executor(None, no_proxy_result, exclude_port)
+        port = proxy_used['port']
+        client = self._proxy_client(proxy_url(proxy_used), port)
+
+        async with self._proxy_limits[port]:
+            try:
+                logger.info(f"[PARSER] Попытка {attempt+1}/{SERP_MAX_ATTEMPTS} порт {port} (async)")
+                started = loop.time()
+                response = await client.get(search_url, headers=request_headers(attempt))
+                latency = loop.time() - started
+            except httpx.HTTPError as e:
+                await loop.run_in_executor(None, end_request, proxy_used)
+                return await loop.run_in_executor(
+                    None, handle_network_error, proxy_used, attempt, e
+                )
+        await loop.run_in_executor(None, end_request, proxy_used)
+
+        # Разбор и возможная смена IP — вне цикла событий
+        return await loop.run_in_executor(
+            None, handle_response, search_url, response.status_code,
+            response.content, proxy_used, attempt, latency
+        )
+
+    # ---------------------------------------------------------
+    # Цикл биддера
+    # ---------------------------------------------------------
+
+    async def bid_job(self, account_key, task, ad_data: Union[Dict, None],
+                      in_schedule: bool, access_token: str) -> list:
+        """Асинхронный аналог tasks._bid_job."""
+        current_price = None
+        if not in_schedule or needs_current_price(ad_data):
+            current_price = await self.get_bid(account_key, task.ad_id, access_token)
+
+        if in_schedule:
+            plan = plan_bid(task, ad_data, current_price)
+        else:
+            plan = plan_out_of_schedule(task, current_price)
+
+        written = False
+        if plan['price'] is not None:
+            written = await self.set_bid(
+                account_key, task.ad_id, plan['price'], access_token,
+                daily_limit_rub=float(task.daily_budget)
+            )
+        return finish_plan(task, plan, written)
+
+
+async def run_cycles(cycles: List[Dict], serp_fetches: List[Tuple[str, str]]) -> Dict:
+    """
+    Все задачи из подготовленных циклов (tasks._prepare_cycle) и все
+    загрузки выдачи — в одном цикле событий. Исключения возвращаются
+    как результаты, чтобы одна ошибка не валила всю пачку.
+    """
+    async with AvitoAsyncEngine() as engine:
+        bid_jobs = [
+            engine.bid_job(cycle['account_key'], task, ad_data, in_schedule, cycle['token'])
+            for cycle in cycles
+            for task, ad_data, in_schedule in cycle['jobs']
+        ]
+        serp_jobs = [engine.fetch_serp(url) for url, _ in serp_fetches]
+        results = await asyncio.gather(*bid_jobs, *serp_jobs, return_exceptions=True)
+
+    return {
+        'bids': results[:len(bid_jobs)],
+        'serp': results[len(bid_jobs):],
+    }
+
+
+async def _fetch_item_infos(requests_list: List[Tuple]) -> List:
+    async with AvitoAsyncEngine() as engine:
+        return await asyncio.gather(
+            *(engine.get_item_info(account_key, token, user_id, item_id)
+              for account_key, token, user_id, item_id in requests_list),
+            return_exceptions=True,
+        )
+
+
+def fetch_item_infos(requests_list: List[Tuple]) -> List:
+    """
+    Синхронная обёртка для management-команд:
+    [(account_key, token, user_id, item_id), ...] -> [info | None | Exception, ...]
+    """
+    return asyncio.run(_fetch_item_infos(requests_list))
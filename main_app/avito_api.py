@@ -2,76 +2,46 @@
 
 import requests
 import logging
-import random
 import time
+import json
+import threading
 from typing import Union, Dict, List
 import redis
 
-logger = logging.getLogger(__name__)
+from .redis_client import (
+    redis_client as _redis, acquire_lock, release_lock, is_locked, key_hash as _hash,
+)
+from .http_client import avito_http
+from .ratelimit import account_for_token
 
-# Redis для синхронизации между воркерами
-_redis = redis.Redis(host='localhost', port=6379, db=1)
+logger = logging.getLogger(__name__)
 
 
 # =============================================================
-# ПРОКСИ-ПУЛ (мобильные)
+# ПРОКСИ (список и выбор — main_app/proxy_pool.py)
 # =============================================================
 
-PROXY_POOL = [
-    {
-        'user': 'uKuNaf',
-        'pass': 'FAjEC5HeK7yt',
-        'host': 'mproxy.site',
-        'port': 17563,
-        'change_ip_url': 'https://changeip.mobileproxy.space/?proxy_key=65a15a75eb565bba6e220d15559005e3'
-    },
-    {
-        'user': 'vuU1DY',
-        'pass': 'apsYVEZRaY7c',
-        'host': 'mproxy.site',
-        'port': 11289,
-        'change_ip_url': 'https://changeip.mobileproxy.space/?proxy_key=7db42d70377c063ba427f4487f63aa6f'
-    },
-]
-
-# Время последней ротации для каждого прокси
-_last_rotation = {}
-
-
-def get_random_proxy(exclude_port=None) -> tuple:
-    """Возвращает (proxies_dict, proxy_info). Можно исключить порт."""
-    available = [p for p in PROXY_POOL if p['port'] != exclude_port]
-    if not available:
-        available = PROXY_POOL
-    proxy = random.choice(available)
-    return {
-        'http': f'http://{proxy["user"]}:{proxy["pass"]}@{proxy["host"]}:{proxy["port"]}',
-        'https': f'http://{proxy["user"]}:{proxy["pass"]}@{proxy["host"]}:{proxy["port"]}',
-    }, proxy
-
-
 def rotate_proxy_ip(proxy: Dict):
-    """Смена IP — не чаще 1 раза в 60 сек. Синхронизация через Redis."""
+    """
+    Смена IP через change_ip_url. Напрямую не вызывать: смену выполняет
+    одна задача rotate_proxy под арендой (proxy_pool.request_rotation).
+    """
     port = proxy['port']
     redis_key = f'proxy_rotation:{port}'
     now = time.time()
 
-    # Проверяем в Redis — общем для всех воркеров
-    last = _redis.get(redis_key)
-    if last and now - float(last) < 60:
-        logger.info(f"[PROXY] Порт {port} — ротация была {int(now - float(last))} сек назад, пропуск")
-        return
-
     try:
         url = proxy['change_ip_url']
         if '&format=json' not in url:
             url += '&format=json'
 
         logger.info(f"[PROXY] Смена IP для порта {port}...")
-        response = requests.get(url, timeout=10)
+        response = avito_http.get(url, timeout=10)
         
         # Сохраняем время в Redis
         _redis.set(redis_key, now, ex=300)
+        # Keep-alive соединения через старый IP больше не годятся
+        avito_http.drop_proxy_session(port)
 
         try:
             data = response.json()
@@ -79,8 +49,6 @@ def rotate_proxy_ip(proxy: Dict):
             logger.info(f"[PROXY] ✅ Новый IP: {new_ip}")
         except:
             logger.info(f"[PROXY] Ответ: {response.text[:100]}")
-
-        time.sleep(8)
     except Exception as e:
         logger.error(f"[PROXY] Ошибка смены IP: {e}")
 
@@ -102,7 +70,42 @@ ITEM_INFO_URL_TPL = 'https://api.avito.ru/core/v1/accounts/{user_id}/items/{item
 # ТОКЕН
 # =============================================================
 
-def get_avito_access_token(client_id: str, client_secret: str) -> Union[str, None]:
+# Токен считаем протухшим за TOKEN_EXPIRY_MARGIN сек до конца expires_in,
+# а фоновое обновление начинаем за TOKEN_REFRESH_AHEAD сек до этого.
+TOKEN_EXPIRY_MARGIN = 60
+TOKEN_REFRESH_AHEAD = 600
+TOKEN_DEFAULT_EXPIRES_IN = 3600
+TOKEN_LOCK_TTL = 20
+TOKEN_WAIT_TIMEOUT = 10
+
+
+def _token_cache_key(client_id: str) -> str:
+    return f'avito_token:{_hash(client_id)}'
+
+
+def _token_owner_key(access_token: str) -> str:
+    return f'avito_token_owner:{_hash(access_token)}'
+
+
+def _read_cached_token(cache_key: str) -> Union[Dict, None]:
+    try:
+        raw = _redis.get(cache_key)
+    except redis.RedisError as e:
+        logger.warning(f"[TOKEN] Кэш недоступен: {e}")
+        return None
+    if not raw:
+        return None
+    try:
+        cached = json.loads(raw)
+    except ValueError:
+        return None
+    if cached.get('expires_at', 0) <= time.time():
+        return None
+    return cached
+
+
+def _request_access_token(client_id: str, client_secret: str) -> Union[Dict, None]:
+    """Запрос нового токена у Avito. Возвращает сырой ответ или None."""
     headers = {
         'Content-Type': 'application/x-www-form-urlencoded',
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
@@ -114,13 +117,12 @@ def get_avito_access_token(client_id: str, client_secret: str) -> Union[str, Non
     }
     try:
         logger.info(f"[TOKEN] Запрос для client_id: {client_id[:8]}...")
-        response = requests.post(TOKEN_URL, headers=headers, data=data, timeout=15)
+        response = avito_http.post(TOKEN_URL, headers=headers, data=data, timeout=15)
         response.raise_for_status()
         token_data = response.json()
-        access_token = token_data.get('access_token')
-        if access_token:
+        if token_data.get('access_token'):
             logger.info("[TOKEN] Успех")
-            return access_token
+            return token_data
         logger.error(f"[TOKEN] access_token не найден: {token_data}")
         return None
     except requests.exceptions.RequestException as e:
@@ -128,14 +130,151 @@ def get_avito_access_token(client_id: str, client_secret: str) -> Union[str, Non
         return None
 
 
+def _fetch_and_cache_token(cache_key: str, client_id: str,
+                           client_secret: str) -> Union[str, None]:
+    token_data = _request_access_token(client_id, client_secret)
+    if not token_data:
+        return None
+
+    access_token = token_data['access_token']
+    try:
+        expires_in = int(token_data.get('expires_in') or TOKEN_DEFAULT_EXPIRES_IN)
+    except (TypeError, ValueError):
+        expires_in = TOKEN_DEFAULT_EXPIRES_IN
+    ttl = expires_in - TOKEN_EXPIRY_MARGIN
+    if ttl <= 0:
+        return access_token
+
+    payload = json.dumps({
+        'access_token': access_token,
+        'expires_at': time.time() + ttl,
+    })
+    try:
+        pipe = _redis.pipeline()
+        pipe.set(cache_key, payload, ex=ttl)
+        # Обратная ссылка токен -> аккаунт, чтобы сбросить кэш по 401
+        pipe.set(_token_owner_key(access_token), cache_key, ex=ttl)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"[TOKEN] Не удалось сохранить в кэш: {e}")
+    return access_token
+
+
+def _refresh_token_in_background(cache_key: str, client_id: str, client_secret: str):
+    """Заранее обновляет токен в отдельном потоке — только один процесс на аккаунт."""
+    lock_key = f'{cache_key}:lock'
+    lock = acquire_lock(lock_key, TOKEN_LOCK_TTL)
+    if not lock:
+        return
+
+    def _refresh():
+        try:
+            _fetch_and_cache_token(cache_key, client_id, client_secret)
+        finally:
+            release_lock(lock_key, lock)
+
+    logger.info(f"[TOKEN] Фоновое обновление для client_id: {client_id[:8]}...")
+    threading.Thread(target=_refresh, daemon=True).start()
+
+
+def get_avito_access_token(client_id: str, client_secret: str) -> Union[str, None]:
+    """
+    Токен client_credentials из общего кэша в Redis.
+    Живёт expires_in, обновляется заранее в фоне; запрашивает новый токен
+    только один процесс на аккаунт, остальные ждут его результата
+    (не дождались за TOKEN_WAIT_TIMEOUT — None).
+    """
+    cache_key = _token_cache_key(client_id)
+
+    cached = _read_cached_token(cache_key)
+    if cached:
+        if cached['expires_at'] - time.time() < TOKEN_REFRESH_AHEAD:
+            _refresh_token_in_background(cache_key, client_id, client_secret)
+        return cached['access_token']
+
+    lock_key = f'{cache_key}:lock'
+    lock = acquire_lock(lock_key, TOKEN_LOCK_TTL)
+    if lock:
+        return _fetch_under_lock(cache_key, lock_key, lock, client_id, client_secret)
+
+    # Токен уже запрашивает другой процесс — ждём его результат. Если он
+    # отпустил блокировку без токена, запрашивает тот один, кто взял её снова
+    deadline = time.time() + TOKEN_WAIT_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(0.2)
+        cached = _read_cached_token(cache_key)
+        if cached:
+            return cached['access_token']
+        if is_locked(lock_key):
+            continue
+        lock = acquire_lock(lock_key, TOKEN_LOCK_TTL)
+        if lock:
+            return _fetch_under_lock(cache_key, lock_key, lock, client_id, client_secret)
+        if not is_locked(lock_key):
+            # Блокировку не взять, хотя её нет, — Redis недоступен, общего кэша нет
+            cached = _read_cached_token(cache_key)
+            if cached:
+                return cached['access_token']
+            return _fetch_and_cache_token(cache_key, client_id, client_secret)
+
+    # Держатель блокировки ещё запрашивает токен — не устраиваем лавину
+    # запросов, цикл задачи повторится позже
+    logger.warning(f"[TOKEN] Не дождались токена для client_id: {client_id[:8]}...")
+    return None
+
+
+def _fetch_under_lock(cache_key: str, lock_key: str, lock: str,
+                      client_id: str, client_secret: str) -> Union[str, None]:
+    try:
+        # Пока брали блокировку, токен мог положить предыдущий держатель
+        cached = _read_cached_token(cache_key)
+        if cached:
+            return cached['access_token']
+        return _fetch_and_cache_token(cache_key, client_id, client_secret)
+    finally:
+        release_lock(lock_key, lock)
+
+
+def invalidate_access_token(access_token: str):
+    """Выбрасывает токен из кэша (например, после 401)."""
+    if not access_token:
+        return
+    owner_key = _token_owner_key(access_token)
+    try:
+        cache_key = _redis.get(owner_key)
+        if cache_key:
+            cache_key = cache_key.decode()
+            cached = _read_cached_token(cache_key)
+            if cached and cached.get('access_token') == access_token:
+                _redis.delete(cache_key)
+        _redis.delete(owner_key)
+        logger.warning("[TOKEN] Токен сброшен из кэша (401)")
+    except redis.RedisError as e:
+        logger.warning(f"[TOKEN] Не удалось сбросить токен: {e}")
+
+
+def _check_auth(response: requests.Response, access_token: str):
+    if response.status_code == 401:
+        invalidate_access_token(access_token)
+
+
 # =============================================================
 # USER ID
 # =============================================================
 
-def get_avito_user_id(access_token: str) -> Union[int, None]:
+# ID пользователя не меняется, пока не сменились ключи аккаунта
+USER_ID_CACHE_TTL = 7 * 24 * 3600
+
+
+def _user_id_cache_key(account_key: str) -> str:
+    return f'avito_user_id:{account_key}'
+
+
+def _request_user_id(access_token: str) -> Union[int, None]:
     headers = {'Authorization': f'Bearer {access_token}'}
     try:
-        response = requests.get(USER_INFO_URL, headers=headers, timeout=10)
+        response = avito_http.get(USER_INFO_URL, headers=headers, timeout=10)
+        _check_auth(response, access_token)
         response.raise_for_status()
         user_id = response.json().get('id')
         if user_id:
@@ -147,6 +286,48 @@ def get_avito_user_id(access_token: str) -> Union[int, None]:
         return None
 
 
+def get_avito_user_id(access_token: str) -> Union[int, None]:
+    """
+    ID пользователя из общего кэша (ключ — аккаунт владельца токена);
+    /accounts/self запрашивается только при промахе.
+    """
+    cache_key = _user_id_cache_key(account_for_token(access_token))
+    try:
+        cached = _redis.get(cache_key)
+    except redis.RedisError:
+        cached = None
+    if cached:
+        return int(cached)
+
+    user_id = _request_user_id(access_token)
+    if user_id:
+        try:
+            _redis.set(cache_key, user_id, ex=USER_ID_CACHE_TTL)
+        except redis.RedisError:
+            pass
+    return user_id
+
+
+def get_account_user_id(account, access_token: str) -> Union[int, None]:
+    """ID пользователя для AvitoAccount: из поля avito_user_id или один запрос с сохранением."""
+    if account.avito_user_id:
+        return account.avito_user_id
+    user_id = get_avito_user_id(access_token)
+    if user_id:
+        account.avito_user_id = user_id
+        type(account).objects.filter(pk=account.pk).update(avito_user_id=user_id)
+    return user_id
+
+
+def forget_account_credentials(client_id: str):
+    """Сбрасывает кэш токена и ID пользователя — ключи аккаунта сменились."""
+    account_key = _hash(client_id)
+    try:
+        _redis.delete(_token_cache_key(client_id), _user_id_cache_key(account_key))
+    except redis.RedisError as e:
+        logger.warning(f"[USER] Не удалось сбросить кэш аккаунта: {e}")
+
+
 # =============================================================
 # БАЛАНС
 # =============================================================
@@ -157,7 +338,8 @@ def get_balances(access_token: str, user_id: int) -> Dict:
 
     try:
         url = CORE_BALANCE_URL_TPL.format(user_id=user_id)
-        resp = requests.get(url, headers=headers, timeout=10)
+        resp = avito_http.get(url, headers=headers, timeout=10)
+        _check_auth(resp, access_token)
         resp.raise_for_status()
         result['real'] = resp.json().get('real', 0)
     except Exception as e:
@@ -165,7 +347,8 @@ def get_balances(access_token: str, user_id: int) -> Dict:
 
     try:
         cpa_headers = {**headers, 'X-Source': 'AvitoBidder'}
-        resp = requests.post(CPA_BALANCE_URL, headers=cpa_headers, json={}, timeout=10)
+        resp = avito_http.post(CPA_BALANCE_URL, headers=cpa_headers, json={}, timeout=10)
+        _check_auth(resp, access_token)
         resp.raise_for_status()
         result['bonus'] = resp.json().get('balance', 0) / 100
     except Exception as e:
@@ -178,42 +361,45 @@ def get_balances(access_token: str, user_id: int) -> Dict:
 # ИНФОРМАЦИЯ ОБ ОБЪЯВЛЕНИИ (ЧЕРЕЗ API — БЕЗ ПАРСИНГА!)
 # =============================================================
 
-def get_item_info(access_token: str, item_id: int) -> Union[Dict, None]:
+def parse_item_info(data: Dict) -> Dict:
+    # Картинка из API
+    image_url = None
+    images = data.get('images', [])
+    if images:
+        if isinstance(images[0], str):
+            image_url = images[0]
+        elif isinstance(images[0], dict):
+            image_url = images[0].get('640x480') or images[0].get('default')
+
+    return {
+        "title": data.get('title', ''),
+        "image_url": image_url,
+        "status": data.get('status', 'unknown'),
+        "url": data.get('url', ''),
+    }
+
+
+def get_item_info(access_token: str, item_id: int,
+                  user_id: int = None) -> Union[Dict, None]:
     """
     Получает title и image ТОЛЬКО через Avito API.
     НЕ парсит HTML — не нужны прокси, не бывает 429.
+    user_id — если известен (AvitoAccount.avito_user_id), иначе из кэша.
     """
     try:
-        user_id = get_avito_user_id(access_token)
+        user_id = user_id or get_avito_user_id(access_token)
         if not user_id:
             return None
 
         api_url = ITEM_INFO_URL_TPL.format(user_id=user_id, item_id=item_id)
         headers = {'Authorization': f'Bearer {access_token}'}
-        resp = requests.get(api_url, headers=headers, timeout=15)
+        resp = avito_http.get(api_url, headers=headers, timeout=15)
+        _check_auth(resp, access_token)
 
         if resp.status_code == 200:
-            data = resp.json()
-            title = data.get('title', '')
-            status = data.get('status', 'unknown')
-            ad_url = data.get('url', '')
-
-            # Картинка из API
-            image_url = None
-            images = data.get('images', [])
-            if images:
-                if isinstance(images[0], str):
-                    image_url = images[0]
-                elif isinstance(images[0], dict):
-                    image_url = images[0].get('640x480') or images[0].get('default')
-
-            logger.info(f"[ITEM_INFO] ✅ {item_id}: «{title}» (API)")
-            return {
-                "title": title,
-                "image_url": image_url,
-                "status": status,
-                "url": ad_url,
-            }
+            info = parse_item_info(resp.json())
+            logger.info(f"[ITEM_INFO] ✅ {item_id}: «{info['title']}» (API)")
+            return info
         else:
             logger.warning(f"[ITEM_INFO] API статус {resp.status_code} для {item_id}")
             return None
@@ -227,8 +413,8 @@ def get_item_info(access_token: str, item_id: int) -> Union[Dict, None]:
 # СПИСОК ОБЪЯВЛЕНИЙ
 # =============================================================
 
-def get_user_ads(access_token: str) -> Union[List[Dict], None]:
-    user_id = get_avito_user_id(access_token)
+def get_user_ads(access_token: str, user_id: int = None) -> Union[List[Dict], None]:
+    user_id = user_id or get_avito_user_id(access_token)
     if not user_id:
         return None
 
@@ -240,7 +426,8 @@ def get_user_ads(access_token: str) -> Union[List[Dict], None]:
 
     try:
         logger.info(f"[ADS] Запрос объявлений {user_id}...")
-        response = requests.get(url, headers=headers, timeout=20)
+        response = avito_http.get(url, headers=headers, timeout=20)
+        _check_auth(response, access_token)
         response.raise_for_status()
         data = response.json()
         ads = data.get('resources', [])
@@ -265,6 +452,28 @@ def get_user_ads(access_token: str) -> Union[List[Dict], None]:
 # СТАВКИ
 # =============================================================
 
+def parse_bid_price(data: Dict) -> Union[float, None]:
+    bid = data.get('manual', {}).get('bidPenny')
+    if bid is not None:
+        price = float(bid) / 100
+        logger.info(f"[STAVKA] Цена: {price} ₽")
+        return price
+
+    logger.warning("[STAVKA] bidPenny не найден")
+    return None
+
+
+def build_bid_body(ad_id: int, new_price: float, daily_limit_rub: float = None) -> Dict:
+    body = {
+        "itemID": ad_id,
+        "actionTypeID": 5,
+        "bidPenny": int(new_price * 100),
+    }
+    if daily_limit_rub and daily_limit_rub > 0:
+        body["dailyBudgetPenny"] = int(daily_limit_rub * 100)
+    return body
+
+
 def get_current_ad_price(ad_id: int, access_token: str) -> Union[float, None]:
     if not access_token:
         return None
@@ -275,22 +484,16 @@ def get_current_ad_price(ad_id: int, access_token: str) -> Union[float, None]:
     for attempt in range(2):
         try:
             logger.info(f"[STAVKA] Попытка {attempt+1}/2")
-            response = requests.get(url, headers=headers, timeout=15)
+            response = avito_http.get(url, headers=headers, timeout=15)
+            if response.status_code == 401:
+                invalidate_access_token(access_token)
+                return None
             response.raise_for_status()
-            data = response.json()
-
-            bid = data.get('manual', {}).get('bidPenny')
-            if bid is not None:
-                price = float(bid) / 100
-                logger.info(f"[STAVKA] Цена: {price} ₽")
-                return price
-
-            logger.warning("[STAVKA] bidPenny не найден")
-            return None
+            return parse_bid_price(response.json())
 
         except requests.exceptions.RequestException as e:
+            # Пауза перед повтором не нужна: после 429 её выдержит ограничитель
             logger.error(f"[STAVKA] Ошибка: {e}")
-            time.sleep(3)
 
     return None
 
@@ -305,23 +508,18 @@ def set_ad_price(ad_id: int, new_price: float, access_token: str,
         'Content-Type': 'application/json',
     }
 
-    body = {
-        "itemID": ad_id,
-        "actionTypeID": 5,
-        "bidPenny": int(new_price * 100),
-    }
+    body = build_bid_body(ad_id, new_price, daily_limit_rub)
 
     log_msg = f"Ставка {new_price} ₽"
-
-    if daily_limit_rub and daily_limit_rub > 0:
-        body["dailyBudgetPenny"] = int(daily_limit_rub * 100)
+    if "dailyBudgetPenny" in body:
         log_msg += f" + лимит {daily_limit_rub} ₽"
 
     try:
         logger.info(f"[SET] {log_msg}")
-        response = requests.post(
+        response = avito_http.post(
             SET_MANUAL_BID_URL, headers=headers, json=body, timeout=15
         )
+        _check_auth(response, access_token)
         response.raise_for_status()
         logger.info(f"[SET] ✅ Успех")
         return True
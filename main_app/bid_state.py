@@ -0,0 +1,96 @@
+# main_app/bid_state.py
+"""
+Кэш текущих ставок объявлений (write-through).
+
+После успешного setManual и после чтения getBids ставка кладётся в Redis
+на BID_RECONCILE_SECONDS. Пока запись жива, цикл берёт ставку из кэша, а не
+из getBids; когда она истекает — ставка сверяется с Avito заново (вдруг её
+поменяли в кабинете). Неудачная запись сбрасывает кэш. Запись той же ставки
+с тем же лимитом не отправляется вовсе.
+"""
+
+import json
+import logging
+from typing import Union
+
+import redis
+from django.conf import settings
+
+from .avito_api import get_current_ad_price, set_ad_price
+from .redis_client import redis_client as _redis
+
+logger = logging.getLogger(__name__)
+
+BID_RECONCILE_SECONDS = getattr(settings, 'BID_RECONCILE_SECONDS', 1800)
+
+
+def _key(ad_id: int) -> str:
+    return f'bid_state:{ad_id}'
+
+
+def _load(ad_id: int) -> Union[dict, None]:
+    try:
+        raw = _redis.get(_key(ad_id))
+    except redis.RedisError as e:
+        logger.warning(f"[BIDSTATE] Кэш недоступен: {e}")
+        return None
+    return json.loads(raw) if raw else None
+
+
+def cached_bid(ad_id: int) -> Union[float, None]:
+    state = _load(ad_id)
+    return state['price'] if state else None
+
+
+def _limit(daily_limit_rub: Union[float, None]) -> Union[float, None]:
+    """Лимит, как его отправляет setManual: 0 и None — без лимита."""
+    return float(daily_limit_rub) if daily_limit_rub and daily_limit_rub > 0 else None
+
+
+def remember_bid(ad_id: int, price: float, daily_limit_rub: float = None):
+    state = {'price': float(price), 'limit': _limit(daily_limit_rub)}
+    try:
+        _redis.set(_key(ad_id), json.dumps(state), ex=BID_RECONCILE_SECONDS)
+    except redis.RedisError as e:
+        logger.warning(f"[BIDSTATE] Кэш недоступен: {e}")
+
+
+def forget_bid(ad_id: int):
+    try:
+        _redis.delete(_key(ad_id))
+    except redis.RedisError as e:
+        logger.warning(f"[BIDSTATE] Кэш недоступен: {e}")
+
+
+def is_same_bid(ad_id: int, price: float, daily_limit_rub: float = None) -> bool:
+    """Та же ставка с тем же лимитом уже стоит — писать незачем."""
+    state = _load(ad_id)
+    return bool(state) and state['price'] == float(price) and state['limit'] == _limit(daily_limit_rub)
+
+
+# =============================================================
+# ЧТЕНИЕ И ЗАПИСЬ ЧЕРЕЗ КЭШ
+# =============================================================
+
+def current_bid(ad_id: int, access_token: str) -> Union[float, None]:
+    """Ставка из кэша или, если его нет, из getBids."""
+    price = cached_bid(ad_id)
+    if price is not None:
+        return price
+    price = get_current_ad_price(ad_id, access_token)
+    if price is not None:
+        remember_bid(ad_id, price)
+    return price
+
+
+def write_bid(ad_id: int, price: float, access_token: str,
+              daily_limit_rub: float = None) -> bool:
+    """setManual с обновлением кэша; ту же ставку не отправляет."""
+    if is_same_bid(ad_id, price, daily_limit_rub):
+        logger.info(f"[SET] {ad_id}: ставка {price} ₽ уже стоит — пропуск")
+        return True
+    if set_ad_price(ad_id, price, access_token, daily_limit_rub=daily_limit_rub):
+        remember_bid(ad_id, price, daily_limit_rub)
+        return True
+    forget_bid(ad_id)
+    return False
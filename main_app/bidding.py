@@ -0,0 +1,191 @@
+# main_app/bidding.py
+"""
+Правила биддера без ввода-вывода.
+
+План цикла строится по уже известным позиции и текущей ставке, а запись
+ставки выполняет вызывающий код (пул потоков в tasks.py или асинхронный
+движок aio_engine.py). Так оба пути принимают одинаковые решения.
+"""
+
+import math
+import random
+from typing import Union, Dict, List
+
+from django.conf import settings
+
+from .models import BiddingTask, BidObservation, TaskLog
+from .schedule import next_wakeup
+from .scheduler import TASK_MIN_RUN_INTERVAL
+from .strategies import next_price
+
+# Пауза между циклами задачи в окне расписания (сек) — начальная
+BID_CYCLE_SECONDS = 290
+# Дальше пауза своя у каждой задачи (BiddingTask.poll_interval): после записи
+# ставки — BID_POLL_MIN_SECONDS; скачок позиции на BID_POLL_VOLATILE_POSITIONS
+# и больше — вдвое короче; спокойный цикл — в BID_POLL_BACKOFF раз длиннее,
+# до BID_POLL_MAX_SECONDS. Разброс — ±BID_POLL_JITTER от паузы
+BID_POLL_JITTER = 0.2
+# Минимум выводится из защиты планировщика: даже с разбросом вниз пауза не
+# короче TASK_MIN_RUN_INTERVAL, иначе claim_task_runs отбросит созревшую задачу
+BID_POLL_MIN_SECONDS = max(
+    getattr(settings, 'BID_POLL_MIN_SECONDS', 0),
+    math.ceil(TASK_MIN_RUN_INTERVAL / (1 - BID_POLL_JITTER)),
+)
+BID_POLL_MAX_SECONDS = getattr(settings, 'BID_POLL_MAX_SECONDS', 1800)
+BID_POLL_BACKOFF = getattr(settings, 'BID_POLL_BACKOFF', 1.5)
+BID_POLL_VOLATILE_POSITIONS = getattr(settings, 'BID_POLL_VOLATILE_POSITIONS', 3)
+
+
+def _plan(logs: List = None) -> Dict:
+    return {
+        'logs': logs or [],    # (сообщение, уровень) до записи ставки
+        'price': None,         # новая ставка или None — ничего не пишем
+        'success': None,       # (сообщение, уровень) после успешной записи
+        'failure': None,       # (сообщение, уровень) после ошибки записи
+        'finished': False,     # добавить «Цикл завершён ✔»
+        'settled': True,       # вне окна: ставка точно на минимуме — можно спать до окна
+        'observation': None,   # (ставка, позиция или None) — для модели выдачи
+        'volatile': None,      # позиция скачет; None — цикл ничего не узнал о позиции
+    }
+
+
+def needs_current_price(ad_data: Union[Dict, None]) -> bool:
+    """Нужна ли текущая ставка из getBids для решения в расписании."""
+    return ad_data is not None
+
+
+def plan_bid(task: BiddingTask, ad_data: Union[Dict, None],
+             current_price: Union[float, None]) -> Dict:
+    """
+    Решение по ставке в расписании по позиции ad_data и текущей ставке.
+    Новую ставку выбирает стратегия задачи (main_app.strategies).
+    """
+    plan = _plan([(f"▶ Биддер для {task.ad_id}", 'INFO')])
+    plan['finished'] = True
+    logs = plan['logs']
+
+    # --- Не найдено ---
+    if ad_data is None:
+        logs.append(("Объявление не найдено в топ-50.", 'ERROR'))
+        # Выпало из топ-50 только что — скачок; не найдено снова — спокойно
+        plan['volatile'] = task.current_position is not None
+        task.current_position = None
+        if task.current_price is not None:
+            plan['observation'] = (task.current_price, None)
+
+        if task.freeze_price_if_not_found:
+            logs.append(("Цена заморожена (настройка).", 'WARNING'))
+            return plan
+
+        new_price, note = next_price(task, None, task.current_price)
+        if new_price is not None:
+            if task.current_price is None:
+                log_msg = f"↑ Первый запуск: {new_price} ₽"
+            else:
+                log_msg = f"↑ Повышена вслепую до {new_price} ₽"
+            plan['price'] = new_price
+            plan['success'] = (log_msg, 'WARNING')
+            plan['failure'] = (f"Ошибка установки {new_price} ₽", 'ERROR')
+        else:
+            logs.append(note)
+        return plan
+
+    # --- Найдено ---
+    position = ad_data["position"]
+    plan['volatile'] = (task.current_position is None
+                        or abs(position - task.current_position) >= BID_POLL_VOLATILE_POSITIONS)
+    task.current_position = position
+    if current_price is not None:
+        task.current_price = current_price
+
+    logs.append((
+        f"📍 Позиция: {position} "
+        f"(цель {task.target_position_min}–{task.target_position_max}), "
+        f"ставка: {current_price or '—'} ₽",
+        'INFO'
+    ))
+
+    if current_price is None:
+        logs.append(("Не удалось получить цену.", 'ERROR'))
+        return plan
+    plan['observation'] = (current_price, position)
+
+    new_price, note = next_price(task, position, current_price)
+    if new_price is None:
+        logs.append(note)
+    elif new_price > float(current_price):
+        # Вышел из цели — ПОВЫШАЕМ
+        plan['price'] = new_price
+        plan['success'] = (
+            f"↑ Повышена до {new_price} ₽ "
+            f"(позиция {position} > {task.target_position_max})",
+            'WARNING'
+        )
+        plan['failure'] = ("Ошибка повышения", 'ERROR')
+    elif new_price < float(current_price):
+        # В цели или выше — ПОНИЖАЕМ (экономия)
+        plan['price'] = new_price
+        plan['success'] = (
+            f"↓ Понижена до {new_price} ₽ "
+            f"(экономия, позиция {position} в норме)",
+            'INFO'
+        )
+        plan['failure'] = ("Ошибка понижения", 'ERROR')
+    return plan
+
+
+def plan_out_of_schedule(task: BiddingTask, current_price: Union[float, None]) -> Dict:
+    """Вне расписания — опускаем ставку до минимума."""
+    plan = _plan()
+    # Ставку не узнали — проверим ещё раз, а не уснём до утра
+    plan['settled'] = current_price is not None
+    min_price = float(task.min_price)
+    if current_price is not None and float(current_price) > min_price:
+        plan['price'] = min_price
+        plan['success'] = (f"↓ Снижена до {min_price} ₽ (вне расписания).", 'INFO')
+    return plan
+
+
+def next_poll_interval(task: BiddingTask, plan: Dict, written: bool) -> int:
+    """Пауза до следующего цикла задачи по итогам этого (сек)."""
+    interval = task.poll_interval or BID_CYCLE_SECONDS
+    if plan['price'] is not None:
+        # Ставку меняли (или не смогли) — проверим результат поскорее
+        return BID_POLL_MIN_SECONDS
+    if plan['volatile'] is None:
+        return interval
+    if plan['volatile']:
+        return max(BID_POLL_MIN_SECONDS, int(interval / 2))
+    return min(BID_POLL_MAX_SECONDS, int(interval * BID_POLL_BACKOFF))
+
+
+def finish_plan(task: BiddingTask, plan: Dict, written: bool) -> List[TaskLog]:
+    """
+    Применяет результат записи ставки, назначает следующий запуск
+    (next_poll_interval, schedule.next_wakeup) и возвращает несохранённые логи цикла.
+    Наблюдение цикла кладёт в task.observation — его сохранит _save_cycle.
+    """
+    messages = list(plan['logs'])
+    task.observation = None
+    if plan['observation'] is not None:
+        price, position = plan['observation']
+        task.observation = BidObservation(task=task, price=price, position=position)
+    if plan['price'] is not None:
+        if written:
+            task.current_price = plan['price']
+            messages.append(plan['success'])
+        else:
+            plan['settled'] = False
+            if plan['failure']:
+                messages.append(plan['failure'])
+    task.poll_interval = next_poll_interval(task, plan, written)
+    # Не чаще, чем позволяет мощность прокси (main_app.capacity)
+    delay = max(task.poll_interval, task.capacity_interval or 0)
+    task.next_run_at = next_wakeup(
+        task, delay * random.uniform(1 - BID_POLL_JITTER, 1 + BID_POLL_JITTER),
+        settled=plan['settled'],
+    )
+    if plan['finished']:
+        messages.append(("Цикл завершён ✔", 'INFO'))
+    return [TaskLog(task=task, message=message, level=level)
+            for message, level in messages]
@@ -0,0 +1,244 @@
+# main_app/capacity.py
+"""
+Планировщик мощности загрузки выдачи.
+
+Предел системы — сколько выдач в минуту мобильные прокси выдерживают без
+429. Раз в CAPACITY_PLAN_SECONDS plan_capacity:
+
+1. мощность — сумма устойчивых скоростей прокси (proxy_pool.sustainable_rpm)
+   с запасом CAPACITY_HEADROOM;
+2. спрос — активные задачи в окне расписания. Задачи с одним search_url
+   делят загрузку, поэтому выдача грузится не чаще раза в SERP_CACHE_TTL
+   и так часто, как хочет самая частая её задача (poll_interval);
+3. если спрос больше мощности, интервалы выдач растягиваются по весу:
+   интервал = max(желаемый, λ / вес), λ подбирается бисекцией так, чтобы
+   загрузки уложились в мощность (не реже раза в CAPACITY_MAX_INTERVAL).
+   Вес выдачи — наибольший вес её задач:
+   приоритет × (1 + ставка / средняя ставка) × (1 + расстояние до цели / 10);
+4. задачам пишется capacity_interval — раньше него bidding.finish_plan цикл
+   не назначит; скорость раздачи задач уходит в Redis (dispatch_due_tasks);
+5. отчёт — мощность, спрос, сколько прокси нужно на текущие задачи —
+   в Redis и в команде capacity_report.
+"""
+
+import json
+import math
+import logging
+from typing import Union, Dict, List
+
+import redis
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .bidding import BID_CYCLE_SECONDS
+from .models import BiddingTask
+from .proxy_pool import active_proxies, sustainable_rpm, PROXY_DEFAULT_RPM
+from .redis_client import redis_client as _redis
+from .schedule import task_in_schedule
+from .scheduler import SCHEDULER_DISPATCH_RATE
+from .serp import normalize_search_url, SERP_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+CAPACITY_PLAN_SECONDS = getattr(settings, 'CAPACITY_PLAN_SECONDS', 60)
+# Какую долю устойчивой скорости прокси планируем занимать
+CAPACITY_HEADROOM = getattr(settings, 'CAPACITY_HEADROOM', 0.85)
+# Реже этого выдачу не растягиваем, даже если мощности не хватает
+CAPACITY_MAX_INTERVAL = getattr(settings, 'CAPACITY_MAX_INTERVAL', 3600)
+# capacity_interval округляется вверх до шага — меньше записей в БД
+CAPACITY_INTERVAL_STEP = 30
+MIN_DISPATCH_RATE = 0.2
+NOT_FOUND_DISTANCE = 50
+
+DISPATCH_RATE_KEY = 'capacity:dispatch_rate'
+REPORT_KEY = 'capacity:report'
+
+
+# =============================================================
+# СПРОС
+# =============================================================
+
+def _desired_interval(task: BiddingTask) -> int:
+    return task.poll_interval or BID_CYCLE_SECONDS
+
+
+def task_weight(task: BiddingTask, mean_price: float) -> float:
+    """Вес задачи: приоритет, траты и насколько она далеко от цели."""
+    price = float(task.current_price or task.min_price)
+    position = task.current_position
+    if position is None:
+        distance = NOT_FOUND_DISTANCE
+    elif position > task.target_position_max:
+        distance = position - task.target_position_max
+    elif position < task.target_position_min:
+        distance = task.target_position_min - position
+    else:
+        distance = 0
+    return (task.priority or 1) * (1 + price / mean_price) * (1 + min(distance, NOT_FOUND_DISTANCE) / 10)
+
+
+def _demand(tasks: List[BiddingTask]) -> Dict[str, Dict]:
+    """{выдача: {'interval', 'weight', 'tasks'}} — желаемый интервал загрузки."""
+    prices = [float(t.current_price or t.min_price) for t in tasks]
+    mean_price = max(sum(prices) / len(prices), 0.01) if prices else 1.0
+
+    urls = {}
+    for task in tasks:
+        key = normalize_search_url(task.search_url)
+        interval = max(_desired_interval(task), SERP_CACHE_TTL)
+        weight = task_weight(task, mean_price)
+        entry = urls.setdefault(key, {'interval': interval, 'weight': weight, 'tasks': []})
+        entry['interval'] = min(entry['interval'], interval)
+        entry['weight'] = max(entry['weight'], weight)
+        entry['tasks'].append(task)
+    return urls
+
+
+# =============================================================
+# РАСПРЕДЕЛЕНИЕ
+# =============================================================
+
+def _interval(entry: Dict, lam: float) -> float:
+    return min(CAPACITY_MAX_INTERVAL, max(entry['interval'], lam / entry['weight']))
+
+
+def _fetch_rpm(urls: Dict[str, Dict], lam: float) -> float:
+    return sum(60.0 / _interval(entry, lam) for entry in urls.values())
+
+
+def allocate(urls: Dict[str, Dict], capacity_rpm: Union[float, None]) -> float:
+    """λ, при котором загрузки укладываются в capacity_rpm; 0 — хватает всем."""
+    if capacity_rpm is None or _fetch_rpm(urls, 0) <= capacity_rpm:
+        return 0.0
+    low = 0.0
+    high = CAPACITY_MAX_INTERVAL * max(entry['weight'] for entry in urls.values())
+    for _ in range(50):
+        middle = (low + high) / 2
+        if _fetch_rpm(urls, middle) > capacity_rpm:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+def _round_up(seconds: float) -> int:
+    return int(math.ceil(seconds / CAPACITY_INTERVAL_STEP) * CAPACITY_INTERVAL_STEP)
+
+
+def build_plan(update: bool = True) -> Dict:
+    """
+    План без применения: {'report', 'task_intervals', 'dispatch_rate'}.
+    update=False — не обновлять оценки скорости прокси (только посмотреть).
+    """
+    proxies = active_proxies()
+    rates = sustainable_rpm(proxies, update=update)
+    # Без прокси выдача грузится напрямую — ограничивать нечем
+    capacity_rpm = sum(rates.values()) * CAPACITY_HEADROOM if rates else None
+
+    tasks = [
+        task for task in BiddingTask.objects.filter(is_active=True).only(
+            'id', 'search_url', 'schedule', 'schedule_bitmap', 'priority',
+            'current_price', 'current_position', 'min_price',
+            'target_position_min', 'target_position_max', 'poll_interval',
+        )
+        if task_in_schedule(task)
+    ]
+    urls = _demand(tasks)
+    lam = allocate(urls, capacity_rpm)
+
+    task_intervals = {}
+    task_rps = 0.0
+    for entry in urls.values():
+        url_interval = _interval(entry, lam)
+        # Не растянутую выдачу задачи читают из кэша сколько хотят
+        stretched = url_interval > entry['interval']
+        for task in entry['tasks']:
+            desired = _desired_interval(task)
+            limited = stretched and url_interval > desired
+            task_rps += 1.0 / (url_interval if limited else desired)
+            task_intervals[task.id] = _round_up(url_interval) if limited else None
+
+    demand_rpm = _fetch_rpm(urls, 0)
+    planned_rpm = _fetch_rpm(urls, lam)
+    if capacity_rpm and planned_rpm:
+        # Задач в секунду столько, чтобы их загрузки не превысили мощность
+        dispatch_rate = capacity_rpm / 60 * (task_rps * 60 / planned_rpm)
+        dispatch_rate = max(MIN_DISPATCH_RATE, min(SCHEDULER_DISPATCH_RATE, dispatch_rate))
+    else:
+        dispatch_rate = float(SCHEDULER_DISPATCH_RATE)
+
+    per_proxy = sum(rates.values()) / len(rates) if rates else float(PROXY_DEFAULT_RPM)
+    report = {
+        'at': timezone.now().isoformat(),
+        'proxies': {str(port): round(rpm, 1) for port, rpm in rates.items()},
+        'capacity_rpm': round(capacity_rpm, 1) if capacity_rpm is not None else None,
+        'active_tasks': len(tasks),
+        'due_tasks': BiddingTask.objects.filter(is_active=True).filter(
+            Q(next_run_at__isnull=True) | Q(next_run_at__lte=timezone.now())
+        ).count(),
+        'search_urls': len(urls),
+        'demand_rpm': round(demand_rpm, 1),
+        'planned_rpm': round(planned_rpm, 1),
+        'stretched_urls': sum(1 for e in urls.values() if _interval(e, lam) > e['interval']),
+        'dispatch_rate': round(dispatch_rate, 2),
+        'proxies_needed': math.ceil(demand_rpm / (per_proxy * CAPACITY_HEADROOM)),
+    }
+    return {'report': report, 'task_intervals': task_intervals, 'dispatch_rate': dispatch_rate}
+
+
+# =============================================================
+# ПРИМЕНЕНИЕ
+# =============================================================
+
+def apply_plan(plan: Dict) -> int:
+    """Пишет capacity_interval изменившимся задачам и скорость раздачи в Redis."""
+    intervals = plan['task_intervals']
+    changed = []
+    for task in BiddingTask.objects.filter(id__in=list(intervals)).only('id', 'capacity_interval'):
+        if task.capacity_interval != intervals[task.id]:
+            task.capacity_interval = intervals[task.id]
+            changed.append(task)
+    BiddingTask.objects.bulk_update(changed, ['capacity_interval'], batch_size=500)
+    # Задачи вне плана (пауза, вне окна) — без ограничения
+    cleared = BiddingTask.objects.filter(capacity_interval__isnull=False).exclude(
+        id__in=list(intervals)
+    ).update(capacity_interval=None)
+
+    try:
+        pipe = _redis.pipeline()
+        pipe.set(DISPATCH_RATE_KEY, plan['dispatch_rate'], ex=CAPACITY_PLAN_SECONDS * 5)
+        pipe.set(REPORT_KEY, json.dumps(plan['report']), ex=CAPACITY_PLAN_SECONDS * 5)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"[CAPACITY] Не удалось сохранить план: {e}")
+    return len(changed) + cleared
+
+
+def plan_capacity() -> Dict:
+    plan = build_plan()
+    updated = apply_plan(plan)
+    report = plan['report']
+    logger.info(
+        f"[CAPACITY] Мощность {report['capacity_rpm']} / спрос {report['demand_rpm']} выдач/мин, "
+        f"растянуто выдач: {report['stretched_urls']}, раздача {report['dispatch_rate']} задач/сек, "
+        f"обновлено задач: {updated}"
+    )
+    return report
+
+
+def current_dispatch_rate() -> float:
+    """Скорость раздачи задач из последнего плана или SCHEDULER_DISPATCH_RATE."""
+    try:
+        rate = _redis.get(DISPATCH_RATE_KEY)
+    except redis.RedisError:
+        rate = None
+    return float(rate) if rate is not None else float(SCHEDULER_DISPATCH_RATE)
+
+
+def last_report() -> Union[Dict, None]:
+    try:
+        raw = _redis.get(REPORT_KEY)
+    except redis.RedisError:
+        return None
+    return json.loads(raw) if raw else None
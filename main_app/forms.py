@@ -3,6 +3,7 @@
 from django import forms
 # +++ ИЗМЕНЕНИЕ: Импортируем новую модель AvitoAccount +++
 from .models import BiddingTask, UserProfile, AvitoAccount
+from .schedule import normalize_schedule
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 # +++ ШАГ 1: НОВАЯ ФОРМА ДЛЯ УПРАВЛЕНИЯ АККАУНТАМИ AVITO +++
@@ -44,6 +45,8 @@ class BiddingTaskForm(forms.ModelForm):
             'min_price', 'max_price', 
             'target_position_min', 'target_position_max', 
             'bid_step', 
+            'strategy',
+            'priority',
             'schedule',
             'daily_budget', 
             'is_active',
@@ -70,6 +73,55 @@ class BiddingTaskForm(forms.ModelForm):
             # Если пользователь передан, фильтруем аккаунты, чтобы показать только его
             self.fields['avito_account'].queryset = AvitoAccount.objects.filter(user=user)
 
+    def clean_schedule(self):
+        return normalize_schedule(self.cleaned_data.get('schedule'))
+
+
+class BulkTaskItemForm(forms.ModelForm):
+    """
+    Проверка одного объявления при массовом добавлении (api_add_tasks).
+    Аккаунт и пользователь задаются во view, поэтому их здесь нет.
+    """
+
+    class Meta:
+        model = BiddingTask
+        fields = [
+            'ad_id', 'title', 'search_url',
+            'min_price', 'max_price',
+            'target_position_min', 'target_position_max',
+            'bid_step',
+            'strategy',
+            'priority',
+            'schedule',
+            'daily_budget',
+            'is_active',
+            'freeze_price_if_not_found',
+        ]
+
+    @classmethod
+    def model_defaults(cls) -> dict:
+        """Значения по умолчанию из модели — для полей, не пришедших в запросе."""
+        defaults = {}
+        for name in cls._meta.fields:
+            field = BiddingTask._meta.get_field(name)
+            if field.has_default():
+                defaults[name] = field.get_default()
+        return defaults
+
+    def clean_schedule(self):
+        return normalize_schedule(self.cleaned_data.get('schedule'))
+
+    def clean(self):
+        cleaned = super().clean()
+        min_price, max_price = cleaned.get('min_price'), cleaned.get('max_price')
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise forms.ValidationError("Мин. цена больше макс. цены")
+        pos_min = cleaned.get('target_position_min')
+        pos_max = cleaned.get('target_position_max')
+        if pos_min is not None and pos_max is not None and pos_min > pos_max:
+            raise forms.ValidationError("Целевая позиция «от» больше «до»")
+        return cleaned
+
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 # +++ ШАГ 2: "ЧИНИМ" СТАРУЮ ФОРМУ USERPROFILEFORM +++
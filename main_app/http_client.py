@@ -0,0 +1,201 @@
+# main_app/http_client.py
+"""
+Общий HTTP-клиент для синхронных вызовов Avito.
+
+Вместо requests.get/post (новое TCP+TLS-соединение на каждый запрос)
+держим keep-alive сессии: одну на api.avito.ru и по одной на каждый порт
+прокси. Сессии живут в пределах процесса: после fork (prefork-воркеры
+Celery) дочерний процесс создаёт свои, не трогая сокеты родителя.
+Запросы к api.avito.ru идут через ограничитель (main_app/ratelimit.py);
+их повторы делает сам клиент, и каждая попытка тоже берёт токен ограничителя.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+from . import ratelimit
+
+logger = logging.getLogger(__name__)
+
+# Соединений в пуле на один хост (не меньше ACCOUNT_CYCLE_CONCURRENCY)
+HTTP_POOL_MAXSIZE = getattr(settings, 'HTTP_POOL_MAXSIZE', 32)
+# Сколько разных хостов держим в пуле одной сессии
+HTTP_POOL_CONNECTIONS = getattr(settings, 'HTTP_POOL_CONNECTIONS', 4)
+# Повторы на уровне соединения (обрыв, 502/503/504) для API
+HTTP_API_RETRIES = getattr(settings, 'HTTP_API_RETRIES', 2)
+HTTP_API_BACKOFF = getattr(settings, 'HTTP_API_BACKOFF', 0.5)
+RETRY_STATUSES = frozenset({502, 503, 504})
+RETRY_METHODS = frozenset({'GET', 'HEAD'})
+
+
+class RateLimitTimeout(requests.exceptions.RequestException):
+    """Запрос к API не дождался своей очереди в ограничителе."""
+
+
+def _not_sent(error: requests.exceptions.ConnectionError) -> bool:
+    """Соединение не установилось — запрос до сервера не дошёл."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class AvitoHttpClient:
+    """
+    avito_http.get(url, ...) / avito_http.post(url, ...) — запросы к API;
+    avito_http.proxy_session(proxy) — сессия для выдачи через конкретный прокси.
+    """
+
+    def __init__(self, pool_connections: int = HTTP_POOL_CONNECTIONS,
+                 pool_maxsize: int = HTTP_POOL_MAXSIZE,
+                 retries: int = HTTP_API_RETRIES,
+                 backoff: float = HTTP_API_BACKOFF):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._pid = None
+        self._api = None
+        self._limited = None
+        self._proxies = {}
+
+    # ---------------------------------------------------------
+    # Сессии
+    # ---------------------------------------------------------
+
+    def _check_pid(self):
+        """После fork сессии родителя не используем — сокеты общие."""
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._api = None
+                    self._limited = None
+                    self._proxies = {}
+                    self._pid = pid
+
+    def _adapter(self, retries: int) -> HTTPAdapter:
+        # Повторяем только идемпотентные запросы; setManual и token —
+        # только при обрыве соединения до отправки
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=self.backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=RETRY_METHODS,
+            raise_on_status=False,
+        )
+        return HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+        )
+
+    def _new_session(self, retries: int) -> requests.Session:
+        session = requests.Session()
+        adapter = self._adapter(retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @property
+    def api(self) -> requests.Session:
+        self._check_pid()
+        if self._api is None:
+            with self._lock:
+                if self._api is None:
+                    self._api = self._new_session(self.retries)
+        return self._api
+
+    @property
+    def limited(self) -> requests.Session:
+        """Сессия api.avito.ru без повторов urllib3 — их делает request."""
+        self._check_pid()
+        if self._limited is None:
+            with self._lock:
+                if self._limited is None:
+                    self._limited = self._new_session(0)
+        return self._limited
+
+    def proxy_session(self, proxy: Dict) -> requests.Session:
+        """
+        Отдельная keep-alive сессия на порт прокси. Повторы здесь не нужны:
+        их делает машина состояний загрузки выдачи (serp.py).
+        """
+        self._check_pid()
+        port = proxy['port']
+        session = self._proxies.get(port)
+        if session is None:
+            with self._lock:
+                session = self._proxies.get(port)
+                if session is None:
+                    session = self._new_session(0)
+                    url = f'http://{proxy["user"]}:{proxy["pass"]}@{proxy["host"]}:{port}'
+                    session.proxies = {'http': url, 'https': url}
+                    self._proxies[port] = session
+        return session
+
+    def drop_proxy_session(self, port: int):
+        """Закрывает соединения прокси — после смены IP они уже мёртвые."""
+        self._check_pid()
+        with self._lock:
+            session = self._proxies.pop(port, None)
+        if session is not None:
+            session.close()
+
+    # ---------------------------------------------------------
+    # Запросы к API
+    # ---------------------------------------------------------
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Запрос через общий пул; к api.avito.ru — через ограничитель (ratelimit).
+        Повторы те же, что у urllib3 для остальных хостов: обрыв до отправки —
+        любой метод, 502/503/504 — только GET/HEAD; перед каждой попыткой —
+        acquire.
+        """
+        family = ratelimit.family_for(url)
+        if family is None:
+            return self.api.request(method, url, **kwargs)
+
+        account = ratelimit.account_for_request(kwargs.get('headers'), kwargs.get('data'))
+        idempotent = method.upper() in RETRY_METHODS
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            if not ratelimit.acquire(family, account):
+                raise RateLimitTimeout(f"Очередь ограничителя {family} переполнена")
+            try:
+                response = self.limited.request(method, url, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                if last or not _not_sent(e):
+                    raise
+                logger.warning(f"[HTTP] {method} {url}: {e} — повтор")
+                continue
+            ratelimit.record_response(family, account, response.status_code, response.headers)
+            if last or not idempotent or response.status_code not in RETRY_STATUSES:
+                return response
+            logger.warning(f"[HTTP] {method} {url}: {response.status_code} — повтор")
+            response.close()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+
+avito_http = AvitoHttpClient()
@@ -0,0 +1,228 @@
+# main_app/item_index.py
+"""
+Индекс объявлений аккаунта для страницы добавления задач.
+
+Каталог /core/v1/items собирается в фоне (задача refresh_item_index_task):
+первая страница показывает размер каталога, остальные загружаются
+параллельно. Результат лежит в Redis (zlib + JSON) с меткой версии;
+эндпоинт фильтрует и отдаёт его страницами, не обращаясь к Avito.
+"""
+
+import json
+import time
+import zlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Dict, List
+
+import redis
+from celery import current_app
+from django.conf import settings
+
+from .avito_api import get_avito_access_token, invalidate_access_token
+from .http_client import avito_http
+from .redis_client import redis_client as _redis, acquire_lock, release_lock
+
+logger = logging.getLogger(__name__)
+
+ITEMS_URL = 'https://api.avito.ru/core/v1/items'
+ITEMS_PER_PAGE = 100
+# Индекс старше этого обновляется в фоне, но продолжает отдаваться
+ITEM_INDEX_STALE_SECONDS = getattr(settings, 'ITEM_INDEX_STALE_SECONDS', 600)
+ITEM_INDEX_TTL = getattr(settings, 'ITEM_INDEX_TTL', 24 * 3600)
+# Сколько страниц каталога грузим одновременно
+ITEM_INDEX_CONCURRENCY = getattr(settings, 'ITEM_INDEX_CONCURRENCY', 4)
+ITEM_INDEX_LOCK_TTL = 300
+# Сколько помним ошибку сборки: пока она есть, эндпоинт сообщает её, а не
+# ставит новую сборку на каждый опрос
+ITEM_INDEX_ERROR_TTL = getattr(settings, 'ITEM_INDEX_ERROR_TTL', 60)
+
+
+def _index_key(account_id: int) -> str:
+    return f'item_index:{account_id}'
+
+
+def _lock_key(account_id: int) -> str:
+    return f'item_index:{account_id}:lock'
+
+
+def _error_key(account_id: int) -> str:
+    return f'item_index:{account_id}:error'
+
+
+def _compact(item: Dict) -> Dict:
+    return {
+        "id": item["id"],
+        "title": item.get("title", ""),
+        "price": item.get("price", 0),
+        "url": item.get("url", ""),
+        "address": item.get("address", ""),
+        "category": (item.get("category") or {}).get("name", ""),
+        "status": item.get("status", ""),
+    }
+
+
+# =============================================================
+# ЗАГРУЗКА КАТАЛОГА
+# =============================================================
+
+def _fetch_page(token: str, page: int) -> Union[Dict, None]:
+    response = avito_http.get(
+        ITEMS_URL,
+        headers={"Authorization": f"Bearer {token}"},
+        params={"per_page": ITEMS_PER_PAGE, "page": page, "status": "active"},
+        timeout=15,
+    )
+    if response.status_code == 401:
+        invalidate_access_token(token)
+    if response.status_code != 200:
+        logger.warning(f"[ITEMS] Страница {page}: статус {response.status_code}")
+        return None
+    return response.json()
+
+
+def _total_pages(data: Dict) -> Union[int, None]:
+    meta = data.get("meta") or {}
+    total = meta.get("total")
+    if not total:
+        return None
+    return -(-int(total) // ITEMS_PER_PAGE)
+
+
+def fetch_catalog(token: str) -> Union[List[Dict], None]:
+    """
+    Все активные объявления аккаунта. Если первая страница сообщает total —
+    остальные грузятся параллельно; иначе параллельными волнами, пока
+    не придёт неполная страница.
+    """
+    first = _fetch_page(token, 1)
+    if first is None:
+        return None
+    items = list(first.get("resources", []))
+    if len(items) < ITEMS_PER_PAGE:
+        return items
+
+    total_pages = _total_pages(first)
+    with ThreadPoolExecutor(max_workers=ITEM_INDEX_CONCURRENCY) as pool:
+        if total_pages:
+            pages = list(pool.map(lambda p: _fetch_page(token, p), range(2, total_pages + 1)))
+            if any(page is None for page in pages):
+                return None
+            for page in pages:
+                items.extend(page.get("resources", []))
+            return items
+
+        next_page = 2
+        while True:
+            wave = range(next_page, next_page + ITEM_INDEX_CONCURRENCY)
+            pages = list(pool.map(lambda p: _fetch_page(token, p), wave))
+            for page in pages:
+                if page is None:
+                    return None
+                resources = page.get("resources", [])
+                items.extend(resources)
+                if len(resources) < ITEMS_PER_PAGE:
+                    return items
+            next_page += ITEM_INDEX_CONCURRENCY
+
+
+# =============================================================
+# ИНДЕКС В REDIS
+# =============================================================
+
+def get_item_index(account_id: int) -> Union[Dict, None]:
+    """{'version', 'built_at', 'items': [...]} или None, если индекса ещё нет."""
+    try:
+        raw = _redis.get(_index_key(account_id))
+    except redis.RedisError as e:
+        logger.warning(f"[ITEMS] Индекс недоступен: {e}")
+        return None
+    if not raw:
+        return None
+    return json.loads(zlib.decompress(raw))
+
+
+def get_index_error(account_id: int) -> Union[str, None]:
+    """Текст последней ошибки сборки или None."""
+    try:
+        error = _redis.get(_error_key(account_id))
+    except redis.RedisError:
+        return None
+    return error.decode() if isinstance(error, bytes) else error
+
+
+def record_index_error(account_id: int, message: str):
+    logger.warning(f"[ITEMS] Аккаунт {account_id}: {message}")
+    try:
+        _redis.set(_error_key(account_id), message, ex=ITEM_INDEX_ERROR_TTL)
+    except redis.RedisError as e:
+        logger.warning(f"[ITEMS] Не удалось сохранить ошибку сборки: {e}")
+
+
+def build_item_index(account) -> Union[int, None]:
+    """
+    Собирает индекс аккаунта и возвращает его версию. Если не удалось —
+    None и ошибка в Redis на ITEM_INDEX_ERROR_TTL (get_index_error).
+    """
+    token = get_avito_access_token(account.avito_client_id, account.avito_client_secret)
+    if not token:
+        record_index_error(account.id, "Не удалось получить токен Avito")
+        return None
+
+    started = time.monotonic()
+    catalog = fetch_catalog(token)
+    if catalog is None:
+        record_index_error(account.id, "Avito не отдал список объявлений")
+        return None
+
+    version = int(time.time() * 1000)
+    payload = {
+        "version": version,
+        "built_at": time.time(),
+        "items": [_compact(item) for item in catalog],
+    }
+    try:
+        _redis.set(_index_key(account.id), zlib.compress(json.dumps(payload).encode()),
+                   ex=ITEM_INDEX_TTL)
+    except redis.RedisError as e:
+        record_index_error(account.id, f"Не удалось сохранить индекс: {e}")
+        return None
+    try:
+        _redis.delete(_error_key(account.id))
+    except redis.RedisError:
+        pass
+
+    logger.info(
+        f"[ITEMS] Аккаунт {account.id}: {len(catalog)} объявлений "
+        f"за {time.monotonic() - started:.1f} сек (версия {version})"
+    )
+    return version
+
+
+def request_index_refresh(account_id: int) -> bool:
+    """Ставит фоновое обновление индекса, если оно ещё не идёт."""
+    lock = acquire_lock(_lock_key(account_id), ITEM_INDEX_LOCK_TTL)
+    if not lock:
+        return False
+    current_app.send_task('main_app.tasks.refresh_item_index_task', args=[account_id, lock])
+    return True
+
+
+def finish_index_refresh(account_id: int, lock: str):
+    release_lock(_lock_key(account_id), lock)
+
+
+def is_stale(index: Dict) -> bool:
+    return time.time() - index.get("built_at", 0) > ITEM_INDEX_STALE_SECONDS
+
+
+def filter_items(items: List[Dict], query: str = '') -> List[Dict]:
+    query = (query or '').strip().lower()
+    if not query:
+        return items
+    return [
+        item for item in items
+        if query in item["title"].lower()
+        or query in item["address"].lower()
+        or query in str(item["id"])
+    ]
@@ -0,0 +1,109 @@
+# main_app/log_sink.py
+"""
+Буфер записей TaskLog (и наблюдений BidObservation).
+
+Циклы биддера не пишут логи сами, а отдают их в log_sink.emit(...),
+наблюдения ставок — в observation_sink.emit(...). Записи копятся в памяти процесса и уходят в БД одним bulk_create:
+когда набралось LOG_SINK_BATCH_SIZE штук или прошло LOG_SINK_FLUSH_SECONDS
+с первой записи в буфере. При остановке воркера (и процесса) буфер
+сбрасывается. Время события ставится при создании записи, а не при вставке.
+"""
+
+import os
+import atexit
+import logging
+import threading
+from typing import Iterable
+
+from celery.signals import worker_process_shutdown, worker_shutdown
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from .models import BidObservation, TaskLog
+
+logger = logging.getLogger(__name__)
+
+LOG_SINK_BATCH_SIZE = getattr(settings, 'LOG_SINK_BATCH_SIZE', 500)
+LOG_SINK_FLUSH_SECONDS = getattr(settings, 'LOG_SINK_FLUSH_SECONDS', 5)
+
+
+class BulkSink:
+    def __init__(self, model=TaskLog, batch_size: int = LOG_SINK_BATCH_SIZE,
+                 flush_seconds: float = LOG_SINK_FLUSH_SECONDS):
+        self.model = model
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._timer = None
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        """После fork буфер и таймер родителя не наши — начинаем с чистого."""
+        if self._pid != os.getpid():
+            self._buffer = []
+            self._timer = None
+            self._pid = os.getpid()
+
+    def emit(self, logs: Iterable):
+        """Кладёт записи в буфер; вставляет, если буфер заполнен."""
+        logs = list(logs)
+        if not logs:
+            return
+        with self._lock:
+            self._check_pid()
+            self._buffer.extend(logs)
+            full = len(self._buffer) >= self.batch_size
+            if not full and self._timer is None:
+                # Таймер живёт в процессе, который пишет (после fork — свой)
+                self._timer = threading.Timer(self.flush_seconds, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def log(self, task, message: str, level: str = 'INFO'):
+        self.emit([TaskLog(task=task, message=message, level=level)])
+
+    def flush(self) -> int:
+        """Вставляет всё накопленное. Возвращает число записей."""
+        with self._lock:
+            logs, self._buffer = self._buffer, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not logs:
+            return 0
+        try:
+            self.model.objects.bulk_create(logs, batch_size=self.batch_size)
+        except DatabaseError as e:
+            logger.error(f"[LOGS] Не удалось записать {len(logs)} записей: {e}")
+            return 0
+        return len(logs)
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        finally:
+            # У потока таймера своё соединение с БД — не оставляем его открытым
+            connection.close()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+
+log_sink = BulkSink(TaskLog)
+observation_sink = BulkSink(BidObservation)
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _flush_on_shutdown(**kwargs):
+    flushed = log_sink.flush() + observation_sink.flush()
+    if flushed:
+        logger.info(f"[LOGS] При остановке записано {flushed} записей")
+
+
+atexit.register(log_sink.flush)
+atexit.register(observation_sink.flush)
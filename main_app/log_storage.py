@@ -0,0 +1,251 @@
+# main_app/log_storage.py
+"""
+Хранение логов задач: срок жизни и итоги по дням.
+
+В Postgres таблица TaskLog секционирована по дням (миграция
+0010_partition_tasklog): секция на каждый день по TIME_ZONE, секция
+main_app_tasklog_legacy со старыми записями и секция по умолчанию на случай,
+если нужный день ещё не создан. Периодическая maintain_task_logs заранее
+создаёт секции на несколько дней вперёд, переносит записи из секции по
+умолчанию в секции их дней, а секции старше
+TASK_LOG_RETENTION_DAYS сворачивает в TaskLogDailySummary и удаляет
+целиком (DROP TABLE вместо DELETE — без нагрузки на vacuum).
+
+На других СУБД (sqlite для разработки) то же самое делается через DELETE.
+"""
+
+import re
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Union, Dict, List, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import TaskLog, TaskLogDailySummary
+
+logger = logging.getLogger(__name__)
+
+TASK_LOG_RETENTION_DAYS = getattr(settings, 'TASK_LOG_RETENTION_DAYS', 30)
+# На сколько дней вперёд держим готовые секции
+TASK_LOG_PARTITION_PREMAKE_DAYS = getattr(settings, 'TASK_LOG_PARTITION_PREMAKE_DAYS', 3)
+
+TASK_LOG_TABLE = TaskLog._meta.db_table
+DEFAULT_PARTITION = f'{TASK_LOG_TABLE}_default'
+SUMMARY_BATCH_SIZE = 1000
+
+# Как цикл биддера пишет события (bidding.py)
+CYCLE_MARK = '▶'
+RAISE_MARK = '↑'
+DROP_MARK = '↓'
+
+_BOUND_RE = re.compile(r"FROM \((?:'([^']+)'|MINVALUE)\) TO \('([^']+)'\)")
+
+
+def day_start(day: date) -> datetime:
+    """Начало дня в TIME_ZONE — граница секций."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def partition_name(day: date) -> str:
+    return f'{TASK_LOG_TABLE}_p{day:%Y%m%d}'
+
+
+# =============================================================
+# ИТОГИ ПО ДНЯМ
+# =============================================================
+
+def rollup(start: Union[datetime, None], end: datetime) -> int:
+    """
+    Сворачивает логи [start, end) в TaskLogDailySummary. Повторный запуск
+    за тот же период перезаписывает итоги, а не удваивает их.
+    """
+    logs = TaskLog.objects.filter(timestamp__lt=end)
+    if start is not None:
+        logs = logs.filter(timestamp__gte=start)
+    rows = (
+        logs.annotate(day=TruncDate('timestamp'))
+        .values('task_id', 'day')
+        .annotate(
+            entries=Count('id'),
+            cycles=Count('id', filter=Q(message__startswith=CYCLE_MARK)),
+            raises=Count('id', filter=Q(message__startswith=RAISE_MARK)),
+            drops=Count('id', filter=Q(message__startswith=DROP_MARK)),
+            errors=Count('id', filter=Q(level='ERROR')),
+        )
+        .order_by()
+    )
+
+    total = 0
+    batch = []
+    for row in rows.iterator():
+        batch.append(TaskLogDailySummary(**row))
+        if len(batch) >= SUMMARY_BATCH_SIZE:
+            total += _save_summaries(batch)
+            batch = []
+    total += _save_summaries(batch)
+    return total
+
+
+def _save_summaries(summaries: List[TaskLogDailySummary]) -> int:
+    if summaries:
+        TaskLogDailySummary.objects.bulk_create(
+            summaries,
+            update_conflicts=True,
+            unique_fields=['task', 'day'],
+            update_fields=['entries', 'cycles', 'raises', 'drops', 'errors'],
+        )
+    return len(summaries)
+
+
+# =============================================================
+# СЕКЦИИ (POSTGRES)
+# =============================================================
+
+def is_partitioned() -> bool:
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s",
+            [TASK_LOG_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def _is_covered(day: date, partitions: List[Tuple[str, Union[datetime, None], datetime]]) -> bool:
+    start, end = day_start(day), day_start(day + timedelta(days=1))
+    return any((lower is None or lower < end) and upper > start
+               for _, lower, upper in partitions)
+
+
+def default_partition_days() -> Dict[date, int]:
+    """{день по TIME_ZONE: записей} в секции по умолчанию."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT (timestamp AT TIME ZONE %s)::date, COUNT(*) '
+            f'FROM "{DEFAULT_PARTITION}" GROUP BY 1',
+            [settings.TIME_ZONE],
+        )
+        return dict(cursor.fetchall())
+
+
+def _create_partition(cursor, day: date, moved: int):
+    name = partition_name(day)
+    bounds = [day_start(day), day_start(day + timedelta(days=1))]
+    if not moved:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS "{name}" '
+            f'PARTITION OF "{TASK_LOG_TABLE}" FOR VALUES FROM (%s) TO (%s)',
+            bounds,
+        )
+        return
+    # Записи дня уже лежат в секции по умолчанию — с ними CREATE ... PARTITION OF
+    # не пройдёт. Переносим их в новую таблицу и подключаем её секцией
+    cursor.execute(f'CREATE TABLE "{name}" (LIKE "{TASK_LOG_TABLE}" INCLUDING DEFAULTS)')
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" '
+        f'WHERE timestamp >= %s AND timestamp < %s RETURNING *) '
+        f'INSERT INTO "{name}" SELECT * FROM moved',
+        bounds,
+    )
+    cursor.execute(
+        f'ALTER TABLE "{TASK_LOG_TABLE}" ATTACH PARTITION "{name}" '
+        f'FOR VALUES FROM (%s) TO (%s)',
+        bounds,
+    )
+
+
+def ensure_partitions(days_ahead: int = TASK_LOG_PARTITION_PREMAKE_DAYS):
+    """
+    Секции на сегодня и days_ahead дней вперёд (кроме уже покрытых). Записи,
+    попавшие в секцию по умолчанию, переносятся в секции своих дней — и
+    дальше сворачиваются и удаляются вместе с ними.
+    """
+    today = timezone.localdate()
+    partitions = list_partitions()
+    stray = default_partition_days()
+    if stray:
+        logger.error(
+            f"[LOGS] В секции по умолчанию {sum(stray.values())} записей "
+            f"за {len(stray)} дн. ({min(stray)} — {max(stray)}) — переносим в секции дней"
+        )
+    days = set(stray) | {today + timedelta(days=offset) for offset in range(days_ahead + 1)}
+
+    with connection.cursor() as cursor:
+        for day in sorted(days):
+            if _is_covered(day, partitions):
+                continue
+            try:
+                with transaction.atomic():
+                    _create_partition(cursor, day, stray.get(day, 0))
+            except DatabaseError as e:
+                logger.error(f"[LOGS] Не удалось создать секцию за {day}: {e}")
+            else:
+                if stray.get(day):
+                    logger.warning(f"[LOGS] Секция {partition_name(day)}: "
+                                   f"перенесено {stray[day]} записей из секции по умолчанию")
+
+
+def list_partitions() -> List[Tuple[str, Union[datetime, None], datetime]]:
+    """[(имя, начало или None, конец), ...] — без секции по умолчанию."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            [TASK_LOG_TABLE],
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_RE.search(bound or '')
+        if not match:
+            continue
+        lower = parse_datetime(match.group(1)) if match.group(1) else None
+        partitions.append((name, lower, parse_datetime(match.group(2))))
+    return sorted(partitions, key=lambda p: p[2])
+
+
+def drop_expired_partitions(cutoff: datetime) -> List[str]:
+    """Сворачивает и удаляет секции, целиком лежащие до cutoff."""
+    dropped = []
+    for name, lower, upper in list_partitions():
+        if upper > cutoff:
+            continue
+        with transaction.atomic():
+            summaries = rollup(lower, upper)
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE "{name}"')
+        logger.info(f"[LOGS] Секция {name} удалена, итогов: {summaries}")
+        dropped.append(name)
+    return dropped
+
+
+# =============================================================
+# ОБСЛУЖИВАНИЕ
+# =============================================================
+
+def maintain_task_logs(retention_days: int = TASK_LOG_RETENTION_DAYS) -> Dict:
+    """Секции вперёд, итоги и удаление всего, что старше retention_days."""
+    cutoff = day_start(timezone.localdate() - timedelta(days=retention_days))
+    if is_partitioned():
+        ensure_partitions()
+        # Секция legacy удалится целиком, когда вся окажется старше cutoff
+        result = {'dropped': drop_expired_partitions(cutoff)}
+    else:
+        with transaction.atomic():
+            summaries = rollup(None, cutoff)
+            deleted, _ = TaskLog.objects.filter(timestamp__lt=cutoff).delete()
+        result = {'deleted': deleted, 'summaries': summaries}
+
+    logger.info(f"[LOGS] Обслуживание логов до {cutoff:%Y-%m-%d}: {result}")
+    return result
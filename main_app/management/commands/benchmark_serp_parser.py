@@ -0,0 +1,98 @@
+import os
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand, CommandError
+from bs4 import BeautifulSoup
+from main_app.serp_extract import extract_item_ids
+
+# Синтетические страницы с трудными случаями — их же сверяют тесты
+FIXTURES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'test_data', 'serp',
+)
+
+
+def parse_with_beautifulsoup(page: bytes) -> list:
+    """Старый парсер get_ad_position — эталон для сравнения."""
+    soup = BeautifulSoup(page.decode('utf-8', errors='replace'), 'html.parser')
+    item_ids = []
+    for ad_element in soup.find_all('div', {'data-marker': 'item'}):
+        item_id = ad_element.get('data-item-id')
+        item_ids.append(int(item_id) if item_id and item_id.isascii() and item_id.isdigit() else 0)
+    return item_ids
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает serp_extract с BeautifulSoup на корпусе сохранённых '
+            'страниц выдачи (см. SERP_RECORD_DIR): позиции и скорость')
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', nargs='?', default=FIXTURES_DIR,
+                            help='Каталог с *.html страницами выдачи '
+                                 '(по умолчанию — main_app/test_data/serp)')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Сколько раз прогонять каждый парсер')
+
+    def _measure(self, parser, pages, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for page in pages:
+                parser(page)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+
+        tracemalloc.start()
+        for page in pages:
+            parser(page)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return best, peak
+
+    def handle(self, *args, **options):
+        corpus = options['corpus']
+        repeat = max(1, options['repeat'])
+
+        if not os.path.isdir(corpus):
+            raise CommandError(f"Каталог {corpus} не найден")
+
+        names = sorted(n for n in os.listdir(corpus) if n.endswith('.html'))
+        if not names:
+            raise CommandError(f"В {corpus} нет *.html страниц")
+
+        pages = []
+        for name in names:
+            with open(os.path.join(corpus, name), 'rb') as f:
+                pages.append(f.read())
+
+        total_mb = sum(len(p) for p in pages) / 1024 / 1024
+        self.stdout.write(f"\nСтраниц: {len(pages)}, объём: {total_mb:.1f} МБ\n")
+
+        mismatches = 0
+        for name, page in zip(names, pages):
+            expected = parse_with_beautifulsoup(page)
+            actual = extract_item_ids(page)
+            if expected != actual:
+                mismatches += 1
+                self.stdout.write(self.style.ERROR(
+                    f"  ❌ {name}: bs4 {len(expected)} шт., extract {len(actual)} шт."
+                ))
+
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"\nРасхождений: {mismatches}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("  ✅ Позиции совпадают на всех страницах"))
+
+        bs_time, bs_peak = self._measure(parse_with_beautifulsoup, pages, repeat)
+        ex_time, ex_peak = self._measure(extract_item_ids, pages, repeat)
+
+        self.stdout.write(
+            f"\n  BeautifulSoup: {bs_time * 1000 / len(pages):.1f} мс/стр, "
+            f"пик памяти {bs_peak / 1024 / 1024:.1f} МБ"
+            f"\n  serp_extract:  {ex_time * 1000 / len(pages):.1f} мс/стр, "
+            f"пик памяти {ex_peak / 1024 / 1024:.1f} МБ"
+            f"\n\n🏁 Ускорение: x{bs_time / ex_time:.1f}"
+        )
+
+        if mismatches:
+            raise CommandError("Парсеры дают разные позиции")
@@ -0,0 +1,48 @@
+import json
+from django.core.management.base import BaseCommand
+from main_app.capacity import build_plan, apply_plan, CAPACITY_HEADROOM
+
+
+class Command(BaseCommand):
+    help = ('Мощность прокси и спрос на загрузку выдачи: хватает ли прокси '
+            'на текущие задачи и сколько их нужно')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apply', action='store_true',
+                            help='Применить план (как periodic plan_capacity_task)')
+        parser.add_argument('--json', action='store_true', help='Отчёт в JSON')
+
+    def handle(self, *args, **options):
+        plan = build_plan(update=options['apply'])
+        if options['apply']:
+            apply_plan(plan)
+        report = plan['report']
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write("\nПрокси (устойчиво, выдач/мин):")
+        for port, rpm in report['proxies'].items():
+            self.stdout.write(f"  {port}: {rpm}")
+        if not report['proxies']:
+            self.stdout.write("  нет — выдача грузится без прокси")
+
+        capacity = report['capacity_rpm']
+        self.stdout.write(
+            f"\nМощность:        {capacity if capacity is not None else '—'} выдач/мин "
+            f"(запас {int((1 - CAPACITY_HEADROOM) * 100)}%)\n"
+            f"Задач в окне:    {report['active_tasks']} (созрело: {report['due_tasks']}), "
+            f"выдач: {report['search_urls']}\n"
+            f"Спрос:           {report['demand_rpm']} выдач/мин\n"
+            f"По плану:        {report['planned_rpm']} выдач/мин, "
+            f"растянуто выдач: {report['stretched_urls']}\n"
+            f"Раздача задач:   {report['dispatch_rate']} в сек\n"
+            f"Нужно прокси:    {report['proxies_needed']}\n"
+        )
+        if capacity is not None and report['demand_rpm'] > capacity:
+            self.stdout.write(self.style.WARNING(
+                f"Мощности не хватает: спрос {report['demand_rpm']} > {capacity} выдач/мин"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS("Мощности хватает"))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Min
+from main_app.models import BiddingTask
+
+
+class Command(BaseCommand):
+    help = ('Активные задачи-дубликаты (одно объявление аккаунта в одной выдаче). '
+            'С --deactivate выключает все, кроме самой ранней; история задач сохраняется')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--deactivate', action='store_true',
+                            help='Выключить лишние копии (is_active = False)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            groups = list(
+                BiddingTask.objects.filter(is_active=True, avito_account__isnull=False)
+                .values('avito_account', 'ad_id', 'search_url')
+                .annotate(first_id=Min('id'), copies=Count('id'))
+                .filter(copies__gt=1)
+                .order_by('avito_account', 'ad_id')
+            )
+            if not groups:
+                self.stdout.write(self.style.SUCCESS("Дубликатов нет"))
+                return
+
+            extra = 0
+            for group in groups:
+                copies = BiddingTask.objects.filter(
+                    is_active=True,
+                    avito_account=group['avito_account'],
+                    ad_id=group['ad_id'],
+                    search_url=group['search_url'],
+                ).exclude(id=group['first_id'])
+                ids = list(copies.order_by('id').values_list('id', flat=True))
+                extra += len(ids)
+                self.stdout.write(
+                    f"Аккаунт {group['avito_account']}, объявление {group['ad_id']}: "
+                    f"остаётся #{group['first_id']}, лишние {ids}\n  {group['search_url']}"
+                )
+                if options['deactivate']:
+                    copies.update(is_active=False)
+
+        if options['deactivate']:
+            self.stdout.write(self.style.SUCCESS(f"\nВыключено задач: {extra}"))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f"\nЛишних задач: {extra}, групп: {len(groups)} — "
+                f"--deactivate выключит их (удалять ничего не будем)"
+            ))
@@ -1,9 +1,7 @@
-import time
-import random
 from django.core.management.base import BaseCommand
 from django.db.models import Q
 from main_app.models import BiddingTask
-from main_app.avito_api import get_avito_access_token, get_item_info
+from main_app.avito_api import get_avito_access_token, get_account_user_id, get_item_info
 
 
 class Command(BaseCommand):
@@ -12,12 +10,11 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--only-empty', action='store_true',
                             help='Только задачи без title/image')
-        parser.add_argument('--pause', type=int, default=8,
-                            help='Мин. пауза между запросами (сек)')
+        parser.add_argument('--async', dest='use_async', action='store_true',
+                            help='Все карточки одновременно через асинхронный движок')
 
     def handle(self, *args, **options):
         only_empty = options['only_empty']
-        base_pause = options['pause']
 
         tasks = BiddingTask.objects.select_related('avito_account').exclude(
             avito_account__isnull=True
@@ -29,14 +26,18 @@ class Command(BaseCommand):
                 Q(image_url='') | Q(image_url__isnull=True)
             )
 
+        if options['use_async']:
+            return self._handle_async(list(tasks))
+
         total = tasks.count()
         updated = 0
         errors = 0
-        consecutive_fails = 0
 
-        self.stdout.write(f"\nНайдено задач: {total}, пауза: {base_pause}с\n")
+        # Темп запросов задаёт общий ограничитель (main_app/ratelimit.py)
+        self.stdout.write(f"\nНайдено задач: {total}\n")
 
         token_cache = {}
+        user_id_cache = {}
         failed_ids = []
 
         for i, task in enumerate(tasks, 1):
@@ -48,6 +49,9 @@ class Command(BaseCommand):
                     account.avito_client_secret
                 )
                 token_cache[account.pk] = token
+                user_id_cache[account.pk] = (
+                    get_account_user_id(account, token) if token else None
+                )
             else:
                 token = token_cache[account.pk]
 
@@ -58,13 +62,7 @@ class Command(BaseCommand):
                 ))
                 continue
 
-            if consecutive_fails >= 3:
-                wait = 60
-                self.stdout.write(f"  ⏳ Много 429, ждём {wait}с...")
-                time.sleep(wait)
-                consecutive_fails = 0
-
-            info = get_item_info(token, task.ad_id)
+            info = get_item_info(token, task.ad_id, user_id=user_id_cache[account.pk])
 
             if info and (info.get("title") or info.get("image_url")):
                 changed = False
@@ -85,23 +83,16 @@ class Command(BaseCommand):
                     self.stdout.write(
                         f"  [{i}/{total}] -- {task.ad_id}: без изменений"
                     )
-                consecutive_fails = 0
             else:
                 errors += 1
-                consecutive_fails += 1
                 failed_ids.append(task.ad_id)
                 self.stdout.write(self.style.WARNING(
                     f"  [{i}/{total}] ❌ {task.ad_id}: нет данных"
                 ))
 
-            pause = random.uniform(base_pause, base_pause + 5)
-            time.sleep(pause)
-
         # Retry
         if failed_ids:
-            wait = 120
-            self.stdout.write(f"\n⏳ Повтор {len(failed_ids)} задач через {wait}с...")
-            time.sleep(wait)
+            self.stdout.write(f"\n⏳ Повтор {len(failed_ids)} задач...")
 
             retry_tasks = BiddingTask.objects.select_related(
                 'avito_account'
@@ -112,7 +103,8 @@ class Command(BaseCommand):
                 if not token:
                     continue
 
-                info = get_item_info(token, task.ad_id)
+                info = get_item_info(token, task.ad_id,
+                                     user_id=user_id_cache.get(task.avito_account.pk))
 
                 if info and (info.get("title") or info.get("image_url")):
                     if info.get("title"):
@@ -130,8 +122,57 @@ class Command(BaseCommand):
                         f"  [retry {i}/{len(failed_ids)}] ❌ {task.ad_id}"
                     ))
 
-                time.sleep(random.uniform(15, 25))
-
         self.stdout.write(
             f"\n🏁 Обновлено: {updated}, ошибок: {errors}, всего: {total}"
-        )
\ No newline at end of file
+        )
+
+    def _handle_async(self, tasks):
+        from main_app.aio_engine import fetch_item_infos
+
+        total = len(tasks)
+        self.stdout.write(f"\nНайдено задач: {total}, режим: async\n")
+
+        # Токен и user_id — один раз на аккаунт
+        credentials = {}
+        jobs = []
+        errors = 0
+        for task in tasks:
+            account = task.avito_account
+            if account.pk not in credentials:
+                token = get_avito_access_token(
+                    account.avito_client_id,
+                    account.avito_client_secret
+                )
+                user_id = get_account_user_id(account, token) if token else None
+                credentials[account.pk] = (token, user_id)
+            token, user_id = credentials[account.pk]
+            if not token or not user_id:
+                errors += 1
+                self.stdout.write(self.style.ERROR(f"  {task.ad_id}: нет токена"))
+                continue
+            jobs.append((task, (account.pk, token, user_id, task.ad_id)))
+
+        results = fetch_item_infos([request for _, request in jobs])
+
+        changed_tasks = []
+        for task, info in zip((task for task, _ in jobs), results):
+            if isinstance(info, Exception) or not info or not (
+                    info.get("title") or info.get("image_url")):
+                errors += 1
+                self.stdout.write(self.style.WARNING(f"  ❌ {task.ad_id}: нет данных"))
+                continue
+            changed = False
+            if info.get("title") and info["title"] != task.title:
+                task.title = info["title"]
+                changed = True
+            if info.get("image_url") and info["image_url"] != task.image_url:
+                task.image_url = info["image_url"]
+                changed = True
+            if changed:
+                changed_tasks.append(task)
+                self.stdout.write(self.style.SUCCESS(f"  ✅ {task.ad_id}: {task.title}"))
+
+        BiddingTask.objects.bulk_update(changed_tasks, ["title", "image_url"], batch_size=500)
+        self.stdout.write(
+            f"\n🏁 Обновлено: {len(changed_tasks)}, ошибок: {errors}, всего: {total}"
+        )
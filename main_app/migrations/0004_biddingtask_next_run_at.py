@@ -0,0 +1,22 @@
+# Generated by Django 4.2.27 on 2026-10-17 21:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0003_remove_biddingtask_last_run'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='biddingtask',
+            name='next_run_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Следующий запуск'),
+        ),
+        migrations.AddIndex(
+            model_name='biddingtask',
+            index=models.Index(fields=['is_active', 'next_run_at'], name='task_due_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.27 on 2026-10-17 21:56
+
+from django.db import migrations, models
+import encrypted_model_fields.fields
+
+
+# Прокси, которые раньше были зашиты в avito_api.PROXY_POOL
+INITIAL_PROXIES = [
+    {
+        'user': 'uKuNaf',
+        'password': 'FAjEC5HeK7yt',
+        'host': 'mproxy.site',
+        'port': 17563,
+        'change_ip_url': 'https://changeip.mobileproxy.space/?proxy_key=65a15a75eb565bba6e220d15559005e3'
+    },
+    {
+        'user': 'vuU1DY',
+        'password': 'apsYVEZRaY7c',
+        'host': 'mproxy.site',
+        'port': 11289,
+        'change_ip_url': 'https://changeip.mobileproxy.space/?proxy_key=7db42d70377c063ba427f4487f63aa6f'
+    },
+]
+
+
+def seed_proxies(apps, schema_editor):
+    ProxyServer = apps.get_model('main_app', 'ProxyServer')
+    for proxy in INITIAL_PROXIES:
+        ProxyServer.objects.get_or_create(port=proxy['port'], defaults=proxy)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0004_biddingtask_next_run_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProxyServer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host', models.CharField(default='mproxy.site', max_length=255, verbose_name='Хост')),
+                ('port', models.PositiveIntegerField(unique=True, verbose_name='Порт')),
+                ('user', models.CharField(max_length=100, verbose_name='Логин')),
+                ('password', encrypted_model_fields.fields.EncryptedCharField(verbose_name='Пароль')),
+                ('change_ip_url', encrypted_model_fields.fields.EncryptedCharField(verbose_name='Ссылка смены IP')),
+                ('rpm_limit', models.PositiveIntegerField(default=20, help_text='Бюджет запросов выдачи через этот прокси на весь кластер', verbose_name='Запросов в минуту')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активен')),
+            ],
+            options={
+                'verbose_name': 'Прокси',
+                'verbose_name_plural': 'Прокси',
+                'ordering': ['port'],
+            },
+        ),
+        migrations.RunPython(seed_proxies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-17 22:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0005_proxyserver'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='avitoaccount',
+            name='avito_user_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, verbose_name='ID пользователя Avito'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.27 on 2026-10-17 22:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0006_avitoaccount_avito_user_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='avitoaccount',
+            name='balance_updated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Балансы обновлены'),
+        ),
+        migrations.AddField(
+            model_name='avitoaccount',
+            name='bonus_balance',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=12, null=True, verbose_name='Аванс (₽)'),
+        ),
+        migrations.AddField(
+            model_name='avitoaccount',
+            name='real_balance',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=12, null=True, verbose_name='Баланс (₽)'),
+        ),
+    ]
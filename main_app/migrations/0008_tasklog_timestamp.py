@@ -0,0 +1,19 @@
+# Generated by Django 4.2.27 on 2026-10-17 22:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0007_avitoaccount_balances'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tasklog',
+            name='timestamp',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.27 on 2026-10-17 22:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0008_tasklog_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskLogDailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('entries', models.PositiveIntegerField(default=0, verbose_name='Записей')),
+                ('cycles', models.PositiveIntegerField(default=0, verbose_name='Циклов')),
+                ('raises', models.PositiveIntegerField(default=0, verbose_name='Повышений')),
+                ('drops', models.PositiveIntegerField(default=0, verbose_name='Понижений')),
+                ('errors', models.PositiveIntegerField(default=0, verbose_name='Ошибок')),
+            ],
+            options={
+                'verbose_name': 'Итоги логов за день',
+                'verbose_name_plural': 'Итоги логов по дням',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tasklog',
+            index=models.Index(fields=['task', '-timestamp'], name='tasklog_task_recent_idx'),
+        ),
+        migrations.AddField(
+            model_name='tasklogdailysummary',
+            name='task',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_summaries', to='main_app.biddingtask'),
+        ),
+        migrations.AddConstraint(
+            model_name='tasklogdailysummary',
+            constraint=models.UniqueConstraint(fields=('task', 'day'), name='tasklog_summary_task_day_uniq'),
+        ),
+    ]
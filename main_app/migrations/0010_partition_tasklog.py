@@ -0,0 +1,143 @@
+# Секционирование main_app_tasklog по дням (только Postgres).
+#
+# Старая таблица не копируется: она переименовывается в main_app_tasklog_legacy
+# и подключается секцией [MINVALUE, начало завтрашнего дня). Её удалит
+# maintain_task_logs, когда вся она станет старше срока хранения.
+# Первичный ключ секционированной таблицы — (id, timestamp): Postgres требует
+# ключ секционирования в уникальных индексах; id по-прежнему уникален (sequence).
+#
+# ATTACH PARTITION проверяет все строки старой таблицы под ACCESS EXCLUSIVE,
+# если границу секции не подтверждает уже проверенный CHECK. Поэтому CHECK
+# добавляется NOT VALID и проверяется (VALIDATE — без блокировки записи)
+# отдельными транзакциями до переименования, и подключение проходит без скана.
+
+from datetime import datetime, time, timedelta
+
+from django.db import migrations
+from django.utils import timezone
+
+TABLE = 'main_app_tasklog'
+LEGACY = 'main_app_tasklog_legacy'
+SEQUENCE = 'main_app_tasklog_part_id_seq'
+BOUND_CHECK = 'main_app_tasklog_legacy_bound'
+PREMAKE_DAYS = 3
+
+_legacy_upper = []
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _legacy_bound():
+    # Одна граница на все шаги миграции, даже если они идут через полночь
+    if not _legacy_upper:
+        _legacy_upper.append(_day_start(timezone.localdate() + timedelta(days=1)))
+    return _legacy_upper[0]
+
+
+def add_bound_check(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{BOUND_CHECK}" '
+            f'CHECK (timestamp < %s) NOT VALID',
+            [_legacy_bound()],
+        )
+
+
+def validate_bound_check(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{TABLE}" VALIDATE CONSTRAINT "{BOUND_CHECK}"')
+
+
+def drop_bound_check(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{TABLE}" DROP CONSTRAINT IF EXISTS "{BOUND_CHECK}"')
+
+
+def partition_tasklog(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s",
+            [TABLE],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM "{TABLE}"')
+        next_id = cursor.fetchone()[0]
+
+        # --- Старая таблица: освобождаем имена и автоинкремент ---
+        cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{LEGACY}"')
+        for name, _ in indexes:
+            if name != f'{TABLE}_pkey':
+                cursor.execute(f'ALTER INDEX "{name}" RENAME TO "{name[:55]}_legacy"')
+        # Ключ секции должен совпасть с ключом родителя — (id, timestamp)
+        cursor.execute(f'CREATE UNIQUE INDEX "{LEGACY}_id_ts" ON "{LEGACY}" (id, timestamp)')
+        cursor.execute(f'ALTER TABLE "{LEGACY}" DROP CONSTRAINT "{TABLE}_pkey"')
+        cursor.execute(f'ALTER TABLE "{LEGACY}" ALTER COLUMN id DROP IDENTITY IF EXISTS')
+        cursor.execute(f'ALTER TABLE "{LEGACY}" ALTER COLUMN id DROP DEFAULT')
+
+        # --- Секционированная таблица с теми же колонками ---
+        cursor.execute(f'CREATE SEQUENCE "{SEQUENCE}" START WITH %s', [next_id])
+        cursor.execute(f'''
+            CREATE TABLE "{TABLE}" (
+                id bigint NOT NULL DEFAULT nextval('{SEQUENCE}'),
+                timestamp timestamp with time zone NOT NULL,
+                level varchar(10) NOT NULL,
+                message text NOT NULL,
+                task_id bigint NOT NULL
+                    REFERENCES main_app_biddingtask (id) DEFERRABLE INITIALLY DEFERRED,
+                CONSTRAINT "{TABLE}_pkey" PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp)
+        ''')
+        cursor.execute(f'ALTER SEQUENCE "{SEQUENCE}" OWNED BY "{TABLE}".id')
+        # Индексы с прежними именами — при подключении legacy Postgres
+        # возьмёт уже построенные индексы старой таблицы
+        for name, definition in indexes:
+            if name != f'{TABLE}_pkey':
+                cursor.execute(definition)
+
+        # --- Секции: старые записи, по умолчанию и дни вперёд ---
+        # Сегодняшние записи уже лежат в старой таблице — она закрывает и сегодня.
+        # Граница совпадает с проверенным CHECK — Postgres не сканирует таблицу
+        today = timezone.localdate()
+        cursor.execute(
+            f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{LEGACY}" '
+            f'FOR VALUES FROM (MINVALUE) TO (%s)',
+            [_legacy_bound()],
+        )
+        # Дальше границу держит сама секция
+        cursor.execute(f'ALTER TABLE "{LEGACY}" DROP CONSTRAINT "{BOUND_CHECK}"')
+        cursor.execute(f'CREATE TABLE "{TABLE}_default" PARTITION OF "{TABLE}" DEFAULT')
+        for offset in range(1, PREMAKE_DAYS + 1):
+            day = today + timedelta(days=offset)
+            cursor.execute(
+                f'CREATE TABLE "{TABLE}_p{day:%Y%m%d}" PARTITION OF "{TABLE}" '
+                f'FOR VALUES FROM (%s) TO (%s)',
+                [_day_start(day), _day_start(day + timedelta(days=1))],
+            )
+
+
+class Migration(migrations.Migration):
+    # Каждый шаг — своя транзакция: VALIDATE не должен идти под блокировкой
+    # ADD CONSTRAINT, а переименование — под блокировкой VALIDATE
+    atomic = False
+
+    dependencies = [
+        ('main_app', '0009_tasklog_daily_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_bound_check, drop_bound_check, atomic=True),
+        migrations.RunPython(validate_bound_check, migrations.RunPython.noop, atomic=True),
+        # Обратно в обычную таблицу не превращаем: для Django схема та же
+        migrations.RunPython(partition_tasklog, migrations.RunPython.noop, atomic=True),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-17 22:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0010_partition_tasklog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='biddingtask',
+            name='last_run_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Последний запуск'),
+        ),
+    ]
@@ -0,0 +1,109 @@
+# Расписание: JSON-строка -> JSONField + скомпилированная битовая карта недели
+
+import re
+import json
+
+from django.db import migrations, models
+
+# Копия main_app.schedule на момент миграции — модуль может меняться,
+# миграция должна давать тот же результат
+MINUTES_PER_DAY = 24 * 60
+BITMAP_BYTES = 7 * MINUTES_PER_DAY // 8
+_TIME_RE = re.compile(r'^([01]?\d|2[0-3]):([0-5]\d)$')
+
+
+def _minutes(value):
+    match = _TIME_RE.match(str(value or '').strip())
+    if not match:
+        return None
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def _lenient_intervals(raw):
+    """Как раньше: нечитаемое расписание — круглосуточно, битые интервалы пропускаются."""
+    try:
+        value = json.loads(raw) if isinstance(raw, str) else raw
+    except ValueError:
+        return []
+    if not isinstance(value, list):
+        return []
+    intervals = []
+    for interval in value:
+        if not isinstance(interval, dict):
+            continue
+        start = _minutes(interval.get('startTime') or interval.get('start'))
+        end = _minutes(interval.get('endTime') or interval.get('end'))
+        days = interval.get('days') or []
+        if start is None or end is None or not isinstance(days, list) or any(
+            not isinstance(day, int) or not 1 <= day <= 7 for day in days
+        ):
+            continue
+        intervals.append({
+            'days': sorted(set(days)),
+            'start': f'{start // 60:02d}:{start % 60:02d}',
+            'end': f'{end // 60:02d}:{end % 60:02d}',
+        })
+    return intervals
+
+
+def _compile(intervals):
+    """Битовая карта активных минут недели; None — круглосуточно."""
+    if not intervals:
+        return None
+    bits = bytearray(BITMAP_BYTES)
+
+    def _mark(day, start, end):
+        base = day * MINUTES_PER_DAY
+        for minute in range(base + start, base + end):
+            bits[minute >> 3] |= 1 << (minute & 7)
+
+    for interval in intervals:
+        start = _minutes(interval['start'])
+        end = _minutes(interval['end'])
+        for day in interval['days'] or range(1, 8):
+            if start <= end:
+                _mark(day - 1, start, end)
+            else:
+                _mark(day - 1, 0, end)
+                _mark(day - 1, start, MINUTES_PER_DAY)
+    return bytes(bits)
+
+
+def convert_schedules(apps, schema_editor):
+    BiddingTask = apps.get_model('main_app', 'BiddingTask')
+    for task in BiddingTask.objects.only('id', 'schedule').iterator():
+        intervals = _lenient_intervals(task.schedule)
+        BiddingTask.objects.filter(id=task.id).update(
+            schedule_data=intervals,
+            schedule_bitmap=_compile(intervals),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0011_biddingtask_last_run_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='biddingtask',
+            name='schedule_data',
+            field=models.JSONField(blank=True, default=list, verbose_name='Расписание'),
+        ),
+        migrations.AddField(
+            model_name='biddingtask',
+            name='schedule_bitmap',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(convert_schedules, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='biddingtask',
+            name='schedule',
+        ),
+        migrations.RenameField(
+            model_name='biddingtask',
+            old_name='schedule_data',
+            new_name='schedule',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.27 on 2026-10-17 22:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0012_structured_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='biddingtask',
+            name='bracket_high',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='biddingtask',
+            name='bracket_low',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='biddingtask',
+            name='strategy',
+            field=models.CharField(choices=[('linear', 'Шаг за шагом'), ('bracket', 'Вилка (быстрый подбор)')], default='linear', max_length=20, verbose_name='Стратегия ставки'),
+        ),
+    ]
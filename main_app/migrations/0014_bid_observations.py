@@ -0,0 +1,67 @@
+# Generated by Django 4.2.27 on 2026-10-17 22:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0013_biddingtask_strategy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BidObservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('observed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('position', models.PositiveSmallIntegerField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Наблюдение ставки',
+                'verbose_name_plural': 'Наблюдения ставок',
+            },
+        ),
+        migrations.CreateModel(
+            name='PositionModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('search_url', models.URLField(max_length=1000)),
+                ('hour_of_week', models.SmallIntegerField()),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('intercept', models.FloatField()),
+                ('slope', models.FloatField()),
+                ('fitted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Модель позиции',
+                'verbose_name_plural': 'Модели позиции',
+            },
+        ),
+        migrations.AddField(
+            model_name='biddingtask',
+            name='predicted_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='biddingtask',
+            name='strategy',
+            field=models.CharField(choices=[('linear', 'Шаг за шагом'), ('bracket', 'Вилка (быстрый подбор)'), ('model', 'По истории выдачи')], default='linear', max_length=20, verbose_name='Стратегия ставки'),
+        ),
+        migrations.AddConstraint(
+            model_name='positionmodel',
+            constraint=models.UniqueConstraint(fields=('search_url', 'hour_of_week'), name='position_model_url_hour_uniq'),
+        ),
+        migrations.AddField(
+            model_name='bidobservation',
+            name='task',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='observations', to='main_app.biddingtask'),
+        ),
+        migrations.AddIndex(
+            model_name='bidobservation',
+            index=models.Index(fields=['task', '-observed_at'], name='observation_task_recent_idx'),
+        ),
+    ]
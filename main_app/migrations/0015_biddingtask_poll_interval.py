@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-17 22:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0014_bid_observations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='biddingtask',
+            name='poll_interval',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Интервал проверки, сек'),
+        ),
+    ]
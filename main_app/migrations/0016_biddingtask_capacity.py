@@ -0,0 +1,23 @@
+# Generated by Django 4.2.27 on 2026-10-17 22:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0015_biddingtask_poll_interval'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='biddingtask',
+            name='capacity_interval',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='biddingtask',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Обычный'), (2, 'Высокий'), (3, 'Максимальный')], default=1, verbose_name='Приоритет проверок'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Одна активная задача на объявление аккаунта в одной выдаче.
+# Данные миграция не трогает: если активные дубликаты есть, она
+# останавливается — сначала manage.py find_duplicate_tasks --deactivate
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicates(apps, schema_editor):
+    BiddingTask = apps.get_model('main_app', 'BiddingTask')
+    groups = (
+        BiddingTask.objects.filter(is_active=True, avito_account__isnull=False)
+        .values('avito_account', 'ad_id', 'search_url')
+        .annotate(copies=Count('id'))
+        .filter(copies__gt=1)
+        .order_by()
+    )
+    found = groups.count()
+    if found:
+        raise RuntimeError(
+            f"Есть активные дубликаты задач (аккаунт, объявление, выдача), групп: {found}. "
+            f"Посмотреть: manage.py find_duplicate_tasks; выключить лишние: "
+            f"manage.py find_duplicate_tasks --deactivate — и повторить migrate."
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0016_biddingtask_capacity'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='biddingtask',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('avito_account', 'ad_id', 'search_url'), name='task_account_ad_url_uniq'),
+        ),
+    ]
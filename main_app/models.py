@@ -1,12 +1,11 @@
 # main_app/models.py - ИЗМЕНЕНИЯ ДЛЯ ЭТАПА 3 (НЕСКОЛЬКО АККАУНТОВ)
 
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 from encrypted_model_fields.fields import EncryptedCharField
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from celery import current_app
-import random
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 # +++ ШАГ 1: НОВАЯ МОДЕЛЬ ДЛЯ АККАУНТОВ AVITO +++
@@ -29,6 +28,12 @@ class AvitoAccount(models.Model):
     )
     avito_client_id = EncryptedCharField(max_length=255, verbose_name="Avito Client ID")
     avito_client_secret = EncryptedCharField(max_length=255, verbose_name="Avito Client Secret")
+    # ID пользователя Avito — запрашивается один раз, сбрасывается при смене ключей
+    avito_user_id = models.BigIntegerField(null=True, blank=True, editable=False, verbose_name="ID пользователя Avito")
+    # Балансы обновляет периодическая задача refresh_balances
+    real_balance = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, editable=False, verbose_name="Баланс (₽)")
+    bonus_balance = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, editable=False, verbose_name="Аванс (₽)")
+    balance_updated_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name="Балансы обновлены")
     
     def __str__(self):
         return f"Аккаунт Avito '{self.name}' ({self.user.username})"
@@ -70,6 +75,28 @@ class BiddingTask(models.Model):
     bid_step = models.DecimalField(max_digits=10, decimal_places=2, default=1.00, verbose_name="Шаг ставки (₽)")
     target_position_min = models.PositiveIntegerField(default=1, verbose_name="Целевая позиция (от)")
     target_position_max = models.PositiveIntegerField(default=10, verbose_name="Целевая позиция (до)")
+    # Как подбирать ставку, см. main_app.strategies
+    STRATEGY_CHOICES = [
+        ('linear', 'Шаг за шагом'),
+        ('bracket', 'Вилка (быстрый подбор)'),
+        ('model', 'По истории выдачи'),
+    ]
+    strategy = models.CharField(max_length=20, choices=STRATEGY_CHOICES, default='linear',
+                                verbose_name="Стратегия ставки")
+    # Вес задачи при нехватке мощности прокси (main_app.capacity)
+    PRIORITY_CHOICES = [(1, 'Обычный'), (2, 'Высокий'), (3, 'Максимальный')]
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=1,
+                                                verbose_name="Приоритет проверок")
+    # Вилка стратегии bracket: ставка, при которой объявление не было в цели,
+    # и ставка, при которой было. NULL — граница ещё не найдена
+    bracket_low = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                      editable=False)
+    bracket_high = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                       editable=False)
+    # Ставка, при которой модель выдачи ждёт target_position_max в текущий час
+    # (стратегия model, main_app.price_model). NULL — модели нет
+    predicted_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                          editable=False)
     daily_budget = models.DecimalField(
     max_digits=10,
     decimal_places=2,
@@ -85,11 +112,28 @@ class BiddingTask(models.Model):
     
     current_position = models.PositiveIntegerField(null=True, blank=True, verbose_name="Текущая позиция в выдаче")
     current_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Текущая ставка")
-    schedule = models.TextField(default="[]", blank=True, verbose_name="Расписание (JSON-строка)")
+    # [{"days": [1..7], "start": "HH:MM", "end": "HH:MM"}, ...], см. main_app.schedule
+    schedule = models.JSONField(default=list, blank=True, verbose_name="Расписание")
+    # Скомпилированное расписание: битовая карта минут недели, NULL — круглосуточно
+    schedule_bitmap = models.BinaryField(null=True, blank=True, editable=False)
     
     is_active = models.BooleanField(default=True, verbose_name="Активен")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
 
+    # Когда задачу заберёт планировщик (main_app.scheduler). NULL — как можно скорее
+    next_run_at = models.DateTimeField(null=True, blank=True, verbose_name="Следующий запуск")
+    # Начало последнего цикла — аренда против частых и двойных запусков
+    # (main_app.scheduler.claim_task_runs)
+    last_run_at = models.DateTimeField(null=True, blank=True, editable=False,
+                                       verbose_name="Последний запуск")
+    # Пауза между циклами в окне по итогам последних циклов (main_app.bidding).
+    # NULL — ещё не считали, BID_CYCLE_SECONDS
+    poll_interval = models.PositiveIntegerField(null=True, blank=True, editable=False,
+                                                verbose_name="Интервал проверки, сек")
+    # Не чаще этого (сек), пока мощности прокси не хватает на всех
+    # (main_app.capacity). NULL — без ограничения
+    capacity_interval = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
     def __str__(self):
         return f"Задание #{self.id} для объявления {self.ad_id}"
 
@@ -97,6 +141,43 @@ class BiddingTask(models.Model):
         verbose_name = "Задание для биддера"
         verbose_name_plural = "Задания для биддера"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_active', 'next_run_at'], name='task_due_idx'),
+        ]
+        constraints = [
+            # Одно объявление аккаунта в одной выдаче — одна активная задача
+            # (старые дубликаты выключает команда find_duplicate_tasks)
+            models.UniqueConstraint(fields=['avito_account', 'ad_id', 'search_url'],
+                                    condition=models.Q(is_active=True),
+                                    name='task_account_ad_url_uniq'),
+        ]
+
+
+# --- МОБИЛЬНЫЕ ПРОКСИ ДЛЯ ВЫДАЧИ ---
+class ProxyServer(models.Model):
+    """
+    Прокси из пула загрузки выдачи (main_app.proxy_pool).
+    Изменения подхватываются воркерами без перезапуска.
+    """
+    host = models.CharField(max_length=255, default='mproxy.site', verbose_name="Хост")
+    port = models.PositiveIntegerField(unique=True, verbose_name="Порт")
+    user = models.CharField(max_length=100, verbose_name="Логин")
+    password = EncryptedCharField(max_length=255, verbose_name="Пароль")
+    change_ip_url = EncryptedCharField(max_length=500, verbose_name="Ссылка смены IP")
+    rpm_limit = models.PositiveIntegerField(
+        default=20,
+        verbose_name="Запросов в минуту",
+        help_text="Бюджет запросов выдачи через этот прокси на весь кластер"
+    )
+    is_active = models.BooleanField(default=True, verbose_name="Активен")
+
+    def __str__(self):
+        return f"Прокси {self.host}:{self.port}"
+
+    class Meta:
+        verbose_name = "Прокси"
+        verbose_name_plural = "Прокси"
+        ordering = ['port']
 
 
 # --- МОДЕЛЬ ПРОФИЛЯ ---
@@ -119,7 +200,8 @@ class UserProfile(models.Model):
 class TaskLog(models.Model):
     # ... (код без изменений) ...
     task = models.ForeignKey(BiddingTask, on_delete=models.CASCADE, related_name='logs')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Время события, а не вставки: записи пишутся пачками (log_sink)
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)
     LEVEL_CHOICES = [('INFO', 'Информация'), ('WARNING', 'Предупреждение'), ('ERROR', 'Ошибка')]
     level = models.CharField(max_length=10, choices=LEVEL_CHOICES, default='INFO')
     message = models.TextField(verbose_name="Сообщение лога")
@@ -129,6 +211,82 @@ class TaskLog(models.Model):
         verbose_name = "Запись лога"
         verbose_name_plural = "Записи логов"
         ordering = ['-timestamp']
+        indexes = [
+            # Последние логи задачи (task_detail_view)
+            models.Index(fields=['task', '-timestamp'], name='tasklog_task_recent_idx'),
+        ]
+
+
+class TaskLogDailySummary(models.Model):
+    """
+    Итоги логов задачи за день. Заполняется перед удалением старых
+    записей TaskLog (main_app/log_storage.py) и хранится дольше них.
+    """
+    task = models.ForeignKey(BiddingTask, on_delete=models.CASCADE, related_name='daily_summaries')
+    day = models.DateField(verbose_name="День")
+    entries = models.PositiveIntegerField(default=0, verbose_name="Записей")
+    cycles = models.PositiveIntegerField(default=0, verbose_name="Циклов")
+    raises = models.PositiveIntegerField(default=0, verbose_name="Повышений")
+    drops = models.PositiveIntegerField(default=0, verbose_name="Понижений")
+    errors = models.PositiveIntegerField(default=0, verbose_name="Ошибок")
+
+    def __str__(self):
+        return f"Итоги задачи #{self.task_id} за {self.day}"
+
+    class Meta:
+        verbose_name = "Итоги логов за день"
+        verbose_name_plural = "Итоги логов по дням"
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'day'], name='tasklog_summary_task_day_uniq'),
+        ]
+
+
+# --- НАБЛЮДЕНИЯ «СТАВКА → ПОЗИЦИЯ» (main_app/price_model.py) ---
+class BidObservation(models.Model):
+    """Позиция объявления при ставке price; пишется каждым циклом в расписании."""
+    task = models.ForeignKey(BiddingTask, on_delete=models.CASCADE, related_name='observations')
+    observed_at = models.DateTimeField(default=timezone.now, db_index=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    # NULL — объявления нет в топ-50
+    position = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"#{self.task_id}: {self.price} ₽ → {self.position or '—'}"
+
+    class Meta:
+        verbose_name = "Наблюдение ставки"
+        verbose_name_plural = "Наблюдения ставок"
+        indexes = [
+            models.Index(fields=['task', '-observed_at'], name='observation_task_recent_idx'),
+        ]
+
+
+class PositionModel(models.Model):
+    """
+    Кривая «ставка → позиция» выдачи в час недели:
+    position ≈ intercept + slope · ln(price). hour_of_week — 0 (пн 00:00)
+    … 167; ALL_WEEK — модель по всем часам (когда часу не хватает данных).
+    """
+    ALL_WEEK = -1
+
+    search_url = models.URLField(max_length=1000)
+    hour_of_week = models.SmallIntegerField()
+    samples = models.PositiveIntegerField(default=0)
+    intercept = models.FloatField()
+    slope = models.FloatField()
+    fitted_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.search_url} [{self.hour_of_week}]"
+
+    class Meta:
+        verbose_name = "Модель позиции"
+        verbose_name_plural = "Модели позиции"
+        constraints = [
+            models.UniqueConstraint(fields=['search_url', 'hour_of_week'],
+                                    name='position_model_url_hour_uniq'),
+        ]
 
 
 # --- СИГНАЛЫ (без изменений) ---
@@ -136,9 +294,3 @@ class TaskLog(models.Model):
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
-
-@receiver(post_save, sender=BiddingTask)
-def auto_start_bidding(sender, instance, created, **kwargs):
-    if created and instance.is_active:  # только при создании
-        delay = random.randint(180, 480)  # 3–8 минут
-        current_app.send_task('main_app.tasks.run_bidding_for_task', args=[instance.id], countdown=delay)
\ No newline at end of file
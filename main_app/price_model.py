@@ -0,0 +1,191 @@
+# main_app/price_model.py
+"""
+Модель выдачи «ставка → позиция».
+
+Каждый цикл в расписании оставляет наблюдение BidObservation: ставка и
+позиция объявления (NULL — не в топ-50, для модели это NOT_FOUND_POSITION).
+Периодическая refresh_price_models:
+
+1. одним GROUP BY по всем наблюдениям за PRICE_MODEL_WINDOW_DAYS считает
+   суммы для метода наименьших квадратов по каждой паре (search_url,
+   час недели) и по каждому search_url целиком — все модели подгоняются
+   разом, в БД, без выгрузки наблюдений;
+2. сохраняет PositionModel: position ≈ intercept + slope · ln(price);
+3. задачам со стратегией model ставит predicted_price — ставку, при которой
+   модель текущего часа (или всей недели) ждёт target_position_max;
+4. удаляет наблюдения старше окна.
+
+Как прогнозом пользуется цикл — strategies.model_price.
+"""
+
+import math
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Union, Dict, List, Tuple
+
+from django.conf import settings
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.functions import Cast, Coalesce, ExtractHour, ExtractIsoWeekDay, Ln
+from django.utils import timezone
+
+from .models import BiddingTask, BidObservation, PositionModel
+from .schedule import week_minute
+
+logger = logging.getLogger(__name__)
+
+# За сколько дней наблюдения участвуют в модели (и сколько хранятся)
+PRICE_MODEL_WINDOW_DAYS = getattr(settings, 'PRICE_MODEL_WINDOW_DAYS', 28)
+# Меньше наблюдений — модели нет
+PRICE_MODEL_MIN_SAMPLES = getattr(settings, 'PRICE_MODEL_MIN_SAMPLES', 12)
+
+# «Не найдено в топ-50» для модели — позиция сразу за выдачей
+NOT_FOUND_POSITION = 51
+# Прогноз дороже — считаем, что цель этой выдачей недостижима
+PREDICTED_PRICE_CAP = 10 ** 6
+MODEL_BATCH_SIZE = 500
+
+
+def hour_of_week(moment: datetime = None) -> int:
+    """Час недели в TIME_ZONE: 0 — пн 00:00, 167 — вс 23:00."""
+    return week_minute(moment) // 60
+
+
+# =============================================================
+# ПОДГОНКА
+# =============================================================
+
+def _sums(since: datetime, hourly: bool) -> List[Dict]:
+    """Суммы МНК по выдачам (и часам недели) — один запрос на все задачи."""
+    rows = (
+        BidObservation.objects
+        .filter(observed_at__gte=since, price__gt=0)
+        .annotate(
+            x=Ln(Cast('price', FloatField())),
+            y=Cast(Coalesce('position', NOT_FOUND_POSITION), FloatField()),
+        )
+    )
+    group = ['task__search_url']
+    if hourly:
+        rows = rows.annotate(
+            how=(ExtractIsoWeekDay('observed_at') - 1) * 24 + ExtractHour('observed_at')
+        )
+        group.append('how')
+    return list(
+        rows.values(*group)
+        .annotate(
+            n=Count('id'),
+            sx=Sum('x'),
+            sy=Sum('y'),
+            sxx=Sum(F('x') * F('x')),
+            sxy=Sum(F('x') * F('y')),
+        )
+        .order_by()
+    )
+
+
+def _solve(row: Dict) -> Union[Tuple[float, float], None]:
+    """(intercept, slope) прямой y = a + b·x или None, если кривой нет."""
+    n = row['n']
+    if n < PRICE_MODEL_MIN_SAMPLES:
+        return None
+    spread = n * row['sxx'] - row['sx'] ** 2
+    if spread <= 1e-9 * n * n:
+        # Ставка почти не менялась — наклон не оценить
+        return None
+    slope = (n * row['sxy'] - row['sx'] * row['sy']) / spread
+    if slope >= 0:
+        # Дороже — не выше: зависимости в данных нет
+        return None
+    return (row['sy'] - slope * row['sx']) / n, slope
+
+
+def fit_position_models(moment: datetime = None) -> int:
+    """Подгоняет все модели по окну наблюдений, устаревшие удаляет."""
+    moment = moment or timezone.now()
+    since = moment - timedelta(days=PRICE_MODEL_WINDOW_DAYS)
+
+    models = []
+    for hourly in (True, False):
+        for row in _sums(since, hourly):
+            fit = _solve(row)
+            if fit is None:
+                continue
+            models.append(PositionModel(
+                search_url=row['task__search_url'],
+                hour_of_week=row['how'] if hourly else PositionModel.ALL_WEEK,
+                samples=row['n'],
+                intercept=fit[0],
+                slope=fit[1],
+                fitted_at=moment,
+            ))
+
+    PositionModel.objects.bulk_create(
+        models,
+        batch_size=MODEL_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['search_url', 'hour_of_week'],
+        update_fields=['samples', 'intercept', 'slope', 'fitted_at'],
+    )
+    PositionModel.objects.filter(fitted_at__lt=moment).delete()
+    return len(models)
+
+
+# =============================================================
+# ПРОГНОЗ
+# =============================================================
+
+def predict_price(model: PositionModel, target_position: int) -> Union[float, None]:
+    """Ставка, при которой модель ждёт target_position; None — недостижимо."""
+    exponent = (target_position - model.intercept) / model.slope
+    if exponent > math.log(PREDICTED_PRICE_CAP):
+        return None
+    return round(math.exp(exponent), 2)
+
+
+def update_predictions(moment: datetime = None) -> int:
+    """predicted_price задач со стратегией model на текущий час недели."""
+    how = hour_of_week(moment)
+    tasks = list(
+        BiddingTask.objects
+        .filter(is_active=True, strategy='model')
+        .only('id', 'search_url', 'target_position_max', 'predicted_price')
+    )
+    if not tasks:
+        return 0
+
+    models = {
+        (m.search_url, m.hour_of_week): m
+        for m in PositionModel.objects.filter(
+            search_url__in={t.search_url for t in tasks},
+            hour_of_week__in=[how, PositionModel.ALL_WEEK],
+        )
+    }
+    predicted = 0
+    for task in tasks:
+        model = (models.get((task.search_url, how))
+                 or models.get((task.search_url, PositionModel.ALL_WEEK)))
+        price = predict_price(model, task.target_position_max) if model else None
+        task.predicted_price = Decimal(str(price)) if price is not None else None
+        predicted += price is not None
+
+    BiddingTask.objects.bulk_update(tasks, ['predicted_price'], batch_size=MODEL_BATCH_SIZE)
+    return predicted
+
+
+# =============================================================
+# ОБСЛУЖИВАНИЕ
+# =============================================================
+
+def refresh_price_models() -> Dict:
+    """Подгонка моделей, прогнозы задач и удаление старых наблюдений."""
+    moment = timezone.now()
+    fitted = fit_position_models(moment)
+    predicted = update_predictions(moment)
+    pruned, _ = BidObservation.objects.filter(
+        observed_at__lt=moment - timedelta(days=PRICE_MODEL_WINDOW_DAYS)
+    ).delete()
+
+    result = {'models': fitted, 'predicted': predicted, 'pruned': pruned}
+    logger.info(f"[MODEL] Модели выдачи обновлены: {result}")
+    return result
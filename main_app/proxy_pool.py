@@ -0,0 +1,479 @@
+# main_app/proxy_pool.py
+"""
+Пул мобильных прокси для загрузки выдачи.
+
+Список прокси — данные (модель ProxyServer, запасной вариант —
+settings.PROXY_POOL). Воркеры перечитывают его без перезапуска: после
+изменения в админке растёт proxy_pool:version в Redis.
+
+Состояние прокси общее для всего кластера и живёт в Redis:
+- статистика по минутам (успехи, 429/403/капча, ошибки, задержка) —
+  скользящее окно PROXY_STATS_WINDOW_MINUTES;
+- бюджет запросов в минуту на прокси (rpm_limit);
+- охлаждение после блока — растёт с каждым блоком подряд.
+
+choose_proxy выбирает прокси случайно с весом по здоровью среди тех,
+что не охлаждаются и не исчерпали бюджет минуты.
+
+Смена IP — аренда на прокси (читатели/писатель): каждый запрос через прокси
+регистрируется в proxy_inflight, смену IP запрашивает ровно один воркер
+(request_rotation), после чего новые запросы на этот прокси не выдаются.
+Задача rotate_proxy ждёт, пока текущие запросы закончатся, меняет IP,
+выжидает ROTATION_SETTLE_SECONDS и снимает аренду — загрузки, не нашедшие
+прокси, повторяются через PROXY_WAIT_SECONDS и подхватывают его сами.
+"""
+
+import time
+import random
+import logging
+from typing import Union, Dict, List
+
+import uuid
+
+import redis
+from celery import current_app
+from django.conf import settings
+
+from .avito_api import rotate_proxy_ip
+from .redis_client import redis_client as _redis, release_lock, extend_lock
+
+logger = logging.getLogger(__name__)
+
+# Как часто воркер сверяет версию пула в Redis
+PROXY_POOL_RELOAD_SECONDS = getattr(settings, 'PROXY_POOL_RELOAD_SECONDS', 10)
+PROXY_STATS_WINDOW_MINUTES = getattr(settings, 'PROXY_STATS_WINDOW_MINUTES', 5)
+PROXY_DEFAULT_RPM = getattr(settings, 'PROXY_DEFAULT_RPM', 20)
+# Охлаждение после блока: 60, 120, 240... сек, не больше PROXY_COOLDOWN_MAX
+PROXY_COOLDOWN_SECONDS = getattr(settings, 'PROXY_COOLDOWN_SECONDS', 60)
+PROXY_COOLDOWN_MAX = getattr(settings, 'PROXY_COOLDOWN_MAX', 900)
+# Сглаживание оценки устойчивой скорости прокси (sustainable_rpm) и её минимум
+PROXY_SUSTAINABLE_ALPHA = 0.3
+PROXY_MIN_SUSTAINABLE_RPM = 1.0
+# Через сколько повторить загрузку, если свободных прокси нет
+PROXY_WAIT_SECONDS = getattr(settings, 'PROXY_WAIT_SECONDS', 10)
+# Сколько секунд после смены IP прокси ещё не готов принимать запросы
+ROTATION_SETTLE_SECONDS = 8
+# Смена IP на одном прокси — не чаще раза в ROTATION_MIN_INTERVAL сек
+ROTATION_MIN_INTERVAL = getattr(settings, 'ROTATION_MIN_INTERVAL', 60)
+# Сколько ждём завершения текущих запросов перед сменой IP
+ROTATION_DRAIN_TIMEOUT = getattr(settings, 'ROTATION_DRAIN_TIMEOUT', 20)
+ROTATION_LEASE_TTL = ROTATION_DRAIN_TIMEOUT + ROTATION_SETTLE_SECONDS + 30
+# Запрос через прокси считается живым не дольше этого (таймаут запроса + запас)
+INFLIGHT_TTL = 45
+
+POOL_VERSION_KEY = 'proxy_pool:version'
+
+OUTCOME_OK = 'ok'
+OUTCOME_BLOCKED = 'blocked'   # 429/403/капча/пустая выдача
+OUTCOME_ERROR = 'error'       # сеть, 5xx
+
+_pool = None
+_pool_version = None
+_pool_checked_at = 0.0
+
+
+# =============================================================
+# СПИСОК ПРОКСИ
+# =============================================================
+
+def proxy_url(proxy: Dict) -> str:
+    return f'http://{proxy["user"]}:{proxy["pass"]}@{proxy["host"]}:{proxy["port"]}'
+
+
+def _load_pool() -> List[Dict]:
+    from .models import ProxyServer
+
+    pool = [
+        {
+            'user': server.user,
+            'pass': server.password,
+            'host': server.host,
+            'port': server.port,
+            'change_ip_url': server.change_ip_url,
+            'rpm_limit': server.rpm_limit,
+        }
+        for server in ProxyServer.objects.filter(is_active=True).order_by('port')
+    ]
+    if not pool:
+        pool = [dict(p) for p in getattr(settings, 'PROXY_POOL', [])]
+    logger.info(f"[PROXY] Пул загружен: {len(pool)} прокси")
+    return pool
+
+
+def _read_version():
+    try:
+        return _redis.get(POOL_VERSION_KEY)
+    except redis.RedisError:
+        return _pool_version
+
+
+def active_proxies() -> List[Dict]:
+    """Текущий пул; перечитывается из БД, если его версия в Redis сменилась."""
+    global _pool, _pool_version, _pool_checked_at
+    now = time.time()
+    if _pool is None or now - _pool_checked_at >= PROXY_POOL_RELOAD_SECONDS:
+        version = _read_version()
+        if _pool is None or version != _pool_version:
+            _pool = _load_pool()
+            _pool_version = version
+        _pool_checked_at = now
+    return _pool
+
+
+def bump_pool_version():
+    """Сообщает всем воркерам, что пул изменился."""
+    try:
+        _redis.incr(POOL_VERSION_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"[PROXY] Не удалось обновить версию пула: {e}")
+
+
+# =============================================================
+# СТАТИСТИКА И ОХЛАЖДЕНИЕ
+# =============================================================
+
+def _minute(now: float) -> int:
+    return int(now // 60)
+
+
+def _stats_key(port: int, minute: int) -> str:
+    return f'proxy_stats:{port}:{minute}'
+
+
+def report_result(proxy: Dict, outcome: str, latency: float = None):
+    """Записывает исход запроса через прокси; после блока — охлаждение."""
+    port = proxy['port']
+    key = _stats_key(port, _minute(time.time()))
+    try:
+        pipe = _redis.pipeline()
+        pipe.hincrby(key, outcome, 1)
+        if latency is not None and outcome == OUTCOME_OK:
+            pipe.hincrby(key, 'latency_ms', int(latency * 1000))
+        pipe.expire(key, (PROXY_STATS_WINDOW_MINUTES + 1) * 60)
+        if outcome == OUTCOME_OK:
+            pipe.delete(f'proxy_blocks:{port}')
+        pipe.execute()
+
+        if outcome == OUTCOME_BLOCKED:
+            streak = _redis.incr(f'proxy_blocks:{port}')
+            _redis.expire(f'proxy_blocks:{port}', PROXY_COOLDOWN_MAX * 2)
+            cooldown = min(PROXY_COOLDOWN_MAX, PROXY_COOLDOWN_SECONDS * 2 ** (streak - 1))
+            _redis.set(f'proxy_cooldown:{port}', 1, ex=int(cooldown))
+            logger.warning(f"[PROXY] Порт {port} охлаждается {int(cooldown)} сек (блок #{streak})")
+    except redis.RedisError as e:
+        logger.warning(f"[PROXY] Статистика недоступна: {e}")
+
+
+def proxy_health(ports: List[int]) -> Dict[int, Dict]:
+    """
+    Статистика прокси за окно: {port: {'ok', 'blocked', 'error',
+    'latency', 'score', 'cooling', 'settling', 'rpm_used'}}.
+    cooling — охлаждается после блока или сейчас меняет IP.
+    """
+    now = time.time()
+    minute = _minute(now)
+    minutes = range(minute - PROXY_STATS_WINDOW_MINUTES + 1, minute + 1)
+    result = {}
+    try:
+        pipe = _redis.pipeline()
+        for port in ports:
+            for m in minutes:
+                pipe.hgetall(_stats_key(port, m))
+            pipe.exists(f'proxy_cooldown:{port}', f'proxy_rotating:{port}')
+            pipe.get(f'proxy_rotation:{port}')
+            pipe.get(f'proxy_rpm:{port}:{minute}')
+        replies = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"[PROXY] Статистика недоступна: {e}")
+        replies = None
+
+    per_port = len(minutes) + 3
+    for i, port in enumerate(ports):
+        totals = {'ok': 0, 'blocked': 0, 'error': 0, 'latency_ms': 0}
+        cooling = settling = False
+        rpm_used = 0
+        if replies is not None:
+            chunk = replies[i * per_port:(i + 1) * per_port]
+            for bucket in chunk[:-3]:
+                for field, value in bucket.items():
+                    field = field.decode()
+                    if field in totals:
+                        totals[field] += int(value)
+            cooling = bool(chunk[-3])
+            rotated_at = chunk[-2]
+            settling = bool(rotated_at) and now - float(rotated_at) < ROTATION_SETTLE_SECONDS
+            rpm_used = int(chunk[-1] or 0)
+
+        ok, blocked, error = totals['ok'], totals['blocked'], totals['error']
+        latency = totals['latency_ms'] / ok / 1000 if ok else None
+        # Сглаженная доля успехов; блоки штрафуем сильнее сетевых ошибок
+        success = (ok + 1) / (ok + 3 * blocked + error + 2)
+        score = max(0.02, success ** 2 / (1 + (latency or 0)))
+        result[port] = {
+            'ok': ok, 'blocked': blocked, 'error': error,
+            'latency': latency, 'score': score,
+            'cooling': cooling, 'settling': settling, 'rpm_used': rpm_used,
+        }
+    return result
+
+
+def sustainable_rpm(pool: List[Dict] = None, update: bool = True) -> Dict[int, float]:
+    """
+    Устойчивая скорость прокси, запросов в минуту: {port: rpm}.
+
+    Пока блоков в окне статистики нет — это rpm_limit; с блоками — сколько
+    успешных запросов в минуту прокси реально пропускал. Оценка сглаживается
+    между замерами (PROXY_SUSTAINABLE_ALPHA) и хранится в Redis;
+    update=False — только прочитать, не обновляя.
+    """
+    pool = active_proxies() if pool is None else pool
+    if not pool:
+        return {}
+    ports = [p['port'] for p in pool]
+    health = proxy_health(ports)
+    try:
+        previous = _redis.mget([f'proxy_sustainable:{port}' for port in ports])
+    except redis.RedisError:
+        previous = [None] * len(ports)
+
+    result = {}
+    for proxy, prev in zip(pool, previous):
+        port = proxy['port']
+        limit = float(proxy.get('rpm_limit') or PROXY_DEFAULT_RPM)
+        stats = health[port]
+        if stats['blocked']:
+            observed = min(limit, stats['ok'] / PROXY_STATS_WINDOW_MINUTES)
+        elif stats['ok'] or stats['error']:
+            observed = limit
+        else:
+            observed = None  # запросов не было — оценка прежняя
+        prev = float(prev) if prev is not None else None
+        if observed is None:
+            value = prev if prev is not None else limit
+        elif prev is None:
+            value = observed
+        else:
+            value = prev + PROXY_SUSTAINABLE_ALPHA * (observed - prev)
+        result[port] = max(PROXY_MIN_SUSTAINABLE_RPM, min(limit, value))
+
+    if update:
+        try:
+            pipe = _redis.pipeline()
+            for port, value in result.items():
+                pipe.set(f'proxy_sustainable:{port}', value, ex=24 * 3600)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"[PROXY] Не удалось сохранить устойчивую скорость: {e}")
+    return result
+
+
+def _budget_key(port: int) -> str:
+    return f'proxy_rpm:{port}:{_minute(time.time())}'
+
+
+def _take_budget(proxy: Dict, key: str) -> bool:
+    """Занимает один запрос из бюджета минуты прокси."""
+    limit = proxy.get('rpm_limit') or PROXY_DEFAULT_RPM
+    try:
+        pipe = _redis.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, 120)
+        used, _ = pipe.execute()
+        if used > limit:
+            _redis.decr(key)
+            return False
+    except redis.RedisError:
+        pass
+    return True
+
+
+def _refund_budget(key: str):
+    """Возвращает в бюджет запрос, который так и не ушёл через прокси."""
+    try:
+        _redis.decr(key)
+    except redis.RedisError:
+        pass
+
+
+# =============================================================
+# ВЫБОР ПРОКСИ
+# =============================================================
+
+def choose_proxy(exclude_port: int = None) -> Union[Dict, None]:
+    """
+    Прокси для следующего запроса выдачи или None, если все охлаждаются,
+    меняют IP или исчерпали бюджет минуты. exclude_port — прокси прошлой
+    попытки, его берём, только если других нет.
+
+    Запрос регистрируется как выполняющийся (proxy['lease']) — после
+    ответа обязательно end_request(proxy).
+    """
+    pool = active_proxies()
+    if not pool:
+        return None
+
+    health = proxy_health([p['port'] for p in pool])
+    candidates = [p for p in pool if not health[p['port']]['cooling']]
+    # Прокси, у которых только что сменился IP, и прокси прошлой попытки —
+    # в последнюю очередь
+    ready = [p for p in candidates
+             if not health[p['port']]['settling'] and p['port'] != exclude_port]
+    settling = [p for p in candidates
+                if health[p['port']]['settling'] and p['port'] != exclude_port]
+    excluded = [p for p in candidates if p['port'] == exclude_port]
+
+    for group in (ready, settling, excluded):
+        # Взвешенный порядок без повторов: ключ u^(1/w)
+        ordered = sorted(
+            group,
+            key=lambda p: random.random() ** (1 / health[p['port']]['score']),
+            reverse=True,
+        )
+        for proxy in ordered:
+            key = _budget_key(proxy['port'])
+            if not _take_budget(proxy, key):
+                continue
+            lease = begin_request(proxy['port'])
+            if lease:
+                return dict(proxy, lease=lease)
+            # Прокси меняет IP — запрос через него не пойдёт
+            _refund_budget(key)
+
+    logger.warning("[PROXY] Нет свободных прокси — все охлаждаются или без бюджета")
+    return None
+
+
+# =============================================================
+# СМЕНА IP — АРЕНДА НА ПРОКСИ
+# =============================================================
+
+# Новый запрос через прокси — только если он не меняет IP
+_BEGIN_REQUEST_LUA = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('zremrangebyscore', KEYS[2], '-inf', ARGV[3])
+redis.call('zadd', KEYS[2], ARGV[2], ARGV[1])
+redis.call('expire', KEYS[2], ARGV[4])
+return 1
+"""
+_begin_request_script = _redis.register_script(_BEGIN_REQUEST_LUA)
+
+# Аренду смены IP получает ровно один воркер, не чаще ROTATION_MIN_INTERVAL
+_REQUEST_ROTATION_LUA = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return 0
+end
+local last = redis.call('get', KEYS[2])
+if last and tonumber(ARGV[3]) - tonumber(last) < tonumber(ARGV[4]) then
+    return 0
+end
+redis.call('set', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+_request_rotation_script = _redis.register_script(_REQUEST_ROTATION_LUA)
+
+
+def _inflight_key(port: int) -> str:
+    return f'proxy_inflight:{port}'
+
+
+def _rotating_key(port: int) -> str:
+    return f'proxy_rotating:{port}'
+
+
+def begin_request(port: int) -> Union[str, None]:
+    """Регистрирует запрос через прокси. None — прокси сейчас меняет IP."""
+    token = uuid.uuid4().hex
+    now = time.time()
+    try:
+        started = _begin_request_script(
+            keys=[_rotating_key(port), _inflight_key(port)],
+            args=[token, now + INFLIGHT_TTL, now, INFLIGHT_TTL * 2],
+        )
+    except redis.RedisError:
+        return token
+    return token if started else None
+
+
+def end_request(proxy: Dict):
+    lease = proxy.get('lease')
+    if not lease:
+        return
+    try:
+        _redis.zrem(_inflight_key(proxy['port']), lease)
+    except redis.RedisError:
+        pass
+
+
+def _inflight_count(port: int) -> int:
+    try:
+        pipe = _redis.pipeline()
+        pipe.zremrangebyscore(_inflight_key(port), '-inf', time.time())
+        pipe.zcard(_inflight_key(port))
+        _, count = pipe.execute()
+        return count
+    except redis.RedisError:
+        return 0
+
+
+def request_rotation(proxy: Dict) -> bool:
+    """
+    Просит сменить IP прокси. Не блокирует: смену выполнит задача
+    rotate_proxy. Если смена уже идёт или была недавно — ничего не делает.
+    """
+    port = proxy['port']
+    lease = uuid.uuid4().hex
+    try:
+        won = _request_rotation_script(
+            keys=[_rotating_key(port), f'proxy_rotation:{port}'],
+            args=[lease, ROTATION_LEASE_TTL, time.time(), ROTATION_MIN_INTERVAL],
+        )
+    except redis.RedisError as e:
+        logger.warning(f"[PROXY] Аренда смены IP недоступна: {e}")
+        return False
+    if not won:
+        logger.info(f"[PROXY] Порт {port} — смена IP уже идёт или была недавно")
+        return False
+
+    current_app.send_task(
+        'main_app.tasks.rotate_proxy',
+        args=[port, lease, 'drain', time.time()],
+    )
+    logger.info(f"[PROXY] Порт {port} — смена IP запрошена, новые запросы идут мимо")
+    return True
+
+
+def _find_proxy(port: int) -> Union[Dict, None]:
+    for proxy in active_proxies():
+        if proxy['port'] == port:
+            return proxy
+    return None
+
+
+def rotation_step(port: int, lease: str, phase: str,
+                  started_at: float) -> Union[Dict, None]:
+    """
+    Шаг смены IP (вызывается из задачи rotate_proxy).
+    Возвращает {'phase', 'countdown'} для следующего шага или None — готово.
+    drain  — ждём окончания текущих запросов (не дольше ROTATION_DRAIN_TIMEOUT);
+    settle — IP сменён, ждём, пока прокси поднимется, затем снимаем аренду.
+    """
+    key = _rotating_key(port)
+
+    if phase == 'drain':
+        inflight = _inflight_count(port)
+        if inflight and time.time() - started_at < ROTATION_DRAIN_TIMEOUT:
+            return {'phase': 'drain', 'countdown': 1}
+        if inflight:
+            logger.warning(f"[PROXY] Порт {port}: {inflight} запросов не закончились — меняем IP")
+
+        proxy = _find_proxy(port)
+        if proxy is not None:
+            rotate_proxy_ip(proxy)
+        extend_lock(key, lease, ROTATION_LEASE_TTL)
+        return {'phase': 'settle', 'countdown': ROTATION_SETTLE_SECONDS}
+
+    release_lock(key, lease)
+    logger.info(f"[PROXY] Порт {port} снова принимает запросы")
+    return None
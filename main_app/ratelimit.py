@@ -0,0 +1,268 @@
+# main_app/ratelimit.py
+"""
+Распределённый ограничитель запросов к api.avito.ru.
+
+Token bucket в Redis на каждую пару (семейство эндпоинтов, аккаунт) и
+общий bucket на семейство для всего кластера. Семейства: token, core
+(core/cpa/items), cpxpromo (ставки).
+
+Скорость аккаунтного bucket подстраивается по AIMD: каждый успешный ответ
+прибавляет AIMD_INCREASE / rate (≈ +AIMD_INCREASE запросов/сек за секунду),
+429 или исчерпанный X-RateLimit-Remaining умножают скорость на AIMD_DECREASE,
+а Retry-After закрывает bucket до указанного времени.
+
+Аккаунт определяется по client_id (запрос токена) или по владельцу токена
+(обратная ссылка avito_token_owner:*, см. avito_api).
+
+Синхронный acquire ждёт очереди до RATE_LIMIT_MAX_WAIT сек — для воркеров.
+Веб-запросы оборачивают вызовы API в wait_limit(RATE_LIMIT_WEB_MAX_WAIT):
+при переполненной очереди пользователь сразу получает ошибку, а поток
+веб-сервера не спит.
+"""
+
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Union, Dict
+from urllib.parse import urlsplit
+
+import redis
+from django.conf import settings
+
+from .redis_client import redis_client as _redis, key_hash
+
+logger = logging.getLogger(__name__)
+
+# rate — стартовая скорость аккаунта (запросов/сек), min/max — пределы AIMD,
+# burst — запас bucket, global — потолок на весь кластер
+DEFAULT_RATE_LIMITS = {
+    'token': {'rate': 0.5, 'burst': 2, 'min': 0.05, 'max': 2, 'global': 5},
+    'core': {'rate': 2, 'burst': 5, 'min': 0.2, 'max': 10, 'global': 30},
+    'cpxpromo': {'rate': 3, 'burst': 6, 'min': 0.2, 'max': 15, 'global': 50},
+}
+RATE_LIMITS = {**DEFAULT_RATE_LIMITS, **getattr(settings, 'AVITO_RATE_LIMITS', {})}
+AIMD_INCREASE = getattr(settings, 'AIMD_INCREASE', 0.1)
+AIMD_DECREASE = getattr(settings, 'AIMD_DECREASE', 0.5)
+# Дольше этого запрос в очереди ограничителя не ждёт
+RATE_LIMIT_MAX_WAIT = getattr(settings, 'RATE_LIMIT_MAX_WAIT', 30)
+# То же для запросов из веб-страниц
+RATE_LIMIT_WEB_MAX_WAIT = getattr(settings, 'RATE_LIMIT_WEB_MAX_WAIT', 2)
+
+API_HOST = 'api.avito.ru'
+BUCKET_TTL = 3600
+
+
+# Берёт по токену из всех bucket'ов сразу или не берёт ни одного.
+# KEYS — bucket'ы, ARGV: now, затем по (rate, burst) на каждый ключ.
+# Возвращает 0 или сколько секунд ждать (строкой — Redis режет дробные числа).
+_ACQUIRE_LUA = """
+local now = tonumber(ARGV[1])
+local state = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local b = redis.call('hmget', key, 'tokens', 'ts', 'rate', 'blocked_until')
+    local rate = tonumber(b[3]) or tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local tokens = tonumber(b[1]) or burst
+    local ts = tonumber(b[2]) or now
+    local blocked = tonumber(b[4]) or 0
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    if blocked > now then
+        wait = math.max(wait, blocked - now)
+    elseif tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+    state[i] = {tokens, rate}
+end
+for i, key in ipairs(KEYS) do
+    local tokens = state[i][1]
+    if wait == 0 then
+        tokens = tokens - 1
+    end
+    redis.call('hset', key, 'tokens', tokens, 'ts', now, 'rate', state[i][2])
+    redis.call('expire', key, ARGV[#ARGV])
+end
+return tostring(wait)
+"""
+_acquire_script = _redis.register_script(_ACQUIRE_LUA)
+
+# Предел ожидания acquire в текущем потоке/контексте (см. wait_limit)
+_max_wait = contextvars.ContextVar('ratelimit_max_wait', default=RATE_LIMIT_MAX_WAIT)
+
+# AIMD: ARGV — event ('ok' | 'throttle'), now, rate по умолчанию, min, max,
+# прибавка, множитель, блокировка (сек)
+_ADJUST_LUA = """
+local now = tonumber(ARGV[2])
+local rate = tonumber(redis.call('hget', KEYS[1], 'rate')) or tonumber(ARGV[3])
+if ARGV[1] == 'ok' then
+    rate = math.min(tonumber(ARGV[5]), rate + tonumber(ARGV[6]) / rate)
+else
+    rate = math.max(tonumber(ARGV[4]), rate * tonumber(ARGV[7]))
+    local block = tonumber(ARGV[8])
+    if block > 0 then
+        redis.call('hset', KEYS[1], 'blocked_until', now + block)
+    end
+end
+redis.call('hset', KEYS[1], 'rate', rate)
+redis.call('expire', KEYS[1], 3600)
+return tostring(rate)
+"""
+_adjust_script = _redis.register_script(_ADJUST_LUA)
+
+
+# =============================================================
+# КТО И КУДА
+# =============================================================
+
+def family_for(url: str) -> Union[str, None]:
+    """Семейство эндпоинтов по URL; None — не API Avito, не ограничиваем."""
+    parts = urlsplit(url)
+    if parts.hostname != API_HOST:
+        return None
+    if parts.path.startswith('/token'):
+        return 'token'
+    if parts.path.startswith('/cpxpromo/'):
+        return 'cpxpromo'
+    return 'core'
+
+
+_token_accounts = {}
+_TOKEN_ACCOUNTS_MAX = 1000
+
+
+def account_for_client(client_id: str) -> str:
+    return key_hash(client_id)
+
+
+def account_for_token(access_token: str) -> str:
+    """Аккаунт по токену — тот же ключ, что у кэша токенов этого client_id."""
+    account = _token_accounts.get(access_token)
+    if account:
+        return account
+    try:
+        owner = _redis.get(f'avito_token_owner:{key_hash(access_token)}')
+    except redis.RedisError:
+        owner = None
+    # avito_token:{hash(client_id)} -> hash(client_id)
+    account = owner.decode().rsplit(':', 1)[-1] if owner else key_hash(access_token)
+    if len(_token_accounts) >= _TOKEN_ACCOUNTS_MAX:
+        _token_accounts.clear()
+    _token_accounts[access_token] = account
+    return account
+
+
+def account_for_request(headers: Union[Dict, None], data) -> str:
+    """Аккаунт по заголовку Authorization или client_id в теле запроса токена."""
+    auth = (headers or {}).get('Authorization', '')
+    if auth.startswith('Bearer '):
+        return account_for_token(auth[len('Bearer '):])
+    if isinstance(data, dict) and data.get('client_id'):
+        return account_for_client(data['client_id'])
+    return 'anonymous'
+
+
+# =============================================================
+# BUCKET'Ы
+# =============================================================
+
+def _bucket_key(family: str, account: str) -> str:
+    return f'ratelimit:{family}:{account}'
+
+
+def reserve(family: str, account: str) -> float:
+    """
+    Пытается взять разрешение на запрос. 0 — можно идти,
+    иначе через сколько секунд попробовать снова.
+    """
+    limits = RATE_LIMITS[family]
+    try:
+        wait = _acquire_script(
+            keys=[_bucket_key(family, account), _bucket_key(family, 'global')],
+            args=[time.time(),
+                  limits['rate'], limits['burst'],
+                  limits['global'], max(limits['burst'], limits['global']),
+                  BUCKET_TTL],
+        )
+    except redis.RedisError as e:
+        logger.warning(f"[RATE] Ограничитель недоступен: {e}")
+        return 0.0
+    return float(wait)
+
+
+@contextmanager
+def wait_limit(seconds: float):
+    """Внутри блока (или функции, как декоратор) acquire ждёт не дольше seconds."""
+    token = _max_wait.set(seconds)
+    try:
+        yield
+    finally:
+        _max_wait.reset(token)
+
+
+def acquire(family: str, account: str, max_wait: float = None) -> bool:
+    """
+    Ждёт своей очереди (синхронно). False — не дождались за max_wait
+    (по умолчанию — предел wait_limit или RATE_LIMIT_MAX_WAIT).
+    """
+    if max_wait is None:
+        max_wait = _max_wait.get()
+    deadline = time.monotonic() + max_wait
+    while True:
+        wait = reserve(family, account)
+        if wait <= 0:
+            return True
+        if time.monotonic() + wait > deadline:
+            logger.warning(f"[RATE] {family}: очередь дольше {max_wait} сек")
+            return False
+        time.sleep(wait)
+
+
+def _header_seconds(headers, name: str) -> Union[float, None]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def record_response(family: str, account: str, status_code: int, headers) -> Union[float, None]:
+    """
+    Подстраивает скорость аккаунта по ответу. Возвращает новую скорость
+    (запросов/сек) или None, если Redis недоступен.
+    """
+    limits = RATE_LIMITS[family]
+    remaining = _header_seconds(headers, 'X-RateLimit-Remaining')
+    retry_after = _header_seconds(headers, 'Retry-After')
+
+    if status_code == 429 or remaining == 0:
+        event = 'throttle'
+        block = retry_after
+        if block is None:
+            block = _header_seconds(headers, 'X-RateLimit-Reset') if remaining == 0 else 0
+        # Reset может прийти как unix-время — тогда это не пауза
+        if block is None or block > 3600:
+            block = 1.0
+    elif status_code < 400:
+        event, block = 'ok', 0
+    else:
+        return None
+
+    try:
+        rate = float(_adjust_script(
+            keys=[_bucket_key(family, account)],
+            args=[event, time.time(), limits['rate'], limits['min'], limits['max'],
+                  AIMD_INCREASE, AIMD_DECREASE, block],
+        ))
+    except redis.RedisError as e:
+        logger.warning(f"[RATE] Ограничитель недоступен: {e}")
+        return None
+
+    if event == 'throttle':
+        logger.warning(
+            f"[RATE] {family}: {status_code}, скорость аккаунта → {rate:.2f}/сек"
+            f"{f', пауза {block:.0f} сек' if block >= 1 else ''}"
+        )
+    return rate
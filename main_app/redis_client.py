@@ -0,0 +1,75 @@
+# main_app/redis_client.py
+
+import uuid
+import hashlib
+import logging
+from typing import Union
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Redis для синхронизации между воркерами и веб-процессами
+# (db=0 занят брокером Celery)
+redis_client = redis.Redis(host='localhost', port=6379, db=1)
+
+
+# Удаляем блокировку, только если она всё ещё наша
+_RELEASE_LOCK_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+_release_lock_script = redis_client.register_script(_RELEASE_LOCK_LUA)
+
+_EXTEND_LOCK_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_extend_lock_script = redis_client.register_script(_EXTEND_LOCK_LUA)
+
+
+def acquire_lock(key: str, ttl: int) -> Union[str, None]:
+    """Пытается взять блокировку без ожидания. Возвращает её токен или None."""
+    token = uuid.uuid4().hex
+    try:
+        if redis_client.set(key, token, nx=True, ex=ttl):
+            return token
+    except redis.RedisError as e:
+        logger.warning(f"[REDIS] Блокировка {key} недоступна: {e}")
+    return None
+
+
+def release_lock(key: str, token: Union[str, None]):
+    if not token:
+        return
+    try:
+        _release_lock_script(keys=[key], args=[token])
+    except redis.RedisError as e:
+        logger.warning(f"[REDIS] Не удалось снять блокировку {key}: {e}")
+
+
+def extend_lock(key: str, token: Union[str, None], ttl: int) -> bool:
+    """Продлевает блокировку, если она всё ещё наша."""
+    if not token:
+        return False
+    try:
+        return bool(_extend_lock_script(keys=[key], args=[token, ttl]))
+    except redis.RedisError as e:
+        logger.warning(f"[REDIS] Не удалось продлить блокировку {key}: {e}")
+        return False
+
+
+def is_locked(key: str) -> bool:
+    try:
+        return bool(redis_client.exists(key))
+    except redis.RedisError:
+        return False
+
+
+def key_hash(value: str) -> str:
+    """Короткий хэш для ключей Redis — без секретов в открытом виде."""
+    return hashlib.sha256(value.encode()).hexdigest()[:24]
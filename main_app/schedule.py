@@ -0,0 +1,203 @@
+# main_app/schedule.py
+"""
+Расписание задачи.
+
+BiddingTask.schedule — список интервалов [{"days": [1..7], "start": "HH:MM",
+"end": "HH:MM"}, ...] (1 — понедельник; пустой days — все дни; start > end —
+интервал через полночь: с start до конца дня и с начала дня до end).
+Пустой список — круглосуточно.
+
+При сохранении задачи расписание компилируется в битовую карту недели
+(10 080 минут = 1260 байт, BiddingTask.schedule_bitmap): проверка «сейчас
+в расписании» — один бит, следующая граница окна — поиск смены бита.
+Время берётся в TIME_ZONE проекта.
+"""
+
+import re
+import json
+from datetime import datetime, timedelta
+from typing import Union, Dict, List
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+BITMAP_BYTES = MINUTES_PER_WEEK // 8
+_WEEK_MASK = (1 << MINUTES_PER_WEEK) - 1
+
+# Задачи с общей границей окна (например, 09:00) просыпаются не разом,
+# а в пределах этого числа секунд — у каждой свой постоянный сдвиг
+SCHEDULE_RAMP_SECONDS = getattr(settings, 'SCHEDULE_RAMP_SECONDS', 120)
+# Окно не откроется никогда (все интервалы пустые) — заглядываем раз в столько
+SCHEDULE_IDLE_RECHECK_SECONDS = getattr(settings, 'SCHEDULE_IDLE_RECHECK_SECONDS', 6 * 3600)
+
+_TIME_RE = re.compile(r'^([01]?\d|2[0-3]):([0-5]\d)$')
+
+
+# =============================================================
+# ПРОВЕРКА И НОРМАЛИЗАЦИЯ
+# =============================================================
+
+def _parse_minutes(value) -> int:
+    match = _TIME_RE.match(str(value or '').strip())
+    if not match:
+        raise ValidationError(f"Неверное время «{value}», нужно ЧЧ:ММ")
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def normalize_schedule(value) -> List[Dict]:
+    """
+    Расписание из формы, API или старой JSON-строки — в канонический вид.
+    Понимает ключи startTime/endTime (редактор задачи) и start/end.
+    """
+    if value in (None, ''):
+        return []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            raise ValidationError("Расписание должно быть JSON-списком")
+    if not isinstance(value, list):
+        raise ValidationError("Расписание должно быть списком интервалов")
+
+    intervals = []
+    for interval in value:
+        if not isinstance(interval, dict):
+            raise ValidationError("Интервал расписания должен быть объектом")
+        start = _parse_minutes(interval.get('startTime') or interval.get('start'))
+        end = _parse_minutes(interval.get('endTime') or interval.get('end'))
+        days = interval.get('days') or []
+        if not isinstance(days, list) or any(
+            not isinstance(day, int) or not 1 <= day <= 7 for day in days
+        ):
+            raise ValidationError("Дни недели — числа от 1 (пн) до 7 (вс)")
+        intervals.append({
+            'days': sorted(set(days)),
+            'start': f'{start // 60:02d}:{start % 60:02d}',
+            'end': f'{end // 60:02d}:{end % 60:02d}',
+        })
+    return intervals
+
+
+# =============================================================
+# БИТОВАЯ КАРТА НЕДЕЛИ
+# =============================================================
+
+def compile_schedule(intervals: List[Dict]) -> Union[bytes, None]:
+    """Битовая карта активных минут недели; None — круглосуточно."""
+    if not intervals:
+        return None
+    bits = bytearray(BITMAP_BYTES)
+
+    def _mark(day: int, start: int, end: int):
+        base = day * MINUTES_PER_DAY
+        for minute in range(base + start, base + end):
+            bits[minute >> 3] |= 1 << (minute & 7)
+
+    for interval in intervals:
+        start = _parse_minutes(interval['start'])
+        end = _parse_minutes(interval['end'])
+        days = interval.get('days') or range(1, 8)
+        for day in days:
+            if start <= end:
+                _mark(day - 1, start, end)
+            else:
+                _mark(day - 1, 0, end)
+                _mark(day - 1, start, MINUTES_PER_DAY)
+    return bytes(bits)
+
+
+def week_minute(moment: datetime = None) -> int:
+    """Номер минуты недели (пн 00:00 — 0) в TIME_ZONE."""
+    local = timezone.localtime(moment)
+    return local.weekday() * MINUTES_PER_DAY + local.hour * 60 + local.minute
+
+
+def _bit(bitmap: bytes, minute: int) -> bool:
+    return bool(bitmap[minute >> 3] & (1 << (minute & 7)))
+
+
+def is_active(bitmap: Union[bytes, None], moment: datetime = None) -> bool:
+    if bitmap is None:
+        return True
+    return _bit(bitmap, week_minute(moment))
+
+
+def next_transition(bitmap: Union[bytes, None],
+                    moment: datetime = None) -> Union[datetime, None]:
+    """
+    Когда состояние окна сменится (вход или выход), считая от moment.
+    None — не сменится никогда (круглосуточно или пустая карта).
+    """
+    if bitmap is None:
+        return None
+    moment = timezone.localtime(moment)
+    current = week_minute(moment)
+    # Карта как число: бит i — минута i. Ищем ближайший бит, отличный от
+    # текущего, — для этого ставим искомые биты в 1 и поворачиваем неделю
+    # так, чтобы минута current + 1 стала нулевым битом
+    bits = int.from_bytes(bitmap, 'little')
+    if _bit(bitmap, current):
+        bits ^= _WEEK_MASK
+    shift = current + 1
+    rotated = ((bits >> shift) | (bits << (MINUTES_PER_WEEK - shift))) & _WEEK_MASK
+    if not rotated:
+        return None
+    offset = (rotated & -rotated).bit_length()
+    return moment.replace(second=0, microsecond=0) + timedelta(minutes=offset)
+
+
+# =============================================================
+# ЗАДАЧА
+# =============================================================
+
+def task_bitmap(task) -> Union[bytes, None]:
+    """Карта задачи; если её ещё не собрали (bulk_create) — собирает на лету."""
+    if task.schedule_bitmap is None and task.schedule:
+        task.schedule_bitmap = compile_schedule(task.schedule)
+    elif isinstance(task.schedule_bitmap, memoryview):
+        # Postgres отдаёт BinaryField как memoryview
+        task.schedule_bitmap = task.schedule_bitmap.tobytes()
+    return task.schedule_bitmap
+
+
+def task_in_schedule(task, moment: datetime = None) -> bool:
+    return is_active(task_bitmap(task), moment)
+
+
+def ramp_offset(task_id: int) -> timedelta:
+    """Постоянный сдвиг задачи в пределах SCHEDULE_RAMP_SECONDS (хеш id)."""
+    if SCHEDULE_RAMP_SECONDS <= 0:
+        return timedelta(0)
+    return timedelta(seconds=(task_id * 2654435761) % 2 ** 32 % SCHEDULE_RAMP_SECONDS)
+
+
+def next_wakeup(task, delay_seconds: float, settled: bool = True,
+                moment: datetime = None) -> datetime:
+    """
+    Когда запустить задачу после цикла.
+
+    В окне — через delay_seconds, но не позже конца окна: там один цикл
+    опустит ставку до минимума. Вне окна, если ставка уже опущена (settled),
+    задача спит до открытия окна; иначе повтор через delay_seconds.
+    Пробуждение на границе сдвигается на ramp_offset задачи.
+    """
+    moment = moment or timezone.now()
+    regular = moment + timedelta(seconds=delay_seconds)
+    bitmap = task_bitmap(task)
+    if bitmap is None:
+        return regular
+
+    boundary = next_transition(bitmap, moment)
+    if is_active(bitmap, moment):
+        if boundary is None:
+            return regular
+        return min(regular, boundary + ramp_offset(task.id))
+
+    if not settled:
+        return regular
+    if boundary is None:
+        return moment + timedelta(seconds=SCHEDULE_IDLE_RECHECK_SECONDS)
+    return boundary + ramp_offset(task.id)
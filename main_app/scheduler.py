@@ -0,0 +1,120 @@
+# main_app/scheduler.py
+"""
+Центральный планировщик биддера.
+
+Вместо цепочек apply_async(countdown=...) у каждой задачи есть индексированное
+поле next_run_at. Периодический dispatch_due_tasks забирает пачку созревших
+задач и раздаёт их воркерам с ограничением скорости. Забранной задаче
+next_run_at сдвигается на SCHEDULER_LEASE_SECONDS вперёд: если цикл потеряется,
+задача сама станет снова «созревшей» — отдельный revive не нужен.
+"""
+
+import logging
+import random
+from datetime import timedelta
+from typing import List, Tuple, Union
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, F
+from django.utils import timezone
+
+from .models import BiddingTask
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_TICK_SECONDS = getattr(settings, 'SCHEDULER_TICK_SECONDS', 15)
+SCHEDULER_BATCH_SIZE = getattr(settings, 'SCHEDULER_BATCH_SIZE', 500)
+# Сколько задач в секунду отдаём воркерам
+SCHEDULER_DISPATCH_RATE = getattr(settings, 'SCHEDULER_DISPATCH_RATE', 20)
+SCHEDULER_LEASE_SECONDS = getattr(settings, 'SCHEDULER_LEASE_SECONDS', 900)
+# Цикл задачи не чаще раза в столько секунд (аренда last_run_at)
+TASK_MIN_RUN_INTERVAL = getattr(settings, 'TASK_MIN_RUN_INTERVAL', 120)
+
+
+def schedule_next_run(task_id: int, delay_seconds: float):
+    """Назначает следующий запуск задачи через delay_seconds."""
+    next_run_at = timezone.now() + timedelta(seconds=delay_seconds)
+    BiddingTask.objects.filter(id=task_id).update(next_run_at=next_run_at)
+    logger.info(f"Задача {task_id} → через {int(delay_seconds)} сек")
+
+
+def wake_tasks(task_ids: List[int]):
+    """Делает задачи «созревшими» — их заберёт ближайший тик."""
+    if task_ids:
+        BiddingTask.objects.filter(id__in=task_ids, is_active=True).update(
+            next_run_at=timezone.now()
+        )
+
+
+def new_task_delay() -> int:
+    """Небольшой разброс первого запуска новых задач."""
+    return random.randint(10, 30)
+
+
+def staggered_start_times(count: int) -> List:
+    """
+    Время первого запуска для пачки новых задач: с небольшим разбросом,
+    как у одиночной, и дальше с шагом 1 / SCHEDULER_DISPATCH_RATE сек —
+    пачка не приходит в планировщик одним тиком.
+    """
+    start = timezone.now() + timedelta(seconds=new_task_delay())
+    step = 1.0 / SCHEDULER_DISPATCH_RATE
+    return [start + timedelta(seconds=i * step) for i in range(count)]
+
+
+def claim_due_tasks(limit: int) -> List[Tuple[int, Union[int, None]]]:
+    """
+    Забирает до limit созревших активных задач (сначала самые просроченные)
+    и сдвигает им next_run_at на срок аренды. Возвращает пары (task_id, account_id).
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = list(
+            BiddingTask.objects.select_for_update(skip_locked=True)
+            .filter(is_active=True)
+            .filter(Q(next_run_at__isnull=True) | Q(next_run_at__lte=now))
+            .order_by(F('next_run_at').asc(nulls_first=True))
+            .values_list('id', 'avito_account_id')[:limit]
+        )
+        if claimed:
+            BiddingTask.objects.filter(id__in=[task_id for task_id, _ in claimed]).update(
+                next_run_at=now + timedelta(seconds=SCHEDULER_LEASE_SECONDS)
+            )
+    return claimed
+
+
+def dispatch_limit(rate: float = SCHEDULER_DISPATCH_RATE) -> int:
+    """Сколько задач можно раздать за один тик при скорости rate задач/сек."""
+    return max(1, min(SCHEDULER_BATCH_SIZE, int(rate * SCHEDULER_TICK_SECONDS)))
+
+
+def claim_task_runs(task_ids: List[int]) -> set:
+    """
+    Отмечает начало цикла задач (last_run_at = now) и возвращает id тех,
+    кого удалось забрать. Не забираются задачи, запущенные меньше
+    TASK_MIN_RUN_INTERVAL сек назад, и те, что прямо сейчас забирает
+    другой воркер, — второй цикл той же задачи не стартует.
+    """
+    now = timezone.now()
+    since = now - timedelta(seconds=TASK_MIN_RUN_INTERVAL)
+    with transaction.atomic():
+        claimed = list(
+            BiddingTask.objects.select_for_update(skip_locked=True)
+            .filter(id__in=task_ids)
+            .filter(Q(last_run_at__isnull=True) | Q(last_run_at__lte=since))
+            .values_list('id', flat=True)
+        )
+        if claimed:
+            BiddingTask.objects.filter(id__in=claimed).update(last_run_at=now)
+    return set(claimed)
+
+
+def release_task_runs(tasks: List[BiddingTask]):
+    """
+    Снимает аренду claim_task_runs с задач, которые цикл так и не выполнили
+    (ждут выдачу): last_run_at возвращается к значению до аренды, и задачу,
+    разбуженную готовой выдачей, следующий тик не отбросит как частую.
+    """
+    if tasks:
+        BiddingTask.objects.bulk_update(tasks, ['last_run_at'])
@@ -0,0 +1,385 @@
+# main_app/serp.py
+
+import os
+import time
+import random
+import hashlib
+import logging
+from array import array
+from typing import Union, Dict, List
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+import redis
+from celery import current_app
+from django.conf import settings
+
+from .proxy_pool import (
+    choose_proxy, active_proxies, report_result, request_rotation, end_request,
+    OUTCOME_OK, OUTCOME_BLOCKED, OUTCOME_ERROR, PROXY_WAIT_SECONDS,
+)
+from .http_client import avito_http
+from .serp_extract import extract_serp
+from .scheduler import wake_tasks
+from .redis_client import redis_client as _redis, acquire_lock, release_lock, extend_lock
+
+logger = logging.getLogger(__name__)
+
+# Одна выдача на все задачи с этим search_url в пределах окна свежести
+SERP_CACHE_TTL = getattr(settings, 'SERP_CACHE_TTL', 240)
+# Загрузка со всеми повторами может идти несколько минут
+SERP_LOCK_TTL = 600
+# После провала всех попыток ожидающие задачи получают «не найдено»
+SERP_FAIL_TTL = 60
+SERP_MAX_ATTEMPTS = 5
+SERP_PENDING = 'pending'
+
+# Повтор после 429/блока: 30, 60, 120, 240 сек — каждый раз в 2 раза больше
+BACKOFF_DELAYS = [30, 60, 120, 240]
+NETWORK_ERROR_DELAY = 15
+# Каталог для записи сырых страниц (корпус для benchmark_serp_parser)
+SERP_RECORD_DIR = getattr(settings, 'SERP_RECORD_DIR', None)
+
+
+HEADERS_LIST = [
+    {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'ru-RU,ru;q=0.9',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'DNT': '1',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1',
+    },
+    {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.5',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1',
+    },
+    {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:122.0) Gecko/20100101 Firefox/122.0',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'ru-RU,ru;q=0.8,en-US;q=0.5',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'DNT': '1',
+        'Connection': 'keep-alive',
+    },
+]
+
+
+# =============================================================
+# НОРМАЛИЗАЦИЯ URL
+# =============================================================
+
+def normalize_search_url(search_url: str) -> str:
+    """
+    Приводит URL выдачи к каноническому виду, чтобы задачи с одинаковым
+    поиском делили одну загрузку: https, хост в нижнем регистре, без
+    фрагмента и utm-меток, параметры отсортированы.
+    """
+    parts = urlsplit(search_url.strip())
+    netloc = parts.netloc.lower()
+    if netloc == 'avito.ru':
+        netloc = 'www.avito.ru'
+    params = [
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_')
+    ]
+    params.sort()
+    return urlunsplit(('https', netloc, parts.path or '/', urlencode(params), ''))
+
+
+def serp_key(normalized_url: str) -> str:
+    return hashlib.sha1(normalized_url.encode()).hexdigest()[:24]
+
+
+# =============================================================
+# КЭШ ВЫДАЧИ
+# =============================================================
+
+_MAX_PACKED_ID = 2 ** 64 - 1
+
+
+def _pack_ids(item_ids: List[int]) -> bytes:
+    # 8 байт на объявление; 0 — карточка без data-item-id (занимает позицию).
+    # ID больше 8 байт не совпадёт ни с одной задачей (ad_id — bigint) — тоже 0
+    return array('Q', [
+        item_id if item_id and item_id <= _MAX_PACKED_ID else 0 for item_id in item_ids
+    ]).tobytes()
+
+
+def _unpack_ids(raw: bytes) -> List[int]:
+    ids = array('Q')
+    ids.frombytes(raw)
+    return ids.tolist()
+
+
+def get_cached_item_ids(key: str) -> Union[List[int], None]:
+    try:
+        raw = _redis.get(f'serp:{key}')
+    except redis.RedisError as e:
+        logger.warning(f"[SERP] Кэш недоступен: {e}")
+        return None
+    if raw is None:
+        return None
+    return _unpack_ids(raw)
+
+
+def store_item_ids(key: str, item_ids: List[int]):
+    try:
+        _redis.set(f'serp:{key}', _pack_ids(item_ids), ex=SERP_CACHE_TTL)
+    except redis.RedisError as e:
+        logger.warning(f"[SERP] Не удалось сохранить выдачу: {e}")
+
+
+# =============================================================
+# ЗАГРУЗКА И ПАРСИНГ
+# =============================================================
+
+def _record_page(key: str, page: bytes):
+    try:
+        path = os.path.join(SERP_RECORD_DIR, f'{key}-{int(time.time())}.html')
+        with open(path, 'wb') as f:
+            f.write(page)
+    except OSError as e:
+        logger.warning(f"[SERP] Не удалось записать страницу: {e}")
+
+
+def _waiters_key(key: str) -> str:
+    return f'serp_waiters:{key}'
+
+
+def _lock_key(key: str) -> str:
+    return f'serp_lock:{key}'
+
+
+def request_headers(attempt: int) -> Dict:
+    return HEADERS_LIST[attempt % len(HEADERS_LIST)]
+
+
+def handle_response(search_url: str, status_code: int, content: bytes,
+                    proxy_used: Dict, attempt: int, latency: float = None) -> Dict:
+    """
+    Разбор ответа выдачи (общий для requests и асинхронного движка).
+    Возвращает {'item_ids': [...]} при успехе, иначе {'retry_in': сек, 'port': порт}
+    — через сколько повторить и какой прокси не брать.
+    """
+    port = proxy_used['port']
+    backoff = BACKOFF_DELAYS[min(attempt, len(BACKOFF_DELAYS) - 1)]
+
+    if status_code in (429, 403):
+        # Меняем IP и повторяем по нарастающей
+        report_result(proxy_used, OUTCOME_BLOCKED)
+        request_rotation(proxy_used)
+        wait = backoff + random.randint(-5, 5)  # небольшой джиттер
+        logger.warning(
+            f"[PARSER] {status_code} порт {port} "
+            f"— смена IP, повтор через {wait} сек"
+        )
+        return {'retry_in': wait, 'port': port}
+
+    if status_code >= 400:
+        return handle_network_error(proxy_used, attempt, f"HTTP {status_code}")
+
+    if SERP_RECORD_DIR:
+        _record_page(serp_key(search_url), content)
+
+    item_ids = extract_serp(content)
+    if item_ids is None:
+        logger.warning(f"[PARSER] Капча/блок на порту {port}")
+    else:
+        logger.info(f"[PARSER] Найдено {len(item_ids)} объявлений")
+
+    if not item_ids:
+        logger.warning("[PARSER] 0 объявлений — блок или пустая выдача")
+        report_result(proxy_used, OUTCOME_BLOCKED)
+        request_rotation(proxy_used)
+        return {'retry_in': backoff, 'port': port}
+
+    report_result(proxy_used, OUTCOME_OK, latency)
+    return {'item_ids': item_ids}
+
+
+def handle_network_error(proxy_used: Dict, attempt: int, error) -> Dict:
+    logger.error(f"[PARSER] Ошибка попытки {attempt+1}: {error}")
+    report_result(proxy_used, OUTCOME_ERROR)
+    request_rotation(proxy_used)
+    return {'retry_in': NETWORK_ERROR_DELAY, 'port': proxy_used['port']}
+
+
+def no_proxy_result(exclude_port: Union[int, None]) -> Dict:
+    """
+    Свободных прокси нет. Если пул не пуст — ждём, не тратя попытку
+    (прокси освободятся после охлаждения или в следующую минуту).
+    """
+    if not active_proxies():
+        logger.error("[PARSER] Пул прокси пуст")
+        return {'retry_in': NETWORK_ERROR_DELAY, 'port': None}
+    return {'retry_in': PROXY_WAIT_SECONDS + random.randint(0, 5),
+            'port': exclude_port, 'wait': True}
+
+
+def fetch_attempt(search_url: str, attempt: int = 0,
+                  exclude_port: int = None) -> Dict:
+    """Одна попытка загрузки выдачи — без ожиданий внутри воркера."""
+    proxy_used = choose_proxy(exclude_port=exclude_port)
+    if proxy_used is None:
+        return no_proxy_result(exclude_port)
+
+    started = time.monotonic()
+    try:
+        logger.info(f"[PARSER] Попытка {attempt+1}/{SERP_MAX_ATTEMPTS} порт {proxy_used['port']}")
+        response = avito_http.proxy_session(proxy_used).get(
+            search_url, headers=request_headers(attempt), timeout=30
+        )
+    except requests.exceptions.RequestException as e:
+        end_request(proxy_used)
+        return handle_network_error(proxy_used, attempt, e)
+
+    # Запрос закончен — смена IP на этом прокси может не ждать разбора
+    end_request(proxy_used)
+    return handle_response(search_url, response.status_code, response.content,
+                           proxy_used, attempt, time.monotonic() - started)
+
+
+def _release_waiters(key: str):
+    """Будит все задачи, ждавшие эту выдачу."""
+    try:
+        pipe = _redis.pipeline(transaction=True)
+        pipe.smembers(_waiters_key(key))
+        pipe.delete(_waiters_key(key))
+        waiters, _ = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"[SERP] Не удалось получить ожидающих: {e}")
+        return
+
+    wake_tasks([int(task_id) for task_id in waiters])
+    if waiters:
+        logger.info(f"[SERP] Выдача готова — разбудили {len(waiters)} задач")
+
+
+def run_fetch_step(search_url: str, attempt: int, exclude_port: Union[int, None],
+                   lock: Union[str, None]) -> Union[Dict, None]:
+    """
+    Шаг конечного автомата загрузки. Вызывается из fetch_serp_page.
+    Возвращает {'attempt', 'port', 'countdown'} для следующего шага
+    или None, если загрузка завершена (успешно или нет).
+    """
+    result = fetch_attempt(search_url, attempt, exclude_port)
+    return complete_fetch_step(search_url, attempt, result, lock)
+
+
+def complete_fetch_step(search_url: str, attempt: int, result: Dict,
+                        lock: Union[str, None]) -> Union[Dict, None]:
+    """Сохраняет результат попытки: выдачу, следующий шаг или провал."""
+    key = serp_key(search_url)
+
+    if 'item_ids' in result:
+        store_item_ids(key, result['item_ids'])
+    elif result.get('wait') or attempt + 1 < SERP_MAX_ATTEMPTS:
+        extend_lock(_lock_key(key), lock, SERP_LOCK_TTL)
+        return {
+            'attempt': attempt if result.get('wait') else attempt + 1,
+            'port': result['port'],
+            'countdown': result['retry_in'],
+        }
+    else:
+        logger.error(f"[PARSER] Все {SERP_MAX_ATTEMPTS} попытки провалились")
+        try:
+            _redis.set(f'serp_fail:{key}', 1, ex=SERP_FAIL_TTL)
+        except redis.RedisError:
+            pass
+
+    release_lock(_lock_key(key), lock)
+    _release_waiters(key)
+    return None
+
+
+def _serp_failed(key: str) -> bool:
+    try:
+        return bool(_redis.exists(f'serp_fail:{key}'))
+    except redis.RedisError:
+        return False
+
+
+def _enqueue_fetch(normalized_url: str, lock: str):
+    current_app.send_task(
+        'main_app.tasks.fetch_serp_page',
+        args=[normalized_url, 0, None, lock],
+        countdown=random.uniform(0, 3),
+    )
+    logger.info("[SERP] Загрузка выдачи поставлена в очередь")
+
+
+def request_item_ids(search_url: str, waiter_id: int,
+                     on_fetch=None) -> Union[List[int], None, str]:
+    """
+    Выдача из общего кэша. Если её нет — запускает одну загрузку на все
+    задачи с этим URL, записывает waiter_id в ожидающие и возвращает
+    SERP_PENDING: задача будет запущена снова, когда выдача появится.
+    None — загрузка не удалась.
+
+    on_fetch(normalized_url, lock) — кто выполнит загрузку; по умолчанию
+    задача Celery fetch_serp_page.
+    """
+    normalized = normalize_search_url(search_url)
+    key = serp_key(normalized)
+
+    item_ids = get_cached_item_ids(key)
+    if item_ids is not None:
+        logger.info(f"[SERP] Из кэша: {len(item_ids)} объявлений")
+        return item_ids
+    if _serp_failed(key):
+        return None
+
+    try:
+        pipe = _redis.pipeline()
+        pipe.sadd(_waiters_key(key), waiter_id)
+        pipe.expire(_waiters_key(key), SERP_LOCK_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"[SERP] Не удалось встать в ожидание: {e}")
+        return None
+
+    # Выдача могла появиться, пока мы вставали в ожидание
+    item_ids = get_cached_item_ids(key)
+    if item_ids is not None:
+        try:
+            _redis.srem(_waiters_key(key), waiter_id)
+        except redis.RedisError:
+            pass
+        return item_ids
+
+    lock = acquire_lock(_lock_key(key), SERP_LOCK_TTL)
+    if lock:
+        (on_fetch or _enqueue_fetch)(normalized, lock)
+    else:
+        logger.info("[SERP] Выдачу уже загружает другой воркер — ждём")
+    return SERP_PENDING
+
+
+def get_ad_position(search_url: str, ad_id: int, waiter_id: int,
+                    on_fetch=None) -> Union[Dict, None]:
+    """
+    {"position": N}, {"pending": True} (выдача загружается, задачу разбудят)
+    или None — объявления нет в выдаче либо загрузка не удалась.
+    """
+    item_ids = request_item_ids(search_url, waiter_id, on_fetch=on_fetch)
+    if item_ids == SERP_PENDING:
+        return {"pending": True}
+    if not item_ids:
+        return None
+
+    try:
+        position = item_ids.index(int(ad_id)) + 1
+    except ValueError:
+        # Страница загрузилась нормально, но объявления нет
+        logger.warning(f"[PARSER] {ad_id} не найден в {len(item_ids)} объявлениях — реально не в топ-50")
+        return None
+
+    logger.info(f"[PARSER] ✅ {ad_id} на позиции {position}")
+    return {"position": position}
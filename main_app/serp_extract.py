@@ -0,0 +1,87 @@
+# main_app/serp_extract.py
+"""
+Быстрый извлекатель позиций из выдачи Avito.
+
+Вместо DOM-дерева BeautifulSoup один проход регулярным выражением по байтам
+страницы: находим открывающие теги <div> с data-marker="item" и берём их
+data-item-id в порядке появления. Как и html.parser, пропускаем содержимое
+комментариев и <script>/<style>, имена тегов и атрибутов — без учёта регистра,
+при повторе атрибута побеждает последнее значение.
+"""
+
+import re
+import html
+from typing import Union, List
+
+# Комментарий | <script>/<style> целиком | открывающий <div ...>
+_TOKEN_RE = re.compile(
+    rb'<!--.*?(?:--!?>|\Z)'
+    rb'|<(script|style)(?=[\s/>])(?:[^>"\']|"[^"]*"|\'[^\']*\')*>.*?(?:</\1\s*>|\Z)'
+    rb'|<div(?=[\s/>])((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>',
+    re.S | re.I,
+)
+
+_ATTR_RE = re.compile(
+    rb'([^\s/>=][^\s/=>]*)(?:\s*=+\s*(\'[^\']*\'|"[^"]*"|(?![\'"])[^>\s]*))?'
+)
+
+_DATA_MARKER_RE = re.compile(rb'data-marker', re.I)
+
+# Признаки страницы блокировки/капчи — ищем только в начале документа
+BLOCK_MARKERS = (
+    b'firewall-title',
+    b'firewall-container',
+    'Доступ ограничен'.encode(),
+    'Доступ с вашего IP'.encode(),
+)
+BLOCK_SCAN_BYTES = 64 * 1024
+
+
+def _attr_value(raw: Union[bytes, None]) -> str:
+    if raw is None:
+        return ''
+    if raw[:1] in (b'"', b"'"):
+        raw = raw[1:-1]
+    value = raw.decode('utf-8', errors='replace')
+    if '&' in value:
+        value = html.unescape(value)
+    return value
+
+
+def _parse_attrs(raw_attrs: bytes) -> dict:
+    attrs = {}
+    for match in _ATTR_RE.finditer(raw_attrs):
+        name = match.group(1).decode('utf-8', errors='replace').lower()
+        attrs[name] = _attr_value(match.group(2))
+    return attrs
+
+
+def extract_item_ids(page: bytes) -> List[int]:
+    """
+    Упорядоченный список data-item-id карточек выдачи.
+    Карточка без числового ID даёт 0 — она всё равно занимает позицию.
+    """
+    item_ids = []
+    for match in _TOKEN_RE.finditer(page):
+        raw_attrs = match.group(2)
+        if raw_attrs is None or not _DATA_MARKER_RE.search(raw_attrs):
+            continue
+        attrs = _parse_attrs(raw_attrs)
+        if attrs.get('data-marker') != 'item':
+            continue
+        item_id = attrs.get('data-item-id', '')
+        # isdigit() без isascii() пропустит '²' и другие не-ASCII цифры — int() на них падает
+        item_ids.append(int(item_id) if item_id.isascii() and item_id.isdigit() else 0)
+    return item_ids
+
+
+def is_block_page(page: bytes) -> bool:
+    head = page[:BLOCK_SCAN_BYTES]
+    return any(marker in head for marker in BLOCK_MARKERS)
+
+
+def extract_serp(page: bytes) -> Union[List[int], None]:
+    """Список ID объявлений или None, если это капча/блокировка."""
+    if is_block_page(page):
+        return None
+    return extract_item_ids(page)
@@ -1,14 +1,45 @@
 # main_app/signals.py
-from django.db.models.signals import post_save
+from datetime import timedelta
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from .models import BiddingTask
-from .tasks import run_bidding_for_task
-import random
+from django.utils import timezone
+from .models import AvitoAccount, BiddingTask, ProxyServer
+from .avito_api import forget_account_credentials
+from .proxy_pool import bump_pool_version
+from .scheduler import new_task_delay
+from .schedule import normalize_schedule, compile_schedule
 
 
-@receiver(post_save, sender=BiddingTask)
-def auto_start_bidding(sender, instance, created, **kwargs):
-    """Запускает биддер ТОЛЬКО при создании новой задачи."""
-    if created and instance.is_active:
-        delay = random.randint(10, 30)
-        run_bidding_for_task.apply_async(args=[instance.id], countdown=delay)
\ No newline at end of file
+@receiver(pre_save, sender=BiddingTask)
+def auto_start_bidding(sender, instance, **kwargs):
+    """Новую задачу ставим в расписание планировщика с небольшим разбросом."""
+    if instance.pk is None and instance.next_run_at is None:
+        instance.next_run_at = timezone.now() + timedelta(seconds=new_task_delay())
+
+
+@receiver(pre_save, sender=BiddingTask)
+def compile_task_schedule(sender, instance, **kwargs):
+    """Расписание — в канонический вид и в битовую карту недели."""
+    instance.schedule = normalize_schedule(instance.schedule)
+    instance.schedule_bitmap = compile_schedule(instance.schedule)
+
+
+@receiver(post_save, sender=ProxyServer)
+@receiver(post_delete, sender=ProxyServer)
+def reload_proxy_pool(sender, instance, **kwargs):
+    """Воркеры перечитают пул прокси в течение PROXY_POOL_RELOAD_SECONDS."""
+    bump_pool_version()
+
+
+@receiver(pre_save, sender=AvitoAccount)
+def reset_account_user_id(sender, instance, **kwargs):
+    """Сменились ключи — ID пользователя и токен старого client_id больше не верны."""
+    if instance.pk is None:
+        return
+    old = AvitoAccount.objects.filter(pk=instance.pk).values(
+        'avito_client_id', 'avito_client_secret'
+    ).first()
+    if old and (old['avito_client_id'] != instance.avito_client_id
+                or old['avito_client_secret'] != instance.avito_client_secret):
+        instance.avito_user_id = None
+        forget_account_credentials(old['avito_client_id'])
@@ -0,0 +1,181 @@
+# main_app/strategies.py
+"""
+Стратегии подбора ставки.
+
+Стратегия получает задачу, позицию объявления (None — не найдено в топ-50)
+и текущую ставку и возвращает (новая ставка, заметка):
+новая ставка — в пределах min_price/max_price или None, если менять нечего;
+заметка — (сообщение, уровень) для лога, когда ставка не меняется.
+Сообщения об изменении ставки собирает bidding.plan_bid.
+
+linear  — шаг bid_step за цикл (как было всегда).
+bracket — вилка: самая низкая ставка, при которой объявление было в цели
+          (bracket_high), и самая высокая, при которой не было (bracket_low);
+          следующая ставка — середина вилки. Пока верхней границы нет,
+          отступ от min_price удваивается. До цели — за O(log n) циклов.
+model   — сразу ставка из модели выдачи (predicted_price, main_app.price_model),
+          если она не противоречит вилке; иначе — как bracket.
+"""
+
+import math
+from typing import Callable, Dict, Tuple, Union
+
+from .models import BiddingTask
+
+Note = Union[Tuple[str, str], None]
+StrategyResult = Tuple[Union[float, None], Note]
+
+
+def _limits(task: BiddingTask) -> Tuple[float, float, float]:
+    return float(task.min_price), float(task.max_price), float(task.bid_step)
+
+
+def _max_reached(task: BiddingTask) -> Note:
+    return (f"Достигнут максимум {task.max_price} ₽", 'WARNING')
+
+
+def _min_reached(task: BiddingTask) -> Note:
+    return (f"Минимум {task.min_price} ₽ — не меняем", 'INFO')
+
+
+def is_on_target(task: BiddingTask, position: Union[int, None]) -> bool:
+    """В цели или выше неё — ставку можно снижать."""
+    return position is not None and position <= task.target_position_max
+
+
+# =============================================================
+# ЛИНЕЙНАЯ
+# =============================================================
+
+def linear_price(task: BiddingTask, position: Union[int, None],
+                 current_price: Union[float, None]) -> StrategyResult:
+    min_price, max_price, step = _limits(task)
+
+    if position is None and current_price is None:
+        return min_price, None
+
+    if not is_on_target(task, position):
+        new_price = float(current_price) + step
+        if new_price <= max_price:
+            return new_price, None
+        return None, _max_reached(task)
+
+    new_price = float(current_price) - step
+    if new_price >= min_price:
+        return new_price, None
+    return None, _min_reached(task)
+
+
+# =============================================================
+# ВИЛКА (БИСЕКЦИЯ)
+# =============================================================
+
+def _on_grid(task: BiddingTask, price: float) -> float:
+    """Ставка на сетке min_price + k * bid_step, в пределах min/max."""
+    min_price, max_price, step = _limits(task)
+    if step > 0:
+        price = min_price + math.floor((price - min_price) / step + 0.5) * step
+    return round(min(max(price, min_price), max_price), 2)
+
+
+# При смене этих настроек найденная вилка больше не верна
+BRACKET_RESET_FIELDS = frozenset({
+    'min_price', 'max_price', 'bid_step', 'strategy',
+    'target_position_min', 'target_position_max', 'search_url',
+})
+
+
+def reset_bracket(task: BiddingTask):
+    task.bracket_low = None
+    task.bracket_high = None
+
+
+def bracket_price(task: BiddingTask, position: Union[int, None],
+                  current_price: Union[float, None]) -> StrategyResult:
+    min_price, max_price, step = _limits(task)
+    step = step if step > 0 else 1.0
+
+    if current_price is None:
+        return min_price, None
+
+    current = float(current_price)
+    low = float(task.bracket_low) if task.bracket_low is not None else None
+    high = float(task.bracket_high) if task.bracket_high is not None else None
+
+    if is_on_target(task, position):
+        # Эта ставка достаточна; нижняя граница выше неё — устарела
+        high = current if high is None else min(high, current)
+        if low is not None and low >= current:
+            low = None
+        task.bracket_low, task.bracket_high = low, high
+
+        if current - min_price < step:
+            return None, _min_reached(task)
+        if low is not None and current - low <= step:
+            return None, (f"Вилка {low}–{current} ₽ сошлась — держим {current} ₽", 'INFO')
+        floor = low if low is not None else min_price
+        new_price = _on_grid(task, (floor + current) / 2)
+        if new_price >= current:
+            new_price = current - step
+        return max(new_price, min_price), None
+
+    # Не в цели: эта ставка мала; верхняя граница ниже неё — устарела
+    low = current if low is None else max(low, current)
+    if high is not None and high <= current:
+        high = None
+    task.bracket_low, task.bracket_high = low, high
+
+    if current >= max_price:
+        return None, _max_reached(task)
+    if high is None:
+        # Верхней границы ещё нет — удваиваем отступ от минимума
+        new_price = _on_grid(task, current + max(step, current - min_price))
+    elif high - current <= step:
+        new_price = high
+    else:
+        new_price = _on_grid(task, (current + high) / 2)
+    if new_price <= current:
+        new_price = current + step
+    return min(new_price, max_price), None
+
+
+# =============================================================
+# ПО МОДЕЛИ ВЫДАЧИ
+# =============================================================
+
+def model_price(task: BiddingTask, position: Union[int, None],
+                current_price: Union[float, None]) -> StrategyResult:
+    if task.predicted_price is None:
+        return bracket_price(task, position, current_price)
+    predicted = _on_grid(task, float(task.predicted_price))
+    if current_price is None:
+        return predicted, None
+
+    # Вилка обновляется в любом случае — прогноз проверяется по ней
+    new_price, note = bracket_price(task, position, current_price)
+    current = float(current_price)
+    if is_on_target(task, position):
+        low = task.bracket_low
+        fits = predicted < current and (low is None or predicted > float(low))
+    else:
+        high = task.bracket_high
+        fits = predicted > current and (high is None or predicted < float(high))
+    return (predicted, None) if fits else (new_price, note)
+
+
+# =============================================================
+# РЕЕСТР
+# =============================================================
+
+STRATEGIES: Dict[str, Callable[..., StrategyResult]] = {
+    'linear': linear_price,
+    'bracket': bracket_price,
+    'model': model_price,
+}
+
+
+def next_price(task: BiddingTask, position: Union[int, None],
+               current_price: Union[float, None]) -> StrategyResult:
+    """Ставка по стратегии задачи; неизвестная стратегия — линейная."""
+    strategy = STRATEGIES.get(task.strategy, linear_price)
+    return strategy(task, position, current_price)
@@ -1,396 +1,471 @@
 # main_app/tasks.py
 
+import asyncio
 import logging
 import time
 import random
-import json
-import requests
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Dict, List
+from django.conf import settings
 from django.utils import timezone
-from bs4 import BeautifulSoup
-from typing import Union, Dict
-from datetime import datetime
+from datetime import timedelta
 from celery import shared_task
 
 from .avito_api import (
-    PROXY_POOL,
     get_avito_access_token,
-    get_current_ad_price,
-    set_ad_price,
-    rotate_proxy_ip,
-    get_random_proxy,
     get_item_info,
+    get_account_user_id,
+    get_balances,
+)
+from .models import AvitoAccount, BiddingTask, TaskLog
+from .bid_state import current_bid, write_bid
+from .bidding import needs_current_price, plan_bid, plan_out_of_schedule, finish_plan
+from .item_index import build_item_index, finish_index_refresh, record_index_error
+from .log_sink import log_sink, observation_sink
+from .log_storage import maintain_task_logs
+from .price_model import refresh_price_models
+from .capacity import plan_capacity, current_dispatch_rate
+from .schedule import task_in_schedule
+from .proxy_pool import rotation_step
+from .serp import get_ad_position, run_fetch_step, complete_fetch_step, NETWORK_ERROR_DELAY
+from .scheduler import (
+    schedule_next_run, claim_due_tasks, claim_task_runs, release_task_runs, dispatch_limit,
 )
-from .models import BiddingTask, TaskLog
 
 logger = logging.getLogger(__name__)
 
-# Счётчик запросов — меняем IP каждые 20 запросов, а не каждый раз
-_request_counter = 0
-_ROTATE_EVERY = 20
+# =============================================================
+# ОСНОВНОЙ БИДДЕР — ОПТИМИЗИРОВАННЫЙ
+# =============================================================
 
+# Сколько ставок одного аккаунта читаем/пишем параллельно
+ACCOUNT_CYCLE_CONCURRENCY = getattr(settings, 'ACCOUNT_CYCLE_CONCURRENCY', 8)
+# Максимум задач в одном запуске run_account_cycle
+ACCOUNT_CYCLE_MAX_TASKS = getattr(settings, 'ACCOUNT_CYCLE_MAX_TASKS', 200)
+# 'threads' — run_account_cycle на аккаунт; 'async' — run_async_cycle на пачку аккаунтов
+BIDDER_IO_ENGINE = getattr(settings, 'BIDDER_IO_ENGINE', 'threads')
+ASYNC_CYCLE_MAX_TASKS = getattr(settings, 'ASYNC_CYCLE_MAX_TASKS', 2000)
 
-def maybe_rotate_ip():
-    """Меняет IP только каждые N запросов — экономит время."""
-    global _request_counter
-    _request_counter += 1
-    if _request_counter >= _ROTATE_EVERY:
-        _request_counter = 0
-        proxy = random.choice(PROXY_POOL)
-        rotate_proxy_ip(proxy)
-        time.sleep(3)  # Короткая пауза после смены
-        logger.info("[ROTATE] IP сменён (плановая ротация)")
 
+def _next_run_at(delay_seconds: float):
+    return timezone.now() + timedelta(seconds=delay_seconds)
 
-# =============================================================
-# ПАРСИНГ ПОЗИЦИИ — ОПТИМИЗИРОВАННЫЙ
-# =============================================================
 
-def get_ad_position(search_url: str, ad_id: int) -> Union[Dict, None]:
+def _bid_job(task: BiddingTask, ad_data: Union[Dict, None], in_schedule: bool,
+             access_token: str) -> List[TaskLog]:
     """
-    Парсит позицию с умными повторами.
-    При 429 — ждёт всё дольше между попытками (не долбит подряд).
+    Один цикл задачи по уже известной позиции: прочитать ставку, принять
+    решение (bidding.py), записать ставку. Только HTTP к Avito — без
+    обращений к БД (выполняется в пуле потоков).
     """
-    headers_list = [
-        {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'ru-RU,ru;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-        },
-        {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-        },
-        {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:122.0) Gecko/20100101 Firefox/122.0',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'ru-RU,ru;q=0.8,en-US;q=0.5',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-        },
-    ]
-
-    max_retries = 5
-    last_port = None
-
-    # Паузы после 429: 30, 60, 120, 240 сек — каждый раз в 2 раза больше
-    backoff_delays = [30, 60, 120, 240]
-
-    for attempt in range(max_retries):
-        proxies, proxy_used = get_random_proxy(exclude_port=last_port)
-        last_port = proxy_used['port']
-        headers = headers_list[attempt % len(headers_list)]
+    if not in_schedule:
+        logger.info(f"Задача {task.id} вне расписания.")
 
-        try:
-            # Обычная пауза между запросами
-            pause = random.uniform(3, 7)
-            logger.info(f"[PARSER] Попытка {attempt+1}/{max_retries} порт {proxy_used['port']} (пауза {pause:.1f}с)")
-            time.sleep(pause)
+    current_price = None
+    if not in_schedule or needs_current_price(ad_data):
+        current_price = current_bid(task.ad_id, access_token)
 
-            response = requests.get(
-                search_url, headers=headers, proxies=proxies, timeout=30
-            )
+    if in_schedule:
+        plan = plan_bid(task, ad_data, current_price)
+    else:
+        plan = plan_out_of_schedule(task, current_price)
 
-            if response.status_code in (429, 403):
-                # Меняем IP
-                rotate_proxy_ip(proxy_used)
-                
-                # Ждём по нарастающей
-                wait = backoff_delays[min(attempt, len(backoff_delays) - 1)]
-                wait += random.randint(-5, 5)  # небольшой джиттер
-                logger.warning(
-                    f"[PARSER] {response.status_code} порт {proxy_used['port']} "
-                    f"— смена IP, ждём {wait} сек перед следующей попыткой"
-                )
-                time.sleep(wait)
-                continue
+    written = False
+    if plan['price'] is not None:
+        written = write_bid(task.ad_id, plan['price'], access_token,
+                            daily_limit_rub=float(task.daily_budget))
+    return finish_plan(task, plan, written)
 
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
 
-            all_ads = soup.find_all('div', {'data-marker': 'item'})
-            logger.info(f"[PARSER] Найдено {len(all_ads)} объявлений")
+def _prepare_cycle(account: AvitoAccount, tasks: List[BiddingTask],
+                   on_serp_fetch=None) -> Dict:
+    """
+    Всё, что нужно до запросов ставок: защита от частых запусков, токен,
+    расписание и позиции из общей выдачи. Возвращает
+    {'jobs': [(task, ad_data, in_schedule)], 'token', 'done', 'skipped', 'logs'}.
+    skipped — задачи без аренды: их цикл ведёт другой запуск, поэтому из
+    них сохраняется только next_run_at.
+    """
+    logs = []
+    done = []
+    skipped = []
+
+    # --- Защита от частых и двойных запусков: аренда last_run_at ---
+    claimed = claim_task_runs([t.id for t in tasks])
+    for task in tasks:
+        if task.id not in claimed:
+            logger.info(f"Задача {task.id} слишком частая — пропуск")
+            task.next_run_at = _next_run_at(180 + random.randint(-30, 60))
+            skipped.append(task)
+    tasks = [t for t in tasks if t.id in claimed]
 
-            if not all_ads:
-                logger.warning("[PARSER] 0 объявлений — блок или пустая выдача")
-                rotate_proxy_ip(proxy_used)
-                wait = backoff_delays[min(attempt, len(backoff_delays) - 1)]
-                time.sleep(wait)
-                continue
+    # --- 1. Токен ---
+    access_token = get_avito_access_token(
+        account.avito_client_id,
+        account.avito_client_secret
+    ) if tasks else None
+    if tasks and not access_token:
+        for task in tasks:
+            logs.append(TaskLog(task=task, message="Не удалось получить токен.", level='ERROR'))
+            task.next_run_at = _next_run_at(300 + random.randint(-60, 60))
+            done.append(task)
+        tasks = []
+
+    # --- 2. Расписание и позиции ---
+    jobs = []
+    waiting = []
+    for task in tasks:
+        if not task_in_schedule(task):
+            jobs.append((task, None, False))
+            continue
 
-            for index, ad_element in enumerate(all_ads):
-                if ad_element.get('data-item-id') == str(ad_id):
-                    position = index + 1
-                    logger.info(f"[PARSER] ✅ {ad_id} на позиции {position}")
-                    return {"position": position}
+        # Позиция из общей выдачи. Если её ещё нет — загрузка идёт в фоне,
+        # задачу разбудят, когда выдача появится. next_run_at уже сдвинут
+        # арендой планировщика — если выдача потеряется, задача созреет снова
+        ad_data = get_ad_position(task.search_url, task.ad_id, task.id,
+                                  on_fetch=on_serp_fetch)
+        if ad_data is not None and ad_data.get("pending"):
+            logger.info(f"Задача {task.id} ждёт выдачу")
+            waiting.append(task)
+            continue
+        jobs.append((task, ad_data, True))
 
-            # Страница загрузилась нормально, но объявления нет
-            logger.warning(f"[PARSER] {ad_id} не найден в {len(all_ads)} объявлениях — реально не в топ-50")
-            return None
+    # Цикл ждущих задач ещё не состоялся — аренда last_run_at им не нужна
+    release_task_runs(waiting)
 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"[PARSER] Ошибка попытки {attempt+1}: {e}")
-            rotate_proxy_ip(proxy_used)
-            time.sleep(15)
+    return {'jobs': jobs, 'token': access_token, 'done': done, 'skipped': skipped,
+            'logs': logs}
 
-    logger.error(f"[PARSER] Все {max_retries} попытки провалились")
-    return None
 
-# =============================================================
-# ПРОВЕРКА РАСПИСАНИЯ
-# =============================================================
+def _save_cycle(tasks: List[BiddingTask], logs: List[TaskLog],
+                skipped: List[BiddingTask] = ()):
+    log_sink.emit(logs)
+    observation_sink.emit(
+        task.observation for task in tasks if getattr(task, 'observation', None)
+    )
+    if tasks:
+        BiddingTask.objects.bulk_update(
+            tasks, ['current_position', 'current_price', 'next_run_at', 'poll_interval',
+                    'bracket_low', 'bracket_high']
+        )
+    # Состояние пропущенных задач пишет запуск, владеющий арендой, —
+    # устаревшие копии не должны его затирать
+    if skipped:
+        BiddingTask.objects.bulk_update(skipped, ['next_run_at'])
 
-def is_time_in_schedule(schedule_data) -> bool:
-    schedule_list = []
-    if isinstance(schedule_data, str):
-        try:
-            schedule_list = json.loads(schedule_data)
-        except json.JSONDecodeError:
-            schedule_list = []
-    elif isinstance(schedule_data, list):
-        schedule_list = schedule_data
-
-    if not schedule_list:
-        return True
-
-    now = datetime.now()
-    current_day_of_week = now.weekday() + 1
-    current_time = now.time()
-
-    for interval in schedule_list:
-        days = interval.get("days")
-        if days:
-            if current_day_of_week not in days:
-                continue
 
+def _run_cycle(account: AvitoAccount, tasks: List[BiddingTask]):
+    """
+    Цикл биддера для задач одного аккаунта: один токен, общий пул соединений,
+    ставки читаем/пишем параллельно, состояние сохраняем одним bulk_update.
+    """
+    cycle = _prepare_cycle(account, tasks)
+    jobs, logs, done = cycle['jobs'], cycle['logs'], cycle['done']
+
+    def _process(job):
+        task, ad_data, in_schedule = job
         try:
-            start_str = interval.get("startTime") or interval.get("start")
-            end_str = interval.get("endTime") or interval.get("end")
-            if not start_str or not end_str:
-                continue
+            return _bid_job(task, ad_data, in_schedule, cycle['token'])
+        except Exception as e:
+            logger.exception(f"Задача {task.id}: ошибка цикла: {e}")
+            task.next_run_at = _next_run_at(300 + random.randint(-60, 60))
+            return [TaskLog(task=task, message=f"Ошибка цикла: {e}", level='ERROR')]
 
-            start_time = datetime.strptime(start_str, "%H:%M").time()
-            end_time = datetime.strptime(end_str, "%H:%M").time()
+    if jobs:
+        with ThreadPoolExecutor(max_workers=ACCOUNT_CYCLE_CONCURRENCY) as pool:
+            for task_logs in pool.map(_process, jobs):
+                logs.extend(task_logs)
+        done.extend(job[0] for job in jobs)
 
-            if start_time <= end_time:
-                if start_time <= current_time < end_time:
-                    return True
-            else:
-                if current_time >= start_time or current_time < end_time:
-                    return True
-        except (ValueError, TypeError):
-            continue
+    _save_cycle(done, logs, cycle['skipped'])
+    logger.info(f"[CYCLE] Аккаунт {account.id}: обработано {len(jobs)}, всего {len(done)}, "
+                f"пропущено {len(cycle['skipped'])}")
 
-    return False
 
+@shared_task
+def run_account_cycle(account_id: int, task_ids: List[int]):
+    """Цикл биддера для пачки созревших задач одного аккаунта."""
+    tasks = list(
+        BiddingTask.objects.select_related('avito_account')
+        .filter(id__in=task_ids, avito_account_id=account_id, is_active=True)
+    )
+    if not tasks:
+        logger.info(f"[CYCLE] Аккаунт {account_id}: активных задач нет")
+        return
+    _run_cycle(tasks[0].avito_account, tasks)
+
+
+@shared_task
+def run_async_cycle(batches: List):
+    """
+    Цикл биддера на асинхронном движке (BIDDER_IO_ENGINE = 'async'):
+    все аккаунты пачки и их загрузки выдачи — в одном цикле событий.
+    batches: [[account_id, [task_id, ...]], ...]
+    """
+    from .aio_engine import run_cycles
+
+    serp_fetches = []
+    cycles = []
+    for account_id, task_ids in batches:
+        tasks = list(
+            BiddingTask.objects.select_related('avito_account')
+            .filter(id__in=task_ids, avito_account_id=account_id, is_active=True)
+        )
+        if not tasks:
+            continue
+        cycle = _prepare_cycle(
+            tasks[0].avito_account, tasks,
+            on_serp_fetch=lambda url, lock: serp_fetches.append((url, lock)),
+        )
+        cycle['account_key'] = account_id
+        cycles.append(cycle)
+
+    results = asyncio.run(run_cycles(cycles, serp_fetches))
+
+    # --- Ставки ---
+    done = []
+    skipped = []
+    logs = []
+    bid_results = iter(results['bids'])
+    for cycle in cycles:
+        logs.extend(cycle['logs'])
+        done.extend(cycle['done'])
+        skipped.extend(cycle['skipped'])
+        for task, ad_data, in_schedule in cycle['jobs']:
+            result = next(bid_results)
+            if isinstance(result, Exception):
+                logger.error(f"Задача {task.id}: ошибка цикла: {result}")
+                logs.append(TaskLog(task=task, message=f"Ошибка цикла: {result}", level='ERROR'))
+                task.next_run_at = _next_run_at(300 + random.randint(-60, 60))
+            else:
+                logs.extend(result)
+            done.append(task)
+    _save_cycle(done, logs, skipped)
+
+    # --- Выдача: сохранить, разбудить ожидающих или повторить позже ---
+    for (search_url, lock), result in zip(serp_fetches, results['serp']):
+        if isinstance(result, Exception):
+            result = {'retry_in': NETWORK_ERROR_DELAY, 'port': None}
+        next_step = complete_fetch_step(search_url, 0, result, lock)
+        if next_step:
+            fetch_serp_page.apply_async(
+                args=[search_url, next_step['attempt'], next_step['port'], lock],
+                countdown=next_step['countdown'],
+            )
+
+    logger.info(f"[ASYNC] Аккаунтов: {len(cycles)}, задач: {len(done)}, выдач: {len(serp_fetches)}")
 
-# =============================================================
-# ОСНОВНОЙ БИДДЕР — ОПТИМИЗИРОВАННЫЙ
-# =============================================================
 
 @shared_task(bind=True, max_retries=5, default_retry_delay=300)
 def run_bidding_for_task(self, task_id: int):
     try:
-        task = BiddingTask.objects.get(id=task_id, is_active=True)
+        task = BiddingTask.objects.select_related('avito_account').get(
+            id=task_id, is_active=True
+        )
     except BiddingTask.DoesNotExist:
         logger.info(f"Задача {task_id} удалена или отключена.")
         return
 
-    # --- Защита от частых запусков (снижено до 120 сек) ---
-    last_log = TaskLog.objects.filter(task=task).order_by('-timestamp').first()
-    if last_log and (timezone.now() - last_log.timestamp).total_seconds() < 120:
-        logger.info(f"Задача {task_id} слишком частая — пропуск")
-        if task.is_active:
-            delay = 180 + random.randint(-30, 60)
-            run_bidding_for_task.apply_async(args=[task_id], countdown=delay)
-        return
-
-    # --- 1. Токен ---
     if not task.avito_account:
-        TaskLog.objects.create(
-            task=task,
-            message="Задача не привязана к аккаунту Avito.",
-            level='ERROR'
-        )
-        if task.is_active:
-            run_bidding_for_task.apply_async(
-                args=[task_id], countdown=300 + random.randint(-60, 60)
-            )
+        log_sink.log(task, "Задача не привязана к аккаунту Avito.", level='ERROR')
+        schedule_next_run(task_id, 300 + random.randint(-60, 60))
         return
 
-    access_token = get_avito_access_token(
-        task.avito_account.avito_client_id,
-        task.avito_account.avito_client_secret
-    )
-    if not access_token:
-        TaskLog.objects.create(
-            task=task,
-            message="Не удалось получить токен.",
-            level='ERROR'
-        )
-        if task.is_active:
-            run_bidding_for_task.apply_async(
-                args=[task_id], countdown=300 + random.randint(-60, 60)
-            )
+    _run_cycle(task.avito_account, [task])
+
+
+# =============================================================
+# ПЛАНИРОВЩИК
+# =============================================================
+
+@shared_task
+def dispatch_due_tasks():
+    """
+    Тик планировщика (celery beat): группирует созревшие задачи по аккаунтам
+    и раздаёт воркерам равномерно со скоростью из плана мощности прокси
+    (capacity.py; без плана — SCHEDULER_DISPATCH_RATE задач в секунду).
+    """
+    rate = current_dispatch_rate()
+    claimed = claim_due_tasks(dispatch_limit(rate))
+
+    by_account = defaultdict(list)
+    for task_id, account_id in claimed:
+        by_account[account_id].append(task_id)
+
+    if BIDDER_IO_ENGINE == 'async':
+        _dispatch_async(by_account, rate)
         return
 
-    # --- 2. Расписание ---
-    if not is_time_in_schedule(task.schedule):
-        logger.info(f"Задача {task_id} вне расписания.")
-        current_price = get_current_ad_price(task.ad_id, access_token)
-        min_price = float(task.min_price)
-        if current_price is not None and float(current_price) > min_price:
-            if set_ad_price(task.ad_id, min_price, access_token,
-                            daily_limit_rub=float(task.daily_budget)):
-                TaskLog.objects.create(
-                    task=task,
-                    message=f"↓ Снижена до {min_price} ₽ (вне расписания).",
-                    level='INFO'
+    dispatched = 0
+    for account_id, task_ids in by_account.items():
+        countdown = dispatched / rate
+        if account_id is None:
+            for task_id in task_ids:
+                run_bidding_for_task.apply_async(args=[task_id], countdown=countdown)
+        else:
+            for start in range(0, len(task_ids), ACCOUNT_CYCLE_MAX_TASKS):
+                run_account_cycle.apply_async(
+                    args=[account_id, task_ids[start:start + ACCOUNT_CYCLE_MAX_TASKS]],
+                    countdown=countdown,
                 )
-                task.current_price = min_price
-                task.save(update_fields=['current_price'])
+        dispatched += len(task_ids)
+
+    if claimed:
+        logger.info(f"[SCHEDULER] Запущено задач: {len(claimed)}, аккаунтов: {len(by_account)}")
+
 
-        if task.is_active:
-            run_bidding_for_task.apply_async(
-                args=[task_id], countdown=300 + random.randint(-60, 60)
+def _dispatch_async(by_account: Dict, rate: float):
+    """Пачки до ASYNC_CYCLE_MAX_TASKS задач — по одному циклу событий на пачку."""
+    batches = []
+    batch_size = 0
+    dispatched = 0
+    for account_id, task_ids in by_account.items():
+        if account_id is None:
+            for task_id in task_ids:
+                run_bidding_for_task.delay(task_id)
+            continue
+        batches.append([account_id, task_ids])
+        batch_size += len(task_ids)
+        if batch_size >= ASYNC_CYCLE_MAX_TASKS:
+            run_async_cycle.apply_async(
+                args=[batches], countdown=dispatched / rate
             )
-        return
+            dispatched += batch_size
+            batches, batch_size = [], 0
+    if batches:
+        run_async_cycle.apply_async(
+            args=[batches], countdown=dispatched / rate
+        )
+    logger.info(f"[SCHEDULER] Запущено аккаунтов (async): {len(by_account)}")
+
+
+# =============================================================
+# ЗАГРУЗКА ВЫДАЧИ (ПОВТОРЫ БЕЗ СНА ВНУТРИ ВОРКЕРА)
+# =============================================================
 
-    # --- 3. Основная логика ---
-    TaskLog.objects.create(task=task, message=f"▶ Биддер для {task.ad_id}")
+@shared_task
+def fetch_serp_page(search_url: str, attempt: int = 0,
+                    exclude_port: int = None, lock: str = None):
+    """
+    Одна попытка загрузки выдачи. При 429/блоке/ошибке сети не спит,
+    а ставит следующую попытку с countdown — слот воркера свободен.
+    """
+    next_step = run_fetch_step(search_url, attempt, exclude_port, lock)
+    if next_step:
+        fetch_serp_page.apply_async(
+            args=[search_url, next_step['attempt'], next_step['port'], lock],
+            countdown=next_step['countdown'],
+        )
 
-    # Плановая ротация IP (не каждый раз!)
-    #maybe_rotate_ip()
 
-    # Парсим позицию
-    ad_data = get_ad_position(task.search_url, task.ad_id)
+# =============================================================
+# СМЕНА IP ПРОКСИ
+# =============================================================
 
-    # --- Не найдено ---
-    if ad_data is None:
-        TaskLog.objects.create(
-            task=task,
-            message="Объявление не найдено в топ-50.",
-            level='ERROR'
+@shared_task
+def rotate_proxy(port: int, lease: str, phase: str = 'drain', started_at: float = None):
+    """
+    Смена IP прокси под арендой (proxy_pool.request_rotation): ждём конца
+    текущих запросов, меняем IP, выжидаем и снимаем аренду.
+    Ожидания — через countdown, воркер не спит.
+    """
+    started_at = started_at or time.time()
+    next_step = rotation_step(port, lease, phase, started_at)
+    if next_step:
+        rotate_proxy.apply_async(
+            args=[port, lease, next_step['phase'], started_at],
+            countdown=next_step['countdown'],
         )
-        task.current_position = None
 
-        if task.freeze_price_if_not_found:
-            TaskLog.objects.create(
-                task=task,
-                message="Цена заморожена (настройка).",
-                level='WARNING'
-            )
-        else:
-            current_price_from_db = task.current_price
-            if current_price_from_db is None:
-                new_price = float(task.min_price)
-                log_msg = f"↑ Первый запуск: {new_price} ₽"
-            else:
-                new_price = float(current_price_from_db) + float(task.bid_step)
-                log_msg = f"↑ Повышена вслепую до {new_price} ₽"
-
-            if new_price <= float(task.max_price):
-                if set_ad_price(task.ad_id, new_price, access_token,
-                                daily_limit_rub=float(task.daily_budget)):
-                    TaskLog.objects.create(
-                        task=task, message=log_msg, level='WARNING'
-                    )
-                    task.current_price = new_price
-                else:
-                    TaskLog.objects.create(
-                        task=task,
-                        message=f"Ошибка установки {new_price} ₽",
-                        level='ERROR'
-                    )
-            else:
-                TaskLog.objects.create(
-                    task=task,
-                    message=f"Достигнут максимум {task.max_price} ₽",
-                    level='WARNING'
-                )
 
-        task.save(update_fields=['current_position', 'current_price'])
+# =============================================================
+# БАЛАНСЫ АККАУНТОВ
+# =============================================================
 
-        # --- Найдено ---
-    else:
-        position = ad_data["position"]
-        current_price = get_current_ad_price(task.ad_id, access_token)
-
-        task.current_position = position
-        if current_price is not None:
-            task.current_price = current_price
-        task.save(update_fields=['current_position', 'current_price'])
-
-        TaskLog.objects.create(
-            task=task,
-            message=f"📍 Позиция: {position} "
-                    f"(цель {task.target_position_min}–{task.target_position_max}), "
-                    f"ставка: {current_price or '—'} ₽"
+def refresh_account_balance(account: AvitoAccount) -> Dict:
+    """
+    Запрашивает балансы аккаунта и сохраняет их с отметкой времени.
+    Возвращает {'id', 'ok', 'real', 'bonus', 'updated_at'} — для страницы аккаунтов.
+    """
+    token = get_avito_access_token(account.avito_client_id, account.avito_client_secret)
+    user_id = get_account_user_id(account, token) if token else None
+    balances = get_balances(token, user_id) if user_id else {}
+
+    fields = []
+    if balances.get('real') is not None:
+        account.real_balance = balances['real']
+        fields.append('real_balance')
+    if balances.get('bonus') is not None:
+        account.bonus_balance = balances['bonus']
+        fields.append('bonus_balance')
+    if fields:
+        account.balance_updated_at = timezone.now()
+        fields.append('balance_updated_at')
+        AvitoAccount.objects.filter(pk=account.pk).update(
+            **{field: getattr(account, field) for field in fields}
         )
+    else:
+        logger.warning(f"[BALANCE] Аккаунт {account.id}: нет данных")
 
-        if current_price is None:
-            TaskLog.objects.create(
-                task=task, message="Не удалось получить цену.", level='ERROR'
-            )
-        elif position > task.target_position_max:
-            # Вышел из цели — ПОВЫШАЕМ
-            new_price = float(current_price) + float(task.bid_step)
-            if new_price <= float(task.max_price):
-                if set_ad_price(task.ad_id, new_price, access_token,
-                                daily_limit_rub=float(task.daily_budget)):
-                    TaskLog.objects.create(
-                        task=task,
-                        message=f"↑ Повышена до {new_price} ₽ "
-                                f"(позиция {position} > {task.target_position_max})",
-                        level='WARNING'
-                    )
-                else:
-                    TaskLog.objects.create(
-                        task=task, message="Ошибка повышения", level='ERROR'
-                    )
-            else:
-                TaskLog.objects.create(
-                    task=task,
-                    message=f"Достигнут максимум {task.max_price} ₽",
-                    level='WARNING'
-                )
-        else:
-            # В цели или выше — ПОНИЖАЕМ (экономия)
-            new_price = float(current_price) - float(task.bid_step)
-            if new_price >= float(task.min_price):
-                if set_ad_price(task.ad_id, new_price, access_token,
-                                daily_limit_rub=float(task.daily_budget)):
-                    TaskLog.objects.create(
-                        task=task,
-                        message=f"↓ Понижена до {new_price} ₽ "
-                                f"(экономия, позиция {position} в норме)",
-                        level='INFO'
-                    )
-                else:
-                    TaskLog.objects.create(
-                        task=task, message="Ошибка понижения", level='ERROR'
-                    )
-            else:
-                TaskLog.objects.create(
-                    task=task,
-                    message=f"Минимум {task.min_price} ₽ — не меняем",
-                    level='INFO'
-                )
+    return {
+        'id': account.id,
+        'ok': bool(fields),
+        'real': float(account.real_balance) if account.real_balance is not None else None,
+        'bonus': float(account.bonus_balance) if account.bonus_balance is not None else None,
+        'updated_at': account.balance_updated_at.isoformat() if account.balance_updated_at else None,
+    }
+
+
+@shared_task
+def refresh_account_balance_task(account_id: int):
+    try:
+        account = AvitoAccount.objects.get(pk=account_id)
+    except AvitoAccount.DoesNotExist:
+        return
+    refresh_account_balance(account)
+
+
+@shared_task
+def refresh_balances():
+    """Периодически: по задаче на аккаунт — воркеры обновляют балансы параллельно."""
+    account_ids = list(AvitoAccount.objects.values_list('id', flat=True))
+    for account_id in account_ids:
+        refresh_account_balance_task.delay(account_id)
+    logger.info(f"[BALANCE] Обновление балансов: {len(account_ids)} аккаунтов")
+
+
+@shared_task
+def maintain_task_logs_task():
+    """Периодически: секции логов вперёд, итоги и удаление старых (log_storage.py)."""
+    return maintain_task_logs()
+
+
+@shared_task
+def plan_capacity_task():
+    """Периодически: план мощности прокси — интервалы задач и скорость раздачи (capacity.py)."""
+    return plan_capacity()
+
+
+@shared_task
+def refresh_price_models_task():
+    """Периодически: модели выдачи «ставка → позиция» и прогнозы задач (price_model.py)."""
+    return refresh_price_models()
 
-    # --- Перепланирование ---
-    TaskLog.objects.create(task=task, message="Цикл завершён ✔")
-    if task.is_active:
-        delay = 290 + random.randint(-60, 60)
-        logger.info(f"Задача {task_id} → через {delay} сек")
-        run_bidding_for_task.apply_async(args=[task_id], countdown=delay)
+
+@shared_task
+def refresh_item_index_task(account_id: int, lock: str = None):
+    """Фоновая пересборка индекса объявлений аккаунта (main_app/item_index.py)."""
+    try:
+        account = AvitoAccount.objects.get(pk=account_id)
+        build_item_index(account)
+    except AvitoAccount.DoesNotExist:
+        pass
+    except Exception as e:
+        logger.exception(f"[ITEMS] Аккаунт {account_id}: ошибка сборки индекса")
+        record_index_error(account_id, f"Ошибка сборки индекса: {e}")
+    finally:
+        finish_index_refresh(account_id, lock)
 
 
 # =============================================================
@@ -418,7 +493,7 @@ def update_task_details(task_id: int):
         logger.error(f"[update_task_details] Нет токена")
         return
 
-    info = get_item_info(token, task.ad_id)
+    info = get_item_info(token, task.ad_id, user_id=get_account_user_id(account, token))
 
     if info:
         updated_fields = []
@@ -435,4 +510,54 @@ def update_task_details(task_id: int):
                 f"[update_task_details] ✅ {task_id}: «{task.title}»"
             )
     else:
-        logger.warning(f"[update_task_details] ❌ Нет данных для {task.ad_id}")
\ No newline at end of file
+        logger.warning(f"[update_task_details] ❌ Нет данных для {task.ad_id}")
+
+
+# Сколько задач обогащаем за один запуск enrich_tasks
+ENRICH_BATCH_SIZE = getattr(settings, 'ENRICH_BATCH_SIZE', 200)
+
+
+@shared_task
+def enrich_tasks(task_ids: List[int]):
+    """
+    Название и картинка для пачки новых задач (после api_add_tasks).
+    Токен и user_id — один раз на аккаунт, карточки — параллельно через
+    общий HTTP-пул, сохранение — одним bulk_update.
+    """
+    if len(task_ids) > ENRICH_BATCH_SIZE:
+        for start in range(0, len(task_ids), ENRICH_BATCH_SIZE):
+            enrich_tasks.delay(task_ids[start:start + ENRICH_BATCH_SIZE])
+        return
+
+    tasks = list(
+        BiddingTask.objects.select_related('avito_account')
+        .filter(id__in=task_ids, avito_account__isnull=False)
+    )
+    by_account = defaultdict(list)
+    for task in tasks:
+        by_account[task.avito_account_id].append(task)
+
+    updated = []
+    for account_tasks in by_account.values():
+        account = account_tasks[0].avito_account
+        token = get_avito_access_token(account.avito_client_id, account.avito_client_secret)
+        if not token:
+            logger.error(f"[enrich_tasks] Нет токена для аккаунта {account.id}")
+            continue
+        user_id = get_account_user_id(account, token)
+
+        with ThreadPoolExecutor(max_workers=ACCOUNT_CYCLE_CONCURRENCY) as pool:
+            infos = list(pool.map(
+                lambda t: get_item_info(token, t.ad_id, user_id=user_id), account_tasks
+            ))
+        for task, info in zip(account_tasks, infos):
+            if not info:
+                logger.warning(f"[enrich_tasks] ❌ Нет данных для {task.ad_id}")
+                continue
+            task.title = info.get("title") or task.title
+            task.image_url = info.get("image_url") or task.image_url
+            updated.append(task)
+
+    if updated:
+        BiddingTask.objects.bulk_update(updated, ['title', 'image_url'])
+    logger.info(f"[enrich_tasks] ✅ Обновлено {len(updated)} из {len(tasks)}")
@@ -1,3 +1,1540 @@
-from django.test import TestCase
+import os
+import json
+import asyncio
+import math
+import time
+import zlib
+from collections import defaultdict
+from io import StringIO
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+import httpx
+import requests
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import aio_engine, avito_api, bid_state, item_index, log_storage, proxy_pool, ratelimit, serp
+from .management.commands.benchmark_serp_parser import FIXTURES_DIR, parse_with_beautifulsoup
+from .bidding import (
+    BID_CYCLE_SECONDS, BID_POLL_BACKOFF, BID_POLL_MAX_SECONDS, BID_POLL_MIN_SECONDS,
+    _plan, finish_plan, next_poll_interval,
+)
+from .capacity import _fetch_rpm, _interval, allocate
+from .forms import BiddingTaskForm
+from .http_client import AvitoHttpClient, RateLimitTimeout
+from .log_sink import BulkSink
+from .models import AvitoAccount, BiddingTask, PositionModel, ProxyServer, TaskLog, TaskLogDailySummary
+from .price_model import _solve, predict_price
+from .schedule import (
+    compile_schedule, is_active, next_transition, next_wakeup, normalize_schedule, ramp_offset,
+)
+from .scheduler import (
+    SCHEDULER_LEASE_SECONDS, TASK_MIN_RUN_INTERVAL, claim_due_tasks, claim_task_runs, wake_tasks,
+)
+from .strategies import bracket_price, linear_price
+from .serp_extract import extract_item_ids, extract_serp
+
+
+def make_account(username: str = 'owner') -> AvitoAccount:
+    user = User.objects.create_user(username=username, password='x')
+    return AvitoAccount.objects.create(
+        user=user, name='Основной', avito_client_id='id', avito_client_secret='secret',
+    )
+
+
+def make_task(account: AvitoAccount, **fields) -> BiddingTask:
+    values = {
+        'avito_account': account, 'user': account.user,
+        'ad_id': 1001, 'search_url': 'https://www.avito.ru/moskva?q=test',
+    }
+    values.update(fields)
+    return BiddingTask.objects.create(**values)
+
+
+# =============================================================
+# АРЕНДА ЦИКЛА И ОЖИДАНИЕ ВЫДАЧИ
+# =============================================================
+
+class PendingSerpLeaseTests(TestCase):
+    def setUp(self):
+        self.account = make_account()
+        self.task = make_task(self.account)
+
+    def _prepare(self, ad_data):
+        from .tasks import _prepare_cycle
+
+        tasks = list(BiddingTask.objects.filter(id=self.task.id))
+        with mock.patch('main_app.tasks.get_avito_access_token', return_value='token'), \
+                mock.patch('main_app.tasks.get_ad_position', return_value=ad_data):
+            return _prepare_cycle(self.account, tasks)
+
+    def test_pending_task_is_not_throttled_after_wake(self):
+        cycle = self._prepare({'pending': True})
+        self.assertEqual(cycle['jobs'], [])
+        self.assertEqual(cycle['done'], [])
+        self.task.refresh_from_db()
+        self.assertIsNone(self.task.last_run_at)
+
+        # Выдача готова: fetch_serp_page будит ожидающих
+        wake_tasks([self.task.id])
+        cycle = self._prepare({'position': 3})
+        self.assertEqual([(job[0].id, job[1]) for job in cycle['jobs']],
+                         [(self.task.id, {'position': 3})])
+        self.assertEqual(cycle['done'], [])
+
+    def test_pending_task_keeps_previous_lease(self):
+        earlier = timezone.now() - timedelta(hours=1)
+        BiddingTask.objects.filter(id=self.task.id).update(last_run_at=earlier)
+        self._prepare({'pending': True})
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.last_run_at, earlier)
+
+    def test_task_that_ran_is_throttled(self):
+        self._prepare({'position': 3})
+        self.assertEqual(claim_task_runs([self.task.id]), set())
+
+    def test_unclaimed_task_keeps_state_of_lease_holder(self):
+        from .tasks import _run_cycle
+
+        stale = list(BiddingTask.objects.filter(id=self.task.id))
+        claim_task_runs([self.task.id])
+        # Запуск с арендой успел записать свежее состояние
+        BiddingTask.objects.filter(id=self.task.id).update(
+            current_price=Decimal('42'), current_position=2, next_run_at=None)
+
+        with mock.patch('main_app.tasks.get_avito_access_token') as get_token:
+            _run_cycle(self.account, stale)
+        get_token.assert_not_called()
+
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.current_price, Decimal('42'))
+        self.assertEqual(self.task.current_position, 2)
+        self.assertIsNotNone(self.task.next_run_at)
+
+
+# =============================================================
+# РАЗБОР ВЫДАЧИ: СОВПАДЕНИЕ С BEAUTIFULSOUP
+# =============================================================
+
+class SerpExtractTests(SimpleTestCase):
+    def _pages(self):
+        names = sorted(n for n in os.listdir(FIXTURES_DIR) if n.endswith('.html'))
+        self.assertTrue(names)
+        for name in names:
+            with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+                yield name, f.read()
+
+    def test_positions_match_beautifulsoup(self):
+        for name, page in self._pages():
+            with self.subTest(page=name):
+                self.assertEqual(extract_item_ids(page), parse_with_beautifulsoup(page))
+
+    def test_tricky_markup(self):
+        pages = dict(self._pages())
+        # Комментарии, тела <script>/<style> и не-div пропущены; без кавычек,
+        # в верхнем регистре и с сущностями — найдены; повтор атрибута — последний
+        self.assertEqual(
+            extract_item_ids(pages['tricky.html']),
+            [101, 102, 103, 104, 105, 0, 0, 107, 108, 109, 110, 111, 112, 113, 114],
+        )
+        self.assertEqual(extract_item_ids(pages['truncated_comment.html']), [201, 202])
+        self.assertEqual(extract_item_ids(pages['truncated_script.html']), [301])
+
+    def test_odd_item_ids_keep_position(self):
+        page = (
+            '<div data-marker="item" data-item-id="1²"></div>'
+            '<div data-marker="item" data-item-id="١٢"></div>'
+            '<div data-marker="item" data-item-id="%d"></div>'
+            '<div data-marker="item" data-item-id="7"></div>' % 2 ** 64
+        ).encode()
+        item_ids = extract_item_ids(page)
+        self.assertEqual(item_ids, [0, 0, 2 ** 64, 7])
+        self.assertEqual(item_ids, parse_with_beautifulsoup(page))
+        # Кэш выдачи хранит ID в 8 байтах: слишком длинный — как карточка без ID
+        self.assertEqual(serp._unpack_ids(serp._pack_ids(item_ids)), [0, 0, 0, 7])
+
+    def test_block_page(self):
+        pages = dict(self._pages())
+        self.assertIsNone(extract_serp(pages['captcha.html']))
+        self.assertEqual(len(extract_serp(pages['basic.html'])), 5)
+
+
+# =============================================================
+# ТОКЕН: ОДИН ЗАПРОС НА АККАУНТ
+# =============================================================
+
+@mock.patch('main_app.avito_api.time.sleep')
+@mock.patch('main_app.avito_api._read_cached_token', return_value=None)
+@mock.patch('main_app.avito_api.release_lock')
+@mock.patch('main_app.avito_api._request_access_token',
+            return_value={'access_token': 'fresh', 'expires_in': 3600})
+class TokenLockTests(SimpleTestCase):
+    def _get(self, acquired, locked):
+        with mock.patch('main_app.avito_api.acquire_lock', side_effect=acquired), \
+                mock.patch('main_app.avito_api.is_locked', side_effect=locked), \
+                mock.patch('main_app.avito_api._redis'):
+            return avito_api.get_avito_access_token('client', 'secret')
+
+    @mock.patch('main_app.avito_api.TOKEN_WAIT_TIMEOUT', 0.05)
+    def test_waiter_does_not_fetch_after_timeout(self, request, release, cached, sleep):
+        self.assertIsNone(self._get([None], lambda key: True))
+        request.assert_not_called()
+
+    def test_single_reacquirer_fetches_when_holder_failed(self, request, release, cached, sleep):
+        self.assertEqual(self._get([None, 'lock'], [False]), 'fresh')
+        request.assert_called_once()
+        release.assert_called_once_with(mock.ANY, 'lock')
+
+    def test_waiter_losing_reacquire_keeps_waiting(self, request, release, cached, sleep):
+        cached.side_effect = [None, None, {'access_token': 'shared'}]
+        # Блокировку снова взял другой ожидающий — ждём его токен
+        self.assertEqual(self._get([None, None], [False, True]), 'shared')
+        request.assert_not_called()
+
+    def test_fetches_directly_without_redis(self, request, release, cached, sleep):
+        self.assertEqual(self._get(lambda key, ttl: None, lambda key: False), 'fresh')
+        request.assert_called_once()
+
+
+@mock.patch('main_app.avito_api.release_lock')
+@mock.patch('main_app.avito_api.acquire_lock', return_value='lock')
+class TokenCacheTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(avito_api, '_redis', DictRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get(self, response):
+        with mock.patch('main_app.avito_api._request_access_token',
+                        return_value=response) as request:
+            token = avito_api.get_avito_access_token('client', 'secret')
+        return token, request.call_count
+
+    def test_token_is_shared_until_expiry(self, acquire, release):
+        response = {'access_token': 'first', 'expires_in': 3600}
+        self.assertEqual(self._get(response), ('first', 1))
+        self.assertEqual(self._get(response), ('first', 0))
+        # Кэш живёт expires_in минус запас
+        key = avito_api._token_cache_key('client')
+        self.assertEqual(avito_api._redis.ttl[key], 3600 - avito_api.TOKEN_EXPIRY_MARGIN)
+
+    def test_expiring_token_is_refreshed_in_background(self, acquire, release):
+        self._get({'access_token': 'first', 'expires_in': 300})
+        with mock.patch('main_app.avito_api._refresh_token_in_background') as refresh:
+            self.assertEqual(self._get({'access_token': 'second'}), ('first', 0))
+        refresh.assert_called_once()
+
+    def test_rejected_token_is_dropped(self, acquire, release):
+        self._get({'access_token': 'first', 'expires_in': 3600})
+        avito_api.invalidate_access_token('first')
+        self.assertEqual(self._get({'access_token': 'second', 'expires_in': 3600}), ('second', 1))
+
+
+# =============================================================
+# ID ПОЛЬЗОВАТЕЛЯ АККАУНТА
+# =============================================================
+
+@mock.patch('main_app.avito_api._request_user_id', return_value=555)
+class UserIdTests(TestCase):
+    def setUp(self):
+        self.account = make_account()
+        self.redis = DictRedis()
+        for patcher in (
+            mock.patch.object(avito_api, '_redis', self.redis),
+            mock.patch.object(ratelimit, '_redis', self.redis),
+            mock.patch.dict(ratelimit._token_accounts, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_user_id_is_requested_once_per_account(self, request):
+        self.assertEqual(avito_api.get_account_user_id(self.account, 'token'), 555)
+        account = AvitoAccount.objects.get(pk=self.account.pk)
+        self.assertEqual(account.avito_user_id, 555)
+        self.assertEqual(avito_api.get_account_user_id(account, 'token'), 555)
+        # Без аккаунта — из общего кэша по владельцу токена
+        self.assertEqual(avito_api.get_avito_user_id('token'), 555)
+        request.assert_called_once()
+
+    def test_new_credentials_reset_user_id(self, request):
+        self.redis.set(avito_api._token_cache_key('id'), '{}')
+        avito_api.get_account_user_id(self.account, 'token')
+        self.account.avito_client_id = 'other-id'
+        self.account.save()
+
+        self.account.refresh_from_db()
+        self.assertIsNone(self.account.avito_user_id)
+        self.assertIsNone(self.redis.get(avito_api._token_cache_key('id')))
+
+    def test_item_info_with_known_user_id_skips_accounts_self(self, request):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'title': 'Диван', 'images': []}
+        with mock.patch('main_app.avito_api.avito_http.get', return_value=response) as get:
+            info = avito_api.get_item_info('token', 77, user_id=555)
+        self.assertEqual(info['title'], 'Диван')
+        get.assert_called_once()
+        self.assertEqual(get.call_args[0][0], avito_api.ITEM_INFO_URL_TPL.format(user_id=555, item_id=77))
+        request.assert_not_called()
+
+
+# =============================================================
+# ОБЩАЯ ВЫДАЧА: URL И ОДНА ЗАГРУЗКА НА ПОИСК
+# =============================================================
+
+class SearchUrlTests(SimpleTestCase):
+    def test_blank_params_are_kept(self):
+        self.assertEqual(
+            serp.normalize_search_url('http://Avito.ru/moskva?s=104&localPriority=&utm_source=x#top'),
+            'https://www.avito.ru/moskva?localPriority=&s=104',
+        )
+        # Пустой параметр меняет выдачу — такие поиски не делят загрузку
+        self.assertNotEqual(serp.normalize_search_url('https://www.avito.ru/moskva?q=a&d='),
+                            serp.normalize_search_url('https://www.avito.ru/moskva?q=a'))
+
+
+class SerpTestCase(SimpleTestCase):
+    """Выдача с Redis в памяти и блокировками поверх него."""
+    URL = 'https://www.avito.ru/moskva?q=divan&s=104'
+
+    def setUp(self):
+        self.redis = DictRedis()
+        for patcher in (
+            mock.patch.object(serp, '_redis', self.redis),
+            mock.patch('main_app.serp.acquire_lock',
+                       side_effect=lambda key, ttl: 'lock' if self.redis.set(key, 1, nx=True) else None),
+            mock.patch('main_app.serp.release_lock',
+                       side_effect=lambda key, lock: self.redis.delete(key)),
+            mock.patch('main_app.serp.extend_lock'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class SerpSharingTests(SerpTestCase):
+    @mock.patch('main_app.serp.wake_tasks')
+    def test_one_fetch_serves_every_task(self, wake):
+        fetches = []
+        on_fetch = lambda url, lock: fetches.append(url)
+        # Тот же поиск с другим порядком параметров и utm-метками
+        self.assertEqual(serp.get_ad_position(self.URL, 11, 1, on_fetch), {'pending': True})
+        self.assertEqual(
+            serp.get_ad_position('http://avito.ru/moskva?s=104&q=divan&utm_source=tg', 22, 2, on_fetch),
+            {'pending': True},
+        )
+        self.assertEqual(fetches, [serp.normalize_search_url(self.URL)])
+
+        serp.complete_fetch_step(fetches[0], 0, {'item_ids': [22, 0, 11]}, 'lock')
+        self.assertEqual(sorted(wake.call_args[0][0]), [1, 2])
+
+        self.assertEqual(serp.get_ad_position(self.URL, 11, 1, on_fetch), {'position': 3})
+        self.assertEqual(serp.get_ad_position(self.URL, 22, 2, on_fetch), {'position': 1})
+        self.assertIsNone(serp.get_ad_position(self.URL, 33, 3, on_fetch))
+        self.assertEqual(len(fetches), 1)
+
+
+# =============================================================
+# ЗАГРУЗКА ВЫДАЧИ: ПОВТОРЫ БЕЗ СНА В ВОРКЕРЕ
+# =============================================================
+
+@mock.patch('main_app.serp.time.sleep', side_effect=AssertionError('воркер не должен спать'))
+@mock.patch('main_app.serp.wake_tasks')
+class SerpRetryTests(SerpTestCase):
+    PROXY = {'port': 8001}
+
+    def setUp(self):
+        super().setUp()
+        for patcher in (
+            mock.patch('main_app.serp.choose_proxy', return_value=self.PROXY),
+            mock.patch('main_app.serp.report_result'),
+            mock.patch('main_app.serp.request_rotation'),
+            mock.patch('main_app.serp.end_request'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _respond(self, status_code, content=b''):
+        response = mock.Mock(status_code=status_code, content=content)
+        return mock.patch('main_app.serp.avito_http.proxy_session',
+                          return_value=mock.Mock(get=mock.Mock(return_value=response)))
+
+    def test_block_schedules_next_attempt(self, wake, sleep):
+        from .tasks import fetch_serp_page
+
+        with self._respond(429), mock.patch.object(fetch_serp_page, 'apply_async') as enqueue:
+            fetch_serp_page(self.URL, 0, None, 'lock')
+        args, countdown = enqueue.call_args[1]['args'], enqueue.call_args[1]['countdown']
+        self.assertEqual(args, [self.URL, 1, 8001, 'lock'])
+        self.assertTrue(serp.BACKOFF_DELAYS[0] - 5 <= countdown <= serp.BACKOFF_DELAYS[0] + 5)
+        serp.extend_lock.assert_called_once()
+        wake.assert_not_called()
+
+    def test_waiting_for_proxy_keeps_attempt(self, wake, sleep):
+        with mock.patch('main_app.serp.choose_proxy', return_value=None), \
+                mock.patch('main_app.serp.active_proxies', return_value=[self.PROXY]):
+            step = serp.run_fetch_step(self.URL, 2, 8001, 'lock')
+        self.assertEqual((step['attempt'], step['port']), (2, 8001))
+        self.assertGreaterEqual(step['countdown'], serp.PROXY_WAIT_SECONDS)
+
+    def test_last_failure_wakes_waiters_and_fails_fast(self, wake, sleep):
+        serp.request_item_ids(self.URL, 5, on_fetch=lambda url, lock: None)
+        with self._respond(503):
+            step = serp.run_fetch_step(serp.normalize_search_url(self.URL),
+                                       serp.SERP_MAX_ATTEMPTS - 1, None, 'lock')
+        self.assertIsNone(step)
+        wake.assert_called_once_with([5])
+        # До SERP_FAIL_TTL задачи не ставят новую загрузку, а сразу получают None
+        fetches = []
+        self.assertIsNone(serp.get_ad_position(self.URL, 11, 1, lambda url, lock: fetches.append(url)))
+        self.assertEqual(fetches, [])
+
+
+# =============================================================
+# ПЛАНИРОВЩИК
+# =============================================================
+
+class ClaimTests(TestCase):
+    def setUp(self):
+        self.account = make_account()
+        now = timezone.now()
+        self.overdue = make_task(self.account, ad_id=1, next_run_at=now - timedelta(minutes=5))
+        self.fresh = make_task(self.account, ad_id=2)
+        self.later = make_task(self.account, ad_id=3, next_run_at=now + timedelta(minutes=5))
+        self.paused = make_task(self.account, ad_id=4, is_active=False)
+        # Новым задачам сигнал разносит старт — здесь они «никогда не запускались»
+        BiddingTask.objects.filter(id__in=[self.fresh.id, self.paused.id]).update(next_run_at=None)
+
+    def test_claim_due_tasks(self):
+        claimed = claim_due_tasks(10)
+        # Сначала никогда не запускавшиеся, потом самые просроченные
+        self.assertEqual(claimed, [(self.fresh.id, self.account.id),
+                                   (self.overdue.id, self.account.id)])
+        self.overdue.refresh_from_db()
+        self.assertGreater(self.overdue.next_run_at,
+                           timezone.now() + timedelta(seconds=SCHEDULER_LEASE_SECONDS - 60))
+        # Забранные задачи второй раз не выдаются
+        self.assertEqual(claim_due_tasks(10), [])
+
+    def test_claim_due_tasks_limit(self):
+        self.assertEqual(len(claim_due_tasks(1)), 1)
+        self.assertEqual(len(claim_due_tasks(1)), 1)
+        self.assertEqual(claim_due_tasks(1), [])
+
+    def test_claim_task_runs(self):
+        ids = [self.overdue.id, self.fresh.id]
+        BiddingTask.objects.filter(id=self.fresh.id).update(
+            last_run_at=timezone.now() - timedelta(seconds=30)
+        )
+        self.assertEqual(claim_task_runs(ids), {self.overdue.id})
+        self.assertEqual(claim_task_runs(ids), set())
+
+
+# =============================================================
+# ЦИКЛ АККАУНТА: ВСЕ СОЗРЕВШИЕ ЗАДАЧИ ЗА ОДИН ЗАПУСК
+# =============================================================
+
+@mock.patch('main_app.tasks.current_dispatch_rate', return_value=100.0)
+class AccountCycleTests(TestCase):
+    def setUp(self):
+        self.first, self.second = make_account('first'), make_account('second')
+        due = timezone.now() - timedelta(minutes=1)
+        self.tasks = [make_task(self.first, ad_id=ad_id) for ad_id in (1, 2, 3)]
+        self.tasks.append(make_task(self.second, ad_id=4))
+        BiddingTask.objects.update(next_run_at=due)
+
+    def test_dispatch_groups_due_tasks_by_account(self, rate):
+        from . import tasks
+
+        with mock.patch.object(tasks, 'ACCOUNT_CYCLE_MAX_TASKS', 2), \
+                mock.patch.object(tasks.run_account_cycle, 'apply_async') as enqueue:
+            tasks.dispatch_due_tasks()
+        batches = defaultdict(list)
+        for call in enqueue.call_args_list:
+            account_id, task_ids = call[1]['args']
+            batches[account_id].append(task_ids)
+        ids = [task.id for task in self.tasks]
+        # Пачки не больше ACCOUNT_CYCLE_MAX_TASKS, у каждой — один аккаунт
+        self.assertEqual(sorted(map(len, batches[self.first.id])), [1, 2])
+        self.assertEqual(sorted(sum(batches[self.first.id], [])), ids[:3])
+        self.assertEqual(batches[self.second.id], [[ids[3]]])
+
+    @mock.patch('main_app.tasks.task_in_schedule', return_value=True)
+    @mock.patch('main_app.tasks.get_ad_position', side_effect=lambda url, ad_id, *a, **kw: {'position': ad_id})
+    @mock.patch('main_app.tasks.get_avito_access_token', return_value='token')
+    def test_account_cycle_uses_one_token_and_one_save(self, token, position, schedule, rate):
+        from .tasks import run_account_cycle
+
+        def bid_job(task, ad_data, in_schedule, access_token):
+            task.current_position = ad_data['position']
+            return [TaskLog(task=task, message='▶ Цикл', level='INFO')]
+
+        ids = [task.id for task in self.tasks[:3]]
+        with mock.patch('main_app.tasks._bid_job', side_effect=bid_job), \
+                mock.patch('main_app.tasks.log_sink') as sink, \
+                CaptureQueriesContext(connection) as queries:
+            run_account_cycle(self.first.id, ids)
+
+        token.assert_called_once()
+        # Аренда и состояние — по одному UPDATE на весь аккаунт
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(len(sink.emit.call_args[0][0]), 3)
+        self.assertEqual(
+            dict(BiddingTask.objects.filter(id__in=ids).values_list('ad_id', 'current_position')),
+            {1: 1, 2: 2, 3: 3},
+        )
+
+
+# =============================================================
+# АСИНХРОННЫЙ ДВИЖОК
+# =============================================================
+
+class AsyncEngineTests(SimpleTestCase):
+    def setUp(self):
+        for patcher in (
+            mock.patch('main_app.ratelimit.reserve', return_value=0),
+            mock.patch('main_app.ratelimit.account_for_token', side_effect=lambda token: token),
+            mock.patch('main_app.ratelimit.record_response'),
+            mock.patch('main_app.bid_state.cached_bid', return_value=None),
+            mock.patch('main_app.bid_state.remember_bid'),
+            mock.patch('main_app.bid_state.is_same_bid', return_value=False),
+            mock.patch('main_app.bid_state.forget_bid'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _run(self, handler, work):
+        async def main():
+            async with aio_engine.AvitoAsyncEngine() as engine:
+                await engine._api.aclose()
+                engine._api = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+                return await work(engine)
+        return asyncio.run(main())
+
+    @mock.patch('main_app.aio_engine.ASYNC_ACCOUNT_CONCURRENCY', 2)
+    def test_requests_are_limited_per_account(self):
+        active, peak = defaultdict(int), defaultdict(int)
+
+        async def handler(request):
+            token = request.headers['Authorization']
+            active[token] += 1
+            peak[token] = max(peak[token], active[token])
+            await asyncio.sleep(0.01)
+            active[token] -= 1
+            return httpx.Response(200, json={'manual': {'bidPenny': 1500}})
+
+        async def work(engine):
+            return await asyncio.gather(*(
+                engine.get_bid(account, ad_id, f'token-{account}')
+                for account in ('a', 'b') for ad_id in range(6)
+            ))
+
+        self.assertEqual(self._run(handler, work), [15.0] * 12)
+        self.assertEqual(dict(peak), {'Bearer token-a': 2, 'Bearer token-b': 2})
+
+    @mock.patch('main_app.aio_engine.invalidate_access_token')
+    def test_rejected_token_is_dropped_and_write_fails(self, invalidate):
+        handler = lambda request: httpx.Response(401)
+        written = self._run(handler, lambda engine: engine.set_bid('a', 1, 20.0, 'stale'))
+        self.assertFalse(written)
+        invalidate.assert_called_once_with('stale')
+        bid_state.forget_bid.assert_called_once_with(1)
+
+    def test_one_failing_job_does_not_break_the_batch(self):
+        task = BiddingTask(id=1, ad_id=1)
+        with mock.patch.object(aio_engine.AvitoAsyncEngine, 'bid_job',
+                               side_effect=[ValueError('сбой'), ['ok']]), \
+                mock.patch.object(aio_engine.AvitoAsyncEngine, 'fetch_serp',
+                                  return_value={'item_ids': [1]}):
+            cycle = {'account_key': 1, 'token': 't', 'jobs': [(task, None, True)] * 2}
+            results = asyncio.run(aio_engine.run_cycles([cycle], [('url', 'lock')]))
+        self.assertIsInstance(results['bids'][0], ValueError)
+        self.assertEqual(results['bids'][1], ['ok'])
+        self.assertEqual(results['serp'], [{'item_ids': [1]}])
+
+
+# =============================================================
+# СТРАТЕГИИ СТАВКИ
+# =============================================================
+
+class StrategyTests(SimpleTestCase):
+    def _task(self, strategy: str = 'bracket') -> BiddingTask:
+        return BiddingTask(
+            id=1, ad_id=1, min_price=Decimal(10), max_price=Decimal(100), bid_step=Decimal(1),
+            target_position_min=1, target_position_max=5, strategy=strategy,
+        )
+
+    def _run(self, price_fn, threshold: float, cycles: int = 40):
+        """Рынок: ставка не ниже threshold — позиция 3, иначе 20."""
+        task = self._task()
+        price, history = None, []
+        for _ in range(cycles):
+            position = None if price is None else (3 if price >= threshold else 20)
+            new_price, _ = price_fn(task, position, price)
+            if new_price is not None:
+                price = new_price
+            history.append(price)
+        return task, history
+
+    def test_bracket_converges_to_threshold(self):
+        task, history = self._run(bracket_price, 47)
+        first = history.index(47.0)
+        self.assertLess(first, 15)
+        self.assertEqual(set(history[first:]), {47.0})
+        self.assertEqual((task.bracket_low, task.bracket_high), (46.0, 47.0))
+
+    def test_bracket_faster_than_linear(self):
+        _, bracket = self._run(bracket_price, 47)
+        _, linear = self._run(linear_price, 47)
+        self.assertNotIn(47.0, linear[:30])
+        self.assertIn(47.0, bracket[:15])
+
+    def test_bracket_stays_within_limits(self):
+        _, history = self._run(bracket_price, 1000)
+        self.assertEqual(max(history), 100.0)
+        _, history = self._run(bracket_price, 0)
+        self.assertEqual(min(history), 10.0)
+
+    def test_bracket_drops_contradicted_bound(self):
+        task = self._task()
+        task.bracket_low, task.bracket_high = 46.0, 47.0
+        # Рынок подорожал: на 47 ₽ больше не в цели — верхняя граница снята
+        new_price, _ = bracket_price(task, 20, 47.0)
+        self.assertIsNone(task.bracket_high)
+        self.assertEqual(task.bracket_low, 47.0)
+        self.assertGreater(new_price, 47.0)
+
+    def test_linear_steps_by_bid_step(self):
+        task = self._task('linear')
+        self.assertEqual(linear_price(task, 20, 30.0), (31.0, None))
+        self.assertEqual(linear_price(task, 3, 30.0), (29.0, None))
+        self.assertEqual(linear_price(task, None, None), (10.0, None))
+        self.assertIsNone(linear_price(task, 20, 100.0)[0])
+
+
+# =============================================================
+# РАСПИСАНИЕ
+# =============================================================
+
+class ScheduleTests(SimpleTestCase):
+    def _at(self, day: int, hour: int, minute: int = 0) -> datetime:
+        # 12.10.2026 — понедельник
+        return timezone.make_aware(datetime(2026, 10, 11 + day, hour, minute))
+
+    def test_round_the_clock(self):
+        self.assertIsNone(compile_schedule([]))
+        self.assertTrue(is_active(None, self._at(1, 3)))
+        self.assertIsNone(next_transition(None, self._at(1, 3)))
+
+    def test_weekday_window(self):
+        bitmap = compile_schedule(normalize_schedule(
+            [{'days': [1, 2, 3, 4, 5], 'startTime': '09:00', 'endTime': '18:00'}]
+        ))
+        self.assertTrue(is_active(bitmap, self._at(1, 9)))
+        self.assertFalse(is_active(bitmap, self._at(1, 18)))
+        self.assertFalse(is_active(bitmap, self._at(6, 12)))
+        self.assertEqual(next_transition(bitmap, self._at(1, 8, 30)), self._at(1, 9))
+        self.assertEqual(next_transition(bitmap, self._at(1, 12, 15)), self._at(1, 18))
+        # Из пятничного вечера — до утра понедельника (через конец недели)
+        self.assertEqual(next_transition(bitmap, self._at(5, 20)), self._at(8, 9))
+
+    def test_overnight_window(self):
+        bitmap = compile_schedule([{'days': [], 'start': '22:00', 'end': '06:00'}])
+        self.assertTrue(is_active(bitmap, self._at(3, 23)))
+        self.assertTrue(is_active(bitmap, self._at(3, 5, 59)))
+        self.assertFalse(is_active(bitmap, self._at(3, 6)))
+        self.assertEqual(next_transition(bitmap, self._at(3, 12)), self._at(3, 22))
+        # 22:00–24:00 и 00:00–06:00 смыкаются — выход только в 06:00
+        self.assertEqual(next_transition(bitmap, self._at(3, 23)), self._at(4, 6))
+
+    def test_empty_window_never_changes(self):
+        bitmap = compile_schedule([{'days': [1], 'start': '10:00', 'end': '10:00'}])
+        self.assertFalse(is_active(bitmap, self._at(1, 10)))
+        self.assertIsNone(next_transition(bitmap, self._at(1, 10)))
+
+    def test_wakeup_follows_window_boundaries(self):
+        task = BiddingTask(id=7, schedule=normalize_schedule(
+            [{'days': [1, 2, 3, 4, 5], 'startTime': '09:00', 'endTime': '18:00'}]
+        ))
+        shift = ramp_offset(task.id)
+
+        # В окне — обычный интервал, но не позже закрытия окна
+        self.assertEqual(next_wakeup(task, 300, moment=self._at(1, 12)), self._at(1, 12, 5))
+        self.assertEqual(next_wakeup(task, 3600, moment=self._at(1, 17, 30)), self._at(1, 18) + shift)
+        # Вне окна с опущенной ставкой — сон до открытия
+        self.assertEqual(next_wakeup(task, 300, moment=self._at(5, 20)), self._at(8, 9) + shift)
+        # Ставку ещё не опустили — повтор через обычный интервал
+        self.assertEqual(
+            next_wakeup(task, 300, settled=False, moment=self._at(5, 20)), self._at(5, 20, 5))
+        # Без расписания — всегда обычный интервал
+        self.assertEqual(
+            next_wakeup(BiddingTask(id=7, schedule=[]), 300, moment=self._at(6, 3)), self._at(6, 3, 5))
+
+
+# =============================================================
+# МОДЕЛЬ ВЫДАЧИ
+# =============================================================
+
+class PriceModelTests(SimpleTestCase):
+    def _row(self, points):
+        xs = [math.log(price) for price, _ in points]
+        ys = [float(position) for _, position in points]
+        return {
+            'n': len(points), 'sx': sum(xs), 'sy': sum(ys),
+            'sxx': sum(x * x for x in xs), 'sxy': sum(x * y for x, y in zip(xs, ys)),
+        }
+
+    def test_solve_recovers_curve(self):
+        points = [(p, 60 - 15 * math.log(p)) for p in range(10, 60, 2)]
+        intercept, slope = _solve(self._row(points))
+        self.assertAlmostEqual(intercept, 60, places=6)
+        self.assertAlmostEqual(slope, -15, places=6)
+
+    def test_solve_rejects_bad_data(self):
+        # Мало наблюдений
+        self.assertIsNone(_solve(self._row([(10, 20), (20, 10)])))
+        # Ставка не менялась
+        self.assertIsNone(_solve(self._row([(30, 5)] * 20)))
+        # Дороже — ниже: зависимости нет
+        self.assertIsNone(_solve(self._row([(p, p) for p in range(10, 40)])))
+
+    def test_predict_price(self):
+        model = PositionModel(intercept=60, slope=-15)
+        self.assertAlmostEqual(predict_price(model, 5), round(math.exp(55 / 15), 2))
+        # Недостижимо при любой разумной ставке
+        self.assertIsNone(predict_price(PositionModel(intercept=500, slope=-1), 5))
+
+
+# =============================================================
+# ИНТЕРВАЛ ПРОВЕРКИ
+# =============================================================
+
+class PollIntervalTests(SimpleTestCase):
+    def _interval(self, current, price=None, volatile=False):
+        task = BiddingTask(poll_interval=current)
+        plan = _plan()
+        plan['price'], plan['volatile'] = price, volatile
+        return next_poll_interval(task, plan, written=True)
+
+    def test_rules(self):
+        self.assertEqual(self._interval(600, price=20.0), BID_POLL_MIN_SECONDS)
+        self.assertEqual(self._interval(600, volatile=True), 300)
+        self.assertEqual(self._interval(BID_POLL_MIN_SECONDS, volatile=True), BID_POLL_MIN_SECONDS)
+        self.assertEqual(self._interval(600), int(600 * BID_POLL_BACKOFF))
+        self.assertEqual(self._interval(BID_POLL_MAX_SECONDS), BID_POLL_MAX_SECONDS)
+        # Цикл без позиции (вне окна, нет цены) интервал не меняет
+        self.assertEqual(self._interval(None, volatile=None), BID_CYCLE_SECONDS)
+
+    def test_floor_survives_jitter_and_run_guard(self):
+        task = BiddingTask(id=1, poll_interval=600)
+        plan = _plan()
+        plan['price'], plan['success'] = 20.0, ("Ставка записана", 'INFO')
+        with mock.patch('main_app.bidding.random.uniform', side_effect=lambda low, high: low):
+            before = timezone.now()
+            finish_plan(task, plan, written=True)
+        # Самый ранний запуск после смены ставки не попадает под claim_task_runs
+        self.assertEqual(task.poll_interval, BID_POLL_MIN_SECONDS)
+        self.assertGreaterEqual((task.next_run_at - before).total_seconds(),
+                                TASK_MIN_RUN_INTERVAL)
+
+    def test_stable_task_backs_off_to_ceiling(self):
+        interval = None
+        for _ in range(20):
+            interval = self._interval(interval)
+        self.assertEqual(interval, BID_POLL_MAX_SECONDS)
+
+
+# =============================================================
+# ПУЛ ПРОКСИ: ЗДОРОВЬЕ, БЮДЖЕТ, ПЕРЕЧИТЫВАНИЕ
+# =============================================================
+
+class ProxyPoolTestCase(TestCase):
+    def setUp(self):
+        self.redis = DictRedis()
+        for patcher in (
+            mock.patch.object(proxy_pool, '_redis', self.redis),
+            mock.patch.object(proxy_pool, '_pool', None),
+            mock.patch.object(proxy_pool, 'PROXY_POOL_RELOAD_SECONDS', 0),
+            mock.patch('main_app.proxy_pool.begin_request', return_value='lease'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Прокси, заведённые миграцией 0005, тестам не нужны
+        ProxyServer.objects.all().delete()
+
+    def _add(self, port, **fields):
+        return ProxyServer.objects.create(port=port, user='u', password='p',
+                                          change_ip_url='http://change', **fields)
+
+
+class ProxyPoolTests(ProxyPoolTestCase):
+    def test_pool_reloads_after_change(self):
+        self._add(8001)
+        self.assertEqual([p['port'] for p in proxy_pool.active_proxies()], [8001])
+        # Сохранение прокси (админка) поднимает версию — воркеры перечитывают пул
+        self._add(8002)
+        self.assertEqual([p['port'] for p in proxy_pool.active_proxies()], [8001, 8002])
+        ProxyServer.objects.filter(port=8001).update(is_active=False)
+        self.assertEqual(len(proxy_pool.active_proxies()), 2)
+        proxy_pool.bump_pool_version()
+        self.assertEqual([p['port'] for p in proxy_pool.active_proxies()], [8002])
+
+    def test_blocks_cool_down_and_lower_score(self):
+        blocked, healthy = {'port': 8001}, {'port': 8002}
+        proxy_pool.report_result(healthy, proxy_pool.OUTCOME_OK, 0.2)
+        proxy_pool.report_result(blocked, proxy_pool.OUTCOME_BLOCKED)
+        self.assertEqual(self.redis.ttl['proxy_cooldown:8001'], proxy_pool.PROXY_COOLDOWN_SECONDS)
+        proxy_pool.report_result(blocked, proxy_pool.OUTCOME_BLOCKED)
+        self.assertEqual(self.redis.ttl['proxy_cooldown:8001'], proxy_pool.PROXY_COOLDOWN_SECONDS * 2)
+
+        health = proxy_pool.proxy_health([8001, 8002])
+        self.assertTrue(health[8001]['cooling'])
+        self.assertFalse(health[8002]['cooling'])
+        self.assertLess(health[8001]['score'], health[8002]['score'])
+        self.assertAlmostEqual(health[8002]['latency'], 0.2)
+
+    def test_choose_skips_cooling_and_spent_budget(self):
+        self._add(8001)
+        self._add(8002, rpm_limit=1)
+        proxy_pool.report_result({'port': 8001}, proxy_pool.OUTCOME_BLOCKED)
+
+        self.assertEqual(proxy_pool.choose_proxy()['port'], 8002)
+        # Бюджет минуты 8002 исчерпан, 8001 охлаждается
+        self.assertIsNone(proxy_pool.choose_proxy())
+
+    def test_previous_proxy_is_the_last_resort(self):
+        self._add(8001)
+        self._add(8002)
+        for _ in range(5):
+            self.assertEqual(proxy_pool.choose_proxy(exclude_port=8001)['port'], 8002)
+        ProxyServer.objects.filter(port=8002).delete()
+        self.assertEqual(proxy_pool.choose_proxy(exclude_port=8001)['port'], 8001)
+
+
+# =============================================================
+# СМЕНА IP ПРОКСИ: АРЕНДА
+# =============================================================
+
+class ProxyRotationTests(ProxyPoolTestCase):
+    def test_proxy_being_rotated_refunds_budget(self):
+        self._add(8001)
+        with mock.patch('main_app.proxy_pool.begin_request', return_value=None):
+            self.assertIsNone(proxy_pool.choose_proxy())
+        self.assertEqual(int(self.redis.get(proxy_pool._budget_key(8001))), 0)
+
+    @mock.patch('main_app.proxy_pool.current_app.send_task')
+    def test_only_one_rotation_is_requested(self, send_task):
+        with mock.patch('main_app.proxy_pool._request_rotation_script', side_effect=[1, 0]):
+            self.assertTrue(proxy_pool.request_rotation({'port': 8001}))
+            self.assertFalse(proxy_pool.request_rotation({'port': 8001}))
+        send_task.assert_called_once()
+        self.assertEqual(send_task.call_args[1]['args'][:1], [8001])
+
+    @mock.patch('main_app.proxy_pool.release_lock')
+    @mock.patch('main_app.proxy_pool.extend_lock')
+    @mock.patch('main_app.proxy_pool.rotate_proxy_ip')
+    def test_rotation_waits_for_inflight_requests(self, rotate, extend, release):
+        self._add(8001)
+        started = time.time()
+        with mock.patch('main_app.proxy_pool._inflight_count', return_value=2):
+            step = proxy_pool.rotation_step(8001, 'lease', 'drain', started)
+            self.assertEqual(step, {'phase': 'drain', 'countdown': 1})
+            rotate.assert_not_called()
+            # Запросы зависли дольше ROTATION_DRAIN_TIMEOUT — меняем IP всё равно
+            step = proxy_pool.rotation_step(
+                8001, 'lease', 'drain', started - proxy_pool.ROTATION_DRAIN_TIMEOUT)
+        self.assertEqual(step['phase'], 'settle')
+        self.assertEqual(rotate.call_args[0][0]['port'], 8001)
+
+        self.assertIsNone(proxy_pool.rotation_step(8001, 'lease', 'settle', started))
+        release.assert_called_once_with(proxy_pool._rotating_key(8001), 'lease')
+
+    def test_rotate_task_reschedules_without_sleeping(self):
+        from .tasks import rotate_proxy
+
+        with mock.patch('main_app.tasks.rotation_step', return_value={'phase': 'settle', 'countdown': 8}), \
+                mock.patch.object(rotate_proxy, 'apply_async') as enqueue:
+            rotate_proxy(8001, 'lease', 'drain', 100.0)
+        enqueue.assert_called_once_with(args=[8001, 'lease', 'settle', 100.0], countdown=8)
+
+
+# =============================================================
+# МОЩНОСТЬ ПРОКСИ
+# =============================================================
+
+class CapacityAllocateTests(SimpleTestCase):
+    def _urls(self):
+        return {
+            'a': {'interval': 240, 'weight': 4.0, 'tasks': []},
+            'b': {'interval': 240, 'weight': 1.0, 'tasks': []},
+            'c': {'interval': 600, 'weight': 1.0, 'tasks': []},
+        }
+
+    def test_enough_capacity(self):
+        urls = self._urls()
+        self.assertEqual(allocate(urls, 100.0), 0.0)
+        self.assertEqual(allocate(urls, None), 0.0)
+
+    def test_stretch_fits_capacity_by_weight(self):
+        urls = self._urls()
+        demand = _fetch_rpm(urls, 0)
+        lam = allocate(urls, demand / 2)
+        self.assertLessEqual(_fetch_rpm(urls, lam), demand / 2 + 1e-6)
+        self.assertAlmostEqual(_fetch_rpm(urls, lam), demand / 2, places=3)
+        # Тяжёлая выдача растянута меньше лёгкой с тем же желаемым интервалом
+        self.assertLess(_interval(urls['a'], lam), _interval(urls['b'], lam))
+        self.assertGreaterEqual(_interval(urls['c'], lam), 600)
+
+
+# =============================================================
+# КЭШ СТАВОК
+# =============================================================
+
+class DictRedis:
+    """Минимальный Redis в памяти: строки, множества и pipeline без атомарности."""
+
+    def __init__(self):
+        self.data = {}
+        self.ttl = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value).encode() if isinstance(value, (str, int)) else value
+        self.ttl[key] = ex
+        return True
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def exists(self, *keys):
+        return sum(key in self.data for key in keys)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def incr(self, key, amount=1):
+        value = int(self.data.get(key) or 0) + amount
+        self.data[key] = str(value).encode()
+        return value
+
+    def decr(self, key, amount=1):
+        return self.incr(key, -amount)
+
+    def hincrby(self, key, field, amount=1):
+        bucket = self.data.setdefault(key, {})
+        field = field.encode()
+        bucket[field] = int(bucket.get(field, 0)) + amount
+        return bucket[field]
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def expire(self, key, seconds):
+        self.ttl[key] = seconds
+
+    def sadd(self, key, *members):
+        self.data.setdefault(key, set()).update(str(m).encode() for m in members)
+
+    def srem(self, key, *members):
+        self.data.get(key, set()).difference_update(str(m).encode() for m in members)
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def pipeline(self, transaction=True):
+        return DictPipeline(self)
+
+
+class DictPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class BidStateTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(bid_state, '_redis', DictRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('main_app.bid_state.set_ad_price')
+    @mock.patch('main_app.bid_state.get_current_ad_price', return_value=25.0)
+    def test_price_from_get_bids_matches_task_without_limit(self, get_price, set_price):
+        self.assertEqual(bid_state.current_bid(1, 'token'), 25.0)
+        # daily_budget = 0 — setManual отправил бы ставку без лимита, как она и стоит
+        self.assertTrue(bid_state.write_bid(1, 25.0, 'token', daily_limit_rub=0.0))
+        self.assertTrue(bid_state.is_same_bid(1, 25.0, None))
+        set_price.assert_not_called()
+
+    @mock.patch('main_app.bid_state.set_ad_price', return_value=True)
+    def test_limit_change_is_written(self, set_price):
+        bid_state.remember_bid(1, 25.0)
+        self.assertTrue(bid_state.write_bid(1, 25.0, 'token', daily_limit_rub=500.0))
+        self.assertTrue(bid_state.write_bid(1, 25.0, 'token', daily_limit_rub=500.0))
+        set_price.assert_called_once()
+
+
+# =============================================================
+# HTTP-КЛИЕНТ: KEEP-ALIVE СЕССИИ
+# =============================================================
+
+class HttpSessionTests(SimpleTestCase):
+    PROXY = {'port': 8001, 'user': 'u', 'pass': 'p', 'host': 'proxy.local'}
+
+    def test_sessions_are_reused(self):
+        client = AvitoHttpClient(pool_maxsize=16)
+        self.assertIs(client.api, client.api)
+        self.assertIs(client.limited, client.limited)
+        self.assertIsNot(client.api, client.limited)
+        adapter = client.api.get_adapter('https://api.avito.ru/')
+        self.assertEqual(adapter._pool_maxsize, 16)
+
+        session = client.proxy_session(self.PROXY)
+        self.assertIs(client.proxy_session(self.PROXY), session)
+        self.assertIsNot(client.proxy_session(dict(self.PROXY, port=8002)), session)
+        self.assertEqual(session.proxies['https'], 'http://u:p@proxy.local:8001')
+
+    def test_child_process_gets_own_sessions(self):
+        client = AvitoHttpClient()
+        api, proxy = client.api, client.proxy_session(self.PROXY)
+        with mock.patch('main_app.http_client.os.getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(client.api, api)
+            self.assertIsNot(client.proxy_session(self.PROXY), proxy)
+
+    def test_dropped_proxy_session_is_closed(self):
+        client = AvitoHttpClient()
+        session = client.proxy_session(self.PROXY)
+        with mock.patch.object(session, 'close') as close:
+            client.drop_proxy_session(8001)
+        close.assert_called_once()
+        self.assertIsNot(client.proxy_session(self.PROXY), session)
+
+
+# =============================================================
+# HTTP-КЛИЕНТ: ПОВТОРЫ ЧЕРЕЗ ОГРАНИЧИТЕЛЬ
+# =============================================================
+
+class HttpRetryTests(SimpleTestCase):
+    URL = 'https://api.avito.ru/core/v1/accounts/self'
+
+    def _client(self, *statuses):
+        client = AvitoHttpClient(retries=2, backoff=0)
+        client._check_pid()
+        client._limited = mock.Mock()
+        client._limited.request.side_effect = [
+            mock.Mock(status_code=status, headers={}) for status in statuses
+        ]
+        return client
+
+    @mock.patch('main_app.ratelimit.record_response')
+    @mock.patch('main_app.ratelimit.acquire', return_value=True)
+    def test_each_retry_takes_a_token(self, acquire, record):
+        response = self._client(503, 502, 200).get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(acquire.call_count, 3)
+        self.assertEqual(record.call_count, 3)
+
+    @mock.patch('main_app.ratelimit.record_response')
+    @mock.patch('main_app.ratelimit.acquire', return_value=True)
+    def test_post_is_not_retried_on_status(self, acquire, record):
+        response = self._client(503, 200).post(self.URL)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(acquire.call_count, 1)
+
+    @mock.patch('main_app.ratelimit.record_response')
+    @mock.patch('main_app.ratelimit.acquire', side_effect=[True, False])
+    def test_retry_without_token_fails(self, acquire, record):
+        with self.assertRaises(RateLimitTimeout):
+            self._client(503, 200).get(self.URL)
+
+    @mock.patch('main_app.ratelimit.record_response')
+    @mock.patch('main_app.ratelimit.acquire', return_value=True)
+    def test_post_is_retried_only_if_not_sent(self, acquire, record):
+        client = self._client()
+        client._limited.request.side_effect = [
+            requests.exceptions.ConnectTimeout(), mock.Mock(status_code=200, headers={}),
+        ]
+        self.assertEqual(client.post(self.URL).status_code, 200)
+        self.assertEqual(acquire.call_count, 2)
+
+        # Соединение было — сервер мог выполнить запрос, повторять нельзя
+        client._limited.request.side_effect = [requests.exceptions.ConnectionError('reset'), mock.Mock()]
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.post(self.URL)
+
+
+# =============================================================
+# ОГРАНИЧИТЕЛЬ ЗАПРОСОВ К API
+# =============================================================
+
+class RateLimitTests(SimpleTestCase):
+    @mock.patch('main_app.ratelimit.time.sleep')
+    @mock.patch('main_app.ratelimit.reserve', return_value=10.0)
+    def test_web_limit_fails_fast(self, reserve, sleep):
+        with ratelimit.wait_limit(ratelimit.RATE_LIMIT_WEB_MAX_WAIT):
+            self.assertFalse(ratelimit.acquire('core', 'acc'))
+        sleep.assert_not_called()
+        # Вне блока — обычный предел воркеров: очередь в 10 сек дожидаемся
+        reserve.side_effect = [10.0, 0.0]
+        self.assertTrue(ratelimit.acquire('core', 'acc'))
+        sleep.assert_called_once_with(10.0)
+
+    def _record(self, status_code, **headers):
+        with mock.patch('main_app.ratelimit._adjust_script', return_value='1.5') as adjust:
+            ratelimit.record_response('core', 'acc', status_code,
+                                      {k.replace('_', '-'): v for k, v in headers.items()})
+        if not adjust.called:
+            return None
+        args = adjust.call_args[1]['args']
+        return args[0], args[-1]
+
+    def test_aimd_events(self):
+        self.assertEqual(self._record(200), ('ok', 0))
+        self.assertEqual(self._record(429, Retry_After='7'), ('throttle', 7.0))
+        # Исчерпанный лимит без 429 — тоже снижение и пауза до сброса
+        self.assertEqual(self._record(200, X_RateLimit_Remaining='0', X_RateLimit_Reset='5'),
+                         ('throttle', 5.0))
+        # Reset как unix-время — не пауза
+        self.assertEqual(self._record(200, X_RateLimit_Remaining='0',
+                                      X_RateLimit_Reset=str(int(time.time()))), ('throttle', 1.0))
+        # 429 без подсказок — только снижение скорости
+        self.assertEqual(self._record(429), ('throttle', 0))
+        # Ошибки сервера скорость не трогают
+        self.assertIsNone(self._record(500))
+
+    def test_requests_are_attributed_to_accounts(self):
+        self.assertEqual(ratelimit.family_for('https://api.avito.ru/token'), 'token')
+        self.assertEqual(ratelimit.family_for('https://api.avito.ru/cpxpromo/1/setManual'), 'cpxpromo')
+        self.assertEqual(ratelimit.family_for('https://api.avito.ru/core/v1/items'), 'core')
+        self.assertIsNone(ratelimit.family_for('https://www.avito.ru/moskva'))
+
+        # Токен и запросы с ним попадают в один bucket аккаунта
+        cache_key = avito_api._token_cache_key('client')
+        redis_stub = DictRedis()
+        redis_stub.set(avito_api._token_owner_key('token-1'), cache_key)
+        with mock.patch.object(ratelimit, '_redis', redis_stub), \
+                mock.patch.dict(ratelimit._token_accounts, clear=True):
+            by_token = ratelimit.account_for_request({'Authorization': 'Bearer token-1'}, None)
+        by_client = ratelimit.account_for_request({}, {'client_id': 'client'})
+        self.assertEqual(by_token, by_client)
+
+    def test_reserve_takes_account_and_global_buckets(self):
+        with mock.patch('main_app.ratelimit._acquire_script', return_value='0.25') as script:
+            self.assertEqual(ratelimit.reserve('cpxpromo', 'acc'), 0.25)
+        self.assertEqual(script.call_args[1]['keys'],
+                         ['ratelimit:cpxpromo:acc', 'ratelimit:cpxpromo:global'])
+
+
+# =============================================================
+# БАЛАНСЫ АККАУНТОВ
+# =============================================================
+
+class BalanceTests(TestCase):
+    def setUp(self):
+        self.account = make_account()
+        self.client.force_login(self.account.user)
+
+    @mock.patch('main_app.tasks.get_balances', return_value={'real': 150.5, 'bonus': None})
+    @mock.patch('main_app.tasks.get_account_user_id', return_value=555)
+    @mock.patch('main_app.tasks.get_avito_access_token', return_value='token')
+    def test_refresh_saves_what_was_received(self, token, user_id, balances):
+        from .tasks import refresh_account_balance
+
+        AvitoAccount.objects.filter(pk=self.account.pk).update(bonus_balance=Decimal('7'))
+        self.account.refresh_from_db()
+        result = refresh_account_balance(self.account)
+
+        self.assertEqual((result['ok'], result['real'], result['bonus']), (True, 150.5, 7.0))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.real_balance, Decimal('150.5'))
+        self.assertEqual(self.account.bonus_balance, Decimal('7'))
+        self.assertIsNotNone(self.account.balance_updated_at)
+
+    @mock.patch('main_app.tasks.get_avito_access_token', side_effect=AssertionError('запрос к Avito'))
+    def test_account_page_shows_stored_balances(self, token):
+        AvitoAccount.objects.filter(pk=self.account.pk).update(real_balance=Decimal('42'))
+        response = self.client.get(reverse('avito-account-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<span class="ac-amount">42</span>', html=True)
+
+    def test_refresh_streams_each_account(self):
+        other = AvitoAccount.objects.create(user=self.account.user, name='Второй',
+                                            avito_client_id='id2', avito_client_secret='s2')
+
+        def refresh(account):
+            if account.id == other.id:
+                raise ValueError('нет ответа')
+            return {'id': account.id, 'ok': True, 'real': 10.0}
+
+        with mock.patch('main_app.views.refresh_account_balance', side_effect=refresh):
+            response = self.client.post(reverse('api-refresh-balances'))
+            lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(sorted((line['id'], line['ok']) for line in lines),
+                         [(self.account.id, True), (other.id, False)])
+
+
+# =============================================================
+# ИНДЕКС ОБЪЯВЛЕНИЙ АККАУНТА
+# =============================================================
+
+class ItemIndexTests(TestCase):
+    def setUp(self):
+        self.account = make_account()
+        self.client.force_login(self.account.user)
+        patcher = mock.patch.object(item_index, '_redis', DictRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get(self, **params):
+        return self.client.get(reverse('api_account_items', args=[self.account.id]), params)
+
+    @mock.patch('main_app.item_index.get_avito_access_token', return_value='token')
+    @mock.patch('main_app.item_index.fetch_catalog', return_value=None)
+    @mock.patch('main_app.views.request_index_refresh')
+    def test_failed_build_is_reported_without_new_builds(self, refresh, fetch, token):
+        self.assertEqual(self._get().status_code, 202)
+        self.assertIsNone(item_index.build_item_index(self.account))
+
+        response = self._get()
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.json()['error'], "Avito не отдал список объявлений")
+        refresh.assert_called_once()
+
+        # Ошибка живёт ITEM_INDEX_ERROR_TTL — после неё сборка ставится снова
+        item_index._redis.delete(item_index._error_key(self.account.id))
+        self.assertEqual(self._get().status_code, 202)
+        self.assertEqual(refresh.call_count, 2)
+
+    @mock.patch('main_app.item_index.get_avito_access_token', return_value='token')
+    @mock.patch('main_app.item_index.fetch_catalog')
+    def test_successful_build_clears_error(self, fetch, token):
+        item_index.record_index_error(self.account.id, "Не удалось получить токен Avito")
+        fetch.return_value = [{'id': 7, 'title': 'Диван'}]
+        self.assertIsNotNone(item_index.build_item_index(self.account))
+
+        self.assertIsNone(item_index.get_index_error(self.account.id))
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['items']], [7])
+
+    def _store(self, items, built_at=None):
+        payload = {'version': 1, 'built_at': built_at or time.time(), 'items': items}
+        item_index._redis.set(item_index._index_key(self.account.id),
+                              zlib.compress(json.dumps(payload).encode()))
+
+    @mock.patch('main_app.views.request_index_refresh')
+    def test_index_is_filtered_paged_and_streamed(self, refresh):
+        items = [item_index._compact({'id': i, 'title': f'Диван {i}' if i % 2 else f'Стул {i}'})
+                 for i in range(1, 8)]
+        self._store(items)
+        make_task(self.account, ad_id=3)
+
+        data = self._get(q='диван', per_page=2, page=2).json()
+        self.assertEqual((data['total'], [item['id'] for item in data['items']]), (4, [5, 7]))
+
+        response = self._get(q='диван', format='ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(lines[0]['total'], 4)
+        self.assertEqual([(item['id'], item['already_added']) for item in lines[1:]],
+                         [(1, False), (3, True), (5, False), (7, False)])
+        refresh.assert_not_called()
+
+        # Устаревший индекс отдаётся, а обновление идёт в фоне
+        self._store(items, built_at=time.time() - item_index.ITEM_INDEX_STALE_SECONDS - 1)
+        self.assertEqual(self._get().status_code, 200)
+        refresh.assert_called_once_with(self.account.id)
+
+    @mock.patch('main_app.item_index.ITEM_INDEX_CONCURRENCY', 2)
+    @mock.patch('main_app.item_index.ITEMS_PER_PAGE', 2)
+    def test_catalog_pages_are_fetched_in_parallel(self):
+        pages = {1: [1, 2], 2: [3, 4], 3: [5]}
+
+        def fetch(token, page):
+            return {'resources': [{'id': i} for i in pages.get(page, [])], 'meta': meta}
+
+        meta = {'total': 5}
+        with mock.patch('main_app.item_index._fetch_page', side_effect=fetch) as fetch_page:
+            self.assertEqual([i['id'] for i in item_index.fetch_catalog('t')], [1, 2, 3, 4, 5])
+        self.assertEqual(sorted(call[0][1] for call in fetch_page.call_args_list), [1, 2, 3])
+
+        # Без total — волнами, пока не придёт неполная страница
+        meta = {}
+        with mock.patch('main_app.item_index._fetch_page', side_effect=fetch):
+            self.assertEqual([i['id'] for i in item_index.fetch_catalog('t')], [1, 2, 3, 4, 5])
+
+        # Одна страница не загрузилась — каталог неполный, индекс не строим
+        with mock.patch('main_app.item_index._fetch_page',
+                        side_effect=lambda token, page: None if page == 3 else fetch(token, page)):
+            self.assertIsNone(item_index.fetch_catalog('t'))
+
+    @mock.patch('main_app.tasks.build_item_index', side_effect=ValueError('битый ответ'))
+    @mock.patch('main_app.tasks.finish_index_refresh')
+    def test_crashed_build_task_stores_error(self, finish, build):
+        from .tasks import refresh_item_index_task
+
+        refresh_item_index_task(self.account.id, 'lock')
+        self.assertIn('битый ответ', item_index.get_index_error(self.account.id))
+        finish.assert_called_once_with(self.account.id, 'lock')
+
+
+# =============================================================
+# МАССОВОЕ ДОБАВЛЕНИЕ ЗАДАЧ
+# =============================================================
+
+@mock.patch('main_app.views.enrich_tasks')
+class AddTasksTests(TestCase):
+    URL = 'https://www.avito.ru/moskva?q=test'
+
+    def setUp(self):
+        self.account = make_account()
+        self.client.force_login(self.account.user)
+
+    def _post(self, items):
+        response = self.client.post(
+            reverse('api_add_tasks'),
+            json.dumps({'account_id': self.account.id, 'items': items}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def _add(self, *ad_ids, url=URL):
+        return self._post([{'ad_id': ad_id, 'search_url': url} for ad_id in ad_ids])
+
+    def test_repeated_add_skips_existing(self, enrich):
+        self.assertEqual(self._add(1, 2, 2)['created'], 2)
+        result = self._add(2, 3)
+        self.assertEqual((result['created'], result['skipped']), (1, [2]))
+        self.assertEqual(BiddingTask.objects.filter(avito_account=self.account).count(), 3)
+
+    def test_same_ad_in_another_search_is_added(self, enrich):
+        self._add(1)
+        result = self._add(1, url=self.URL + '&p=2')
+        self.assertEqual((result['created'], result['skipped']), (1, []))
+
+    def test_item_without_search_url_is_rejected(self, enrich):
+        # url из индекса — страница объявления, выдачей она не считается
+        result = self._post([{'ad_id': 1, 'url': 'https://www.avito.ru/moskva/item_1'}])
+        self.assertEqual(result['created'], 0)
+        self.assertIn('search_url', result['errors'][0]['errors'])
+        self.assertFalse(BiddingTask.objects.exists())
+
+    def test_created_counts_only_inserted_rows(self, enrich):
+        bulk_create = BiddingTask.objects.bulk_create
+
+        def racing_bulk_create(tasks, **kwargs):
+            # Другой путь успел создать ту же задачу между проверкой и вставкой
+            make_task(self.account, ad_id=2, search_url=self.URL)
+            return bulk_create(tasks, **kwargs)
+
+        with mock.patch.object(BiddingTask.objects, 'bulk_create', side_effect=racing_bulk_create):
+            result = self._add(1, 2)
+        self.assertEqual((result['created'], result['added_ids']), (1, [1]))
+        self.assertEqual(BiddingTask.objects.filter(ad_id=2).count(), 1)
+        enrich.delay.assert_called_once()
+        self.assertEqual(len(enrich.delay.call_args[0][0]), 1)
+
+    def test_database_rejects_active_duplicate(self, enrich):
+        make_task(self.account, ad_id=1, search_url=self.URL)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            make_task(self.account, ad_id=1, search_url=self.URL)
+        # Выключенная копия, другое объявление и другая выдача — можно
+        make_task(self.account, ad_id=1, search_url=self.URL, is_active=False)
+        make_task(self.account, ad_id=2, search_url=self.URL)
+        make_task(self.account, ad_id=1, search_url=self.URL + '&p=2')
+
+    def test_task_form_reports_duplicate(self, enrich):
+        make_task(self.account, ad_id=1, search_url=self.URL)
+        form = BiddingTaskForm(user=self.account.user, data={
+            'avito_account': self.account.id, 'ad_id': 1, 'search_url': self.URL,
+            'min_price': 10, 'max_price': 50, 'target_position_min': 1,
+            'target_position_max': 10, 'bid_step': 1, 'strategy': 'linear',
+            'priority': 1, 'schedule': '[]', 'daily_budget': 0, 'is_active': 'on',
+        })
+        self.assertFalse(form.is_valid())
+        self.assertIn('__all__', form.errors)
+
+
+class DuplicateTasksCommandTests(TransactionTestCase):
+    URL = 'https://www.avito.ru/moskva?q=test'
+
+    def _constraint(self):
+        return next(c for c in BiddingTask._meta.constraints if c.name == 'task_account_ad_url_uniq')
+
+    def test_deactivates_all_but_earliest_copy(self):
+        account = make_account()
+        # Дубликаты из времени до уникального ключа
+        with connection.schema_editor() as editor:
+            editor.remove_constraint(BiddingTask, self._constraint())
+        tasks = [make_task(account, ad_id=1, search_url=self.URL) for _ in range(3)]
+        other = make_task(account, ad_id=2, search_url=self.URL)
+
+        out = StringIO()
+        call_command('find_duplicate_tasks', stdout=out)
+        self.assertIn('Лишних задач: 2', out.getvalue())
+        self.assertEqual(BiddingTask.objects.filter(is_active=True).count(), 4)
+
+        call_command('find_duplicate_tasks', '--deactivate', stdout=StringIO())
+        self.assertEqual(
+            set(BiddingTask.objects.filter(is_active=True).values_list('id', flat=True)),
+            {tasks[0].id, other.id},
+        )
+        self.assertEqual(BiddingTask.objects.count(), 4)
+        # Ключ снова ставится — активных дубликатов нет
+        with connection.schema_editor() as editor:
+            editor.add_constraint(BiddingTask, self._constraint())
+
+
+# =============================================================
+# БУФЕР ЛОГОВ
+# =============================================================
+
+@mock.patch('main_app.log_sink.threading.Timer')
+class LogSinkTests(TestCase):
+    def setUp(self):
+        self.task = make_task(make_account())
+        self.sink = BulkSink(TaskLog, batch_size=3, flush_seconds=5)
+
+    def _logs(self, count):
+        return [TaskLog(task=self.task, message=f'▶ {i}', level='INFO') for i in range(count)]
+
+    def test_full_buffer_is_written_in_one_insert(self, timer):
+        self.sink.emit(self._logs(2))
+        self.assertEqual((self.sink.pending(), TaskLog.objects.count()), (2, 0))
+        timer.assert_called_once_with(5, self.sink._flush_on_timer)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.sink.emit(self._logs(1))
+        self.assertEqual(len([q for q in queries.captured_queries if q['sql'].startswith('INSERT')]), 1)
+        self.assertEqual((self.sink.pending(), TaskLog.objects.count()), (0, 3))
+        timer.return_value.cancel.assert_called_once()
+
+    def test_timer_flushes_partial_buffer(self, timer):
+        self.sink.emit(self._logs(1))
+        self.sink.emit(self._logs(1))
+        timer.assert_called_once()
+        with mock.patch('main_app.log_sink.connection'):
+            timer.call_args[0][1]()
+        self.assertEqual(TaskLog.objects.count(), 2)
+
+    def test_child_process_drops_parent_buffer(self, timer):
+        self.sink.emit(self._logs(2))
+        with mock.patch('main_app.log_sink.os.getpid', return_value=os.getpid() + 1):
+            self.sink.emit(self._logs(1))
+            self.assertEqual(self.sink.pending(), 1)
+
+    def test_failed_insert_is_logged_not_raised(self, timer):
+        self.sink.emit(self._logs(1))
+        with mock.patch.object(TaskLog.objects, 'bulk_create', side_effect=DatabaseError('нет места')), \
+                self.assertLogs('main_app.log_sink', 'ERROR'):
+            self.assertEqual(self.sink.flush(), 0)
+
+
+# =============================================================
+# ХРАНЕНИЕ ЛОГОВ: СЕКЦИИ ПО ДНЯМ
+# =============================================================
+
+@skipUnless(connection.vendor == 'postgresql', 'секции TaskLog есть только в Postgres')
+class TaskLogPartitionTests(TestCase):
+    def setUp(self):
+        self.task = make_task(make_account())
+
+    def _log_on(self, day):
+        log = TaskLog.objects.create(task=self.task, message='▶ Цикл', level='INFO')
+        TaskLog.objects.filter(id=log.id).update(
+            timestamp=log_storage.day_start(day) + timedelta(hours=12))
+
+    def test_stray_default_rows_move_to_their_day(self):
+        day = timezone.localdate() + timedelta(days=30)
+        self._log_on(day)
+        self.assertEqual(log_storage.default_partition_days(), {day: 1})
+
+        with self.assertLogs('main_app.log_storage', 'ERROR'):
+            log_storage.ensure_partitions()
+
+        self.assertEqual(log_storage.default_partition_days(), {})
+        names = [name for name, _, _ in log_storage.list_partitions()]
+        self.assertIn(log_storage.partition_name(day), names)
+        self.assertEqual(TaskLog.objects.filter(task=self.task).count(), 1)
+
+        # Секции на дни вперёд создаются как обычно, в т.ч. за день переноса
+        log_storage.ensure_partitions(days_ahead=31)
+        names = [name for name, _, _ in log_storage.list_partitions()]
+        self.assertIn(log_storage.partition_name(day + timedelta(days=1)), names)
+
+
+class TaskLogMaintenanceTests(TestCase):
+    def setUp(self):
+        self.task = make_task(make_account())
+        self.old_day = timezone.localdate() - timedelta(days=40)
+
+    def _log(self, day, message, level='INFO'):
+        log = TaskLog.objects.create(task=self.task, message=message, level=level)
+        TaskLog.objects.filter(id=log.id).update(
+            timestamp=log_storage.day_start(day) + timedelta(hours=12))
+
+    def _fill_old_day(self):
+        self._log(self.old_day, '▶ Цикл')
+        self._log(self.old_day, '↑ Ставка 12')
+        self._log(self.old_day, '↓ Ставка 10')
+        self._log(self.old_day, 'Ошибка API', level='ERROR')
+
+    def test_rerun_overwrites_summary(self):
+        self._fill_old_day()
+        end = log_storage.day_start(self.old_day + timedelta(days=1))
+        self.assertEqual(log_storage.rollup(None, end), 1)
+        self.assertEqual(log_storage.rollup(None, end), 1)
+
+        summary = TaskLogDailySummary.objects.get(task=self.task)
+        self.assertEqual(
+            (summary.day, summary.entries, summary.cycles, summary.raises, summary.drops, summary.errors),
+            (self.old_day, 4, 1, 1, 1, 1),
+        )
+
+    @skipUnless(connection.vendor == 'sqlite', 'без секций логи удаляются построчно')
+    def test_old_rows_are_summarized_and_deleted(self):
+        self._fill_old_day()
+        self._log(timezone.localdate(), '▶ Цикл')
+
+        result = log_storage.maintain_task_logs(retention_days=30)
+
+        self.assertEqual(result, {'deleted': 4, 'summaries': 1})
+        self.assertEqual(TaskLog.objects.filter(task=self.task).count(), 1)
+        self.assertEqual(TaskLogDailySummary.objects.get(task=self.task).entries, 4)
+
+    @skipUnless(connection.vendor == 'postgresql', 'секции TaskLog есть только в Postgres')
+    def test_expired_partition_is_summarized_and_dropped(self):
+        # Строки старше границы legacy попадают в неё, поэтому день берём после неё
+        day = timezone.localdate() + timedelta(days=40)
+        self._log(day, '▶ Цикл')
+        with self.assertLogs('main_app.log_storage', 'ERROR'):
+            log_storage.ensure_partitions(days_ahead=0)
+        # В проде обслуживание идёт своей транзакцией: проверки FK уже выполнены
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+        cutoff = log_storage.day_start(day + timedelta(days=1))
+        dropped = log_storage.drop_expired_partitions(cutoff)
+
+        self.assertIn(log_storage.partition_name(day), dropped)
+        self.assertFalse(TaskLog.objects.filter(task=self.task).exists())
+        self.assertEqual(TaskLogDailySummary.objects.get(task=self.task, day=day).cycles, 1)
 
-# Create your tests here.
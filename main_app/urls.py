@@ -21,6 +21,7 @@ path('api/account/<int:account_id>/items/', views.api_account_items, name='api_a
     # +++ НОВЫЕ ПУТИ ДЛЯ УПРАВЛЕНИЯ АККАУНТАМИ AVITO +++
     # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
     path('accounts/', views.avito_account_list, name='avito-account-list'),
+    path('accounts/balances/refresh/', views.api_refresh_balances, name='api-refresh-balances'),
     path('accounts/add/', views.AvitoAccountCreateView.as_view(), name='avito-account-add'),
     path('accounts/<int:pk>/edit/', views.AvitoAccountUpdateView.as_view(), name='avito-account-edit'),
     path('accounts/<int:pk>/delete/', views.AvitoAccountDeleteView.as_view(), name='avito-account-delete'),
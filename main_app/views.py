@@ -1,47 +1,87 @@
 import json
 import logging
-import requests
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy
 from django.views.generic import CreateView, UpdateView, DeleteView
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.http import JsonResponse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 
-from .tasks import update_task_details
+from .tasks import update_task_details, refresh_account_balance, enrich_tasks
+from .item_index import (
+    get_item_index, get_index_error, request_index_refresh, is_stale, filter_items,
+)
 from .models import BiddingTask, UserProfile, TaskLog, AvitoAccount
-from .forms import BiddingTaskForm, AvitoAccountForm
-from .avito_api import get_avito_access_token, get_balances, get_user_ads, get_avito_user_id
+from .forms import BiddingTaskForm, AvitoAccountForm, BulkTaskItemForm
+from .scheduler import staggered_start_times
+from .schedule import compile_schedule
+from .strategies import BRACKET_RESET_FIELDS, reset_bracket
+from .bidding import BID_CYCLE_SECONDS
+from .ratelimit import wait_limit, RATE_LIMIT_WEB_MAX_WAIT
+from .avito_api import (
+    get_avito_access_token, get_user_ads, get_account_user_id,
+)
 
 logger = logging.getLogger(__name__)
 
+# Сколько аккаунтов опрашиваем одновременно при обновлении балансов по кнопке
+BALANCE_REFRESH_CONCURRENCY = getattr(settings, 'BALANCE_REFRESH_CONCURRENCY', 8)
+# По сколько объявлений проверяем already_added при отдаче NDJSON
+ITEMS_STREAM_CHUNK = 500
+
 
 # === СПИСОК АККАУНТОВ AVITO ===
 
 @login_required
 def avito_account_list(request):
+    # Балансы — из БД (обновляет периодическая задача refresh_balances),
+    # без запросов к Avito внутри запроса страницы
     accounts = AvitoAccount.objects.filter(user=request.user)
-    for acc in accounts:
-        token = get_avito_access_token(acc.avito_client_id, acc.avito_client_secret)
-        if token:
-            user_id = get_avito_user_id(token)
-            if user_id:
-                balances = get_balances(token, user_id)
-                acc.real_balance = balances.get('real', 0)
-                acc.bonus_balance = balances.get('bonus', 0)
-            else:
-                acc.real_balance = None
-                acc.bonus_balance = None
-        else:
-            acc.real_balance = None
-            acc.bonus_balance = None
-
     context = {'accounts': accounts}
     return render(request, 'main_app/avito_account_list.html', context)
 
 
+@login_required
+def api_refresh_balances(request):
+    """
+    Обновление балансов по кнопке: аккаунты опрашиваются параллельно,
+    каждый результат уходит строкой NDJSON, как только готов.
+    """
+    accounts = list(AvitoAccount.objects.filter(user=request.user))
+
+    def refresh(account):
+        try:
+            with wait_limit(RATE_LIMIT_WEB_MAX_WAIT):
+                return refresh_account_balance(account)
+        finally:
+            connection.close()  # соединение с БД этого потока пула
+
+    def stream():
+        if not accounts:
+            return
+        workers = min(BALANCE_REFRESH_CONCURRENCY, len(accounts))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(refresh, acc): acc for acc in accounts}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"[BALANCE] Аккаунт {futures[future].id}: {e}")
+                    result = {'id': futures[future].id, 'ok': False}
+                yield json.dumps(result) + "\n"
+
+    response = StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # === CRUD ДЛЯ АККАУНТОВ AVITO ===
 
 class AvitoAccountCreateView(LoginRequiredMixin, CreateView):
@@ -77,13 +117,14 @@ class AvitoAccountDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView
 # === AJAX: СПИСОК ОБЪЯВЛЕНИЙ ДЛЯ ВЫБРАННОГО АККАУНТА ===
 
 @login_required
+@wait_limit(RATE_LIMIT_WEB_MAX_WAIT)
 def get_ads_for_account(request, account_id):
     account = get_object_or_404(AvitoAccount, pk=account_id, user=request.user)
     token = get_avito_access_token(account.avito_client_id, account.avito_client_secret)
     if not token:
         return JsonResponse({'error': 'Не удалось получить токен Avito.'}, status=400)
 
-    ads = get_user_ads(token)
+    ads = get_user_ads(token, user_id=get_account_user_id(account, token))
     if ads is None:
         return JsonResponse({'error': 'Не удалось получить список объявлений.'}, status=400)
 
@@ -100,12 +141,6 @@ def task_list_view(request):
     
     accounts = AvitoAccount.objects.filter(user=request.user)
 
-    for task in tasks:
-        try:
-            task.schedule_list = json.loads(task.schedule)
-        except (json.JSONDecodeError, TypeError):
-            task.schedule_list = []
-    
     context = {
         'tasks': tasks,
         'accounts': accounts,
@@ -135,9 +170,16 @@ class TaskCreateUpdateView(LoginRequiredMixin, UpdateView):
     def form_valid(self, form):
         self.object = form.save(commit=False)
         self.object.user = self.request.user
-        self.object.schedule = self.request.POST.get('schedule', '[]')
         if not self.object.pk:
             self.object.title = f"Объявление №{self.object.ad_id}"
+        else:
+            if 'schedule' in form.changed_data:
+                # Задача могла спать до старого окна — пусть пересчитает по новому
+                self.object.next_run_at = timezone.now()
+            if BRACKET_RESET_FIELDS.intersection(form.changed_data):
+                # Найденная вилка ставок и спокойный интервал были для старых условий
+                reset_bracket(self.object)
+                self.object.poll_interval = None
         self.object.save()
         update_task_details.delay(self.object.id)
         return redirect(self.success_url)
@@ -176,14 +218,13 @@ def settings_view(request):
 def task_detail_view(request, pk):
     task = get_object_or_404(BiddingTask, pk=pk, avito_account__user=request.user)
     logs = task.logs.order_by('-timestamp')[:50]
-    
-    # Парсим расписание для отображения
-    try:
-        task.schedule_list = json.loads(task.schedule)
-    except (json.JSONDecodeError, TypeError):
-        task.schedule_list = []
-    
-    context = {'task': task, 'logs': logs}
+
+    context = {
+        'task': task,
+        'logs': logs,
+        'poll_minutes': max(task.poll_interval or BID_CYCLE_SECONDS,
+                            task.capacity_interval or 0) / 60,
+    }
     return render(request, 'main_app/task_detail.html', context)
 
 
@@ -217,8 +258,18 @@ def bulk_update_tasks(request):
         if 'bid_step' in data:
             update_fields['bid_step'] = data['bid_step']
         
+        if BRACKET_RESET_FIELDS.intersection(update_fields):
+            update_fields.update(bracket_low=None, bracket_high=None, poll_interval=None)
         if update_fields:
-            tasks.update(**update_fields)
+            try:
+                with transaction.atomic():
+                    tasks.update(**update_fields)
+            except IntegrityError:
+                return JsonResponse({
+                    'status': 'error',
+                    'message': 'Среди выбранных есть копия уже активной задачи '
+                               '(то же объявление в той же выдаче)'
+                }, status=400)
         
         return JsonResponse({
             'status': 'ok',
@@ -259,65 +310,56 @@ def bulk_delete_tasks(request):
 
 @login_required
 def api_account_items(request, account_id):
-    """API: список объявлений аккаунта Avito"""
-    from main_app.avito_api import get_avito_access_token
-    
+    """
+    API: объявления аккаунта из индекса (main_app/item_index.py).
+    ?q= — поиск по названию/адресу/ID, ?page=&per_page= — страницы,
+    ?format=ndjson — потоком: строка с мета-данными, затем по объявлению.
+    Пока индекса нет — 202 {"pending": true}, сборка идёт в фоне; если
+    сборка не удалась — 502 с ошибкой, новая попытка после ITEM_INDEX_ERROR_TTL.
+    """
     account = get_object_or_404(AvitoAccount, id=account_id, user=request.user)
-    token = get_avito_access_token(account.avito_client_id, account.avito_client_secret)
-    
-    if not token:
-        return JsonResponse({"error": "Не удалось получить токен"}, status=400)
-    
-    headers = {"Authorization": f"Bearer {token}"}
-    
-    all_items = []
-    page = 1
-    
-    while True:
-        resp = requests.get(
-            "https://api.avito.ru/core/v1/items",
-            headers=headers,
-            params={"per_page": 100, "page": page, "status": "active"},
-            timeout=15
+
+    index = get_item_index(account.id)
+    if index is None:
+        error = get_index_error(account.id)
+        if error:
+            return JsonResponse({"error": error, "items": [], "total": 0}, status=502)
+        request_index_refresh(account.id)
+        return JsonResponse({"pending": True, "items": [], "total": 0}, status=202)
+    if is_stale(index) or request.GET.get("refresh"):
+        request_index_refresh(account.id)
+
+    items = filter_items(index["items"], request.GET.get("q", ""))
+    total = len(items)
+    try:
+        per_page = max(0, int(request.GET.get("per_page", 0)))
+        page = max(1, int(request.GET.get("page", 1)))
+    except ValueError:
+        return JsonResponse({"error": "Неверные параметры страницы"}, status=400)
+    if per_page:
+        items = items[(page - 1) * per_page:page * per_page]
+
+    meta = {"total": total, "version": index["version"], "built_at": index["built_at"]}
+
+    def with_added(chunk):
+        # Уже добавленные — только среди отдаваемых объявлений
+        existing = set(
+            BiddingTask.objects.filter(
+                avito_account=account, ad_id__in=[item["id"] for item in chunk]
+            ).values_list("ad_id", flat=True)
         )
-        
-        if resp.status_code != 200:
-            break
-        
-        data = resp.json()
-        resources = data.get("resources", [])
-        
-        if not resources:
-            break
-        
-        all_items.extend(resources)
-        
-        if len(resources) < 100:
-            break
-        
-        page += 1
-    
-    # Убираем уже добавленные
-    existing_ad_ids = set(
-        BiddingTask.objects.filter(
-            avito_account=account
-        ).values_list("ad_id", flat=True)
-    )
-    
-    items = []
-    for item in all_items:
-        items.append({
-            "id": item["id"],
-            "title": item.get("title", ""),
-            "price": item.get("price", 0),
-            "url": item.get("url", ""),
-            "address": item.get("address", ""),
-            "category": item.get("category", {}).get("name", ""),
-            "status": item.get("status", ""),
-            "already_added": item["id"] in existing_ad_ids,
-        })
-    
-    return JsonResponse({"items": items, "total": len(items)})
+        return [dict(item, already_added=item["id"] in existing) for item in chunk]
+
+    if request.GET.get("format") == "ndjson":
+        def stream():
+            yield json.dumps(meta) + "\n"
+            for start in range(0, len(items), ITEMS_STREAM_CHUNK):
+                for item in with_added(items[start:start + ITEMS_STREAM_CHUNK]):
+                    yield json.dumps(item, ensure_ascii=False) + "\n"
+
+        return StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+
+    return JsonResponse({"items": with_added(items), **meta})
 
 
 @login_required
@@ -330,61 +372,94 @@ def add_task_page(request):
 @login_required
 @require_POST
 def api_add_tasks(request):
-    """API: массовое добавление задач"""
+    """
+    API: массовое добавление задач.
+
+    {"account_id": 1, "defaults": {...поля задачи...},
+     "items": [{"ad_id": ..., "title": ..., "search_url": ...}, ...]}
+
+    Каждое объявление проверяется формой BulkTaskItemForm (поля модели,
+    search_url обязателен — в items или в defaults), дубликаты по ключу
+    (объявление, выдача) отсекаются одним запросом, задачи создаются одним
+    bulk_create с разнесённым первым запуском. Проверка и вставка идут под
+    блокировкой строки аккаунта — одновременные запросы не создадут задачу
+    дважды; уникальный ключ в БД страхует остальные пути. Название и картинку подтягивает фоновая
+    задача enrich_tasks.
+    """
     try:
         data = json.loads(request.body)
     except json.JSONDecodeError:
         return JsonResponse({"success": False, "error": "Invalid JSON"}, status=400)
 
     account_id = data.get("account_id")
-    items = data.get("items", [])
+    items = data.get("items") or []
+    defaults = data.get("defaults") or {}
 
-    if not account_id or not items:
+    if not account_id or not isinstance(items, list) or not items or not isinstance(defaults, dict):
         return JsonResponse({"success": False, "error": "Нет данных"}, status=400)
 
     account = get_object_or_404(AvitoAccount, id=account_id, user=request.user)
 
-    created = 0
-    added_ids = []
-
+    base = {**BulkTaskItemForm.model_defaults(), **defaults}
+    errors = []
+    candidates = {}
     for item in items:
-        ad_id = item.get("ad_id")
-        if not ad_id:
+        if not isinstance(item, dict):
             continue
-
-        # Пропускаем дубликаты
-        if BiddingTask.objects.filter(avito_account=account, ad_id=ad_id).exists():
+        # url из индекса объявлений — страница самого объявления, не выдача:
+        # поиск позиции по ней всегда пуст, поэтому search_url только явный
+        fields = {**base, **item}
+        form = BulkTaskItemForm(data=fields)
+        if not form.is_valid():
+            errors.append({"ad_id": item.get("ad_id"), "errors": form.errors.get_json_data()})
             continue
-
-        task = BiddingTask.objects.create(
-            user=request.user,
-            avito_account=account,
-            ad_id=ad_id,
-            title=item.get("title", ""),
-            max_bid_kopecks=int(float(item.get("max_bid", 300)) * 100),
-            strategy=item.get("strategy", "match_position"),
-            target_position=int(item.get("target_position", 1)),
-            is_active=True,
+        # Повтор внутри запроса — берём первое вхождение
+        key = (form.cleaned_data["ad_id"], form.cleaned_data["search_url"])
+        candidates.setdefault(key, form)
+
+    with transaction.atomic():
+        AvitoAccount.objects.select_for_update().get(pk=account.pk)
+        existing = set(
+            BiddingTask.objects
+            .filter(avito_account=account, ad_id__in={ad_id for ad_id, _ in candidates})
+            .values_list("ad_id", "search_url")
         )
-
-        # Пробуем получить картинку через парсинг URL
-        url = item.get("url", "")
-        if url:
-            try:
-                from main_app.avito_api import get_item_info
-                token = get_avito_access_token(account.avito_client_id, account.avito_client_secret)
-                info = get_item_info(token, ad_id)
-                if info and info.get("image_url"):
-                    task.image_url = info["image_url"]
-                    task.save(update_fields=["image_url"])
-            except Exception:
-                pass
-
-        created += 1
-        added_ids.append(ad_id)
+        skipped = [ad_id for ad_id, url in candidates if (ad_id, url) in existing]
+        forms_to_create = [form for key, form in candidates.items() if key not in existing]
+
+        new_tasks = []
+        for form, start_at in zip(forms_to_create, staggered_start_times(len(forms_to_create))):
+            task = form.save(commit=False)
+            task.user = request.user
+            task.avito_account = account
+            task.next_run_at = start_at
+            task.schedule_bitmap = compile_schedule(task.schedule)
+            new_tasks.append(task)
+
+        inserted = []
+        if new_tasks:
+            BiddingTask.objects.bulk_create(new_tasks, batch_size=500, ignore_conflicts=True)
+            # ignore_conflicts не возвращает id и молча пропускает конфликты —
+            # созданные задачи перечитываем. Свою строку от успевшей раньше
+            # (создана другим путём) отличает разнесённый next_run_at
+            new_keys = {(task.ad_id, task.search_url, task.next_run_at) for task in new_tasks}
+            inserted = [
+                (task_id, ad_id) for task_id, ad_id, url, run_at in
+                BiddingTask.objects
+                .filter(avito_account=account, ad_id__in={key[0] for key in new_keys})
+                .values_list("id", "ad_id", "search_url", "next_run_at")
+                if (ad_id, url, run_at) in new_keys
+            ]
+
+    added_ids = [ad_id for _, ad_id in inserted]
+    if inserted:
+        enrich_tasks.delay([task_id for task_id, _ in inserted])
+        logger.info(f"[ADD] Аккаунт {account.id}: создано {len(inserted)} задач")
 
     return JsonResponse({
         "success": True,
-        "created": created,
+        "created": len(added_ids),
         "added_ids": added_ids,
-    })
\ No newline at end of file
+        "skipped": skipped,
+        "errors": errors,
+    })